@@ -13,15 +13,21 @@ Ou com gunicorn (produção):
 
 import os
 import json
+import threading
 from datetime import datetime, timezone
-import requests as http_requests
 import openai
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from firebase_admin import auth, firestore
 from google.cloud.firestore_v1.transforms import Increment
 from firestore_reader import FirestoreReader
-from fcm_sender import FCMSender
+from fcm_sender import FCMSender, tokens_para_remover
+from http_transport import get_transport
+from notification_queue import NotificationQueue
+from rate_limiter import PRIORIDADE_ALTA, PRIORIDADE_NORMAL
+from status_coalescer import StatusCoalescer
+from fcm_topics import TopicSubscriptions, topico_da_base
+from cache_backends import criar_cache
 from typing import Optional, Tuple
 
 app = Flask(__name__)
@@ -74,10 +80,34 @@ def initialize_services():
         
         reader = FirestoreReader(service_account_path)
         sender = FCMSender(service_account_path)
+        if reader.indice_papeis is not None:
+            reader.indice_papeis.ao_mudar(_invalidar_autorizacao_por_uids)
+            reader.indice_papeis.iniciar()  # hidrata em background o índice UID -> base
+        if reader.devolucoes_resumo is not None:
+            reader.devolucoes_resumo.observar()  # mantém bases/{baseId}/devolucoes_resumo/{yyyy-mm} em dia
+        if _modo_fila_padrao() or os.path.exists(NotificationQueue.caminho_padrao()):
+            get_fila()  # retoma jobs gravados antes de um reinício sem esperar a próxima requisição
         
         print("✅ Serviços inicializados")
 
 
+def _remover_tokens_invalidos(base_id: str, tokens: list, resultado: dict) -> int:
+    """
+    Após um broadcast, limpa no Firestore os tokens que o FCM rejeitou como mortos,
+    para que os próximos envios só incluam dispositivos ativos.
+    Registra a quantidade em resultado["tokens_removidos"].
+    """
+    removidos = 0
+    mortos = tokens_para_remover(tokens, resultado)
+    if mortos:
+        try:
+            removidos = reader.remover_tokens_invalidos(base_id, mortos)
+        except Exception as e:
+            print(f"⚠️ Erro ao remover tokens inválidos da base {base_id}: {e}")
+    resultado["tokens_removidos"] = removidos
+    return removidos
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Endpoint de health check (não inicializa FCM; servidor pode estar acordando)."""
@@ -96,11 +126,174 @@ def health_ready():
     """Verifica se o backend está pronto para enviar notificações (inicializa FCM). Útil para diagnóstico."""
     try:
         initialize_services()
-        return jsonify({"status": "ok", "ready": True, "message": "FCM inicializado"}), 200
+        return jsonify({
+            "status": "ok", "ready": True, "message": "FCM inicializado",
+            "token_oauth": sender.token_manager.stats(),
+            "rate_limiter": sender.rate_limiter.stats(),
+            "status_coalescer": coalescer.stats(),
+            "topicos": topicos.stats() if topicos is not None else None,
+            "diretorio": reader.diretorio.stats() if reader.diretorio is not None else None,
+            "indice_papeis": reader.indice_papeis.stats() if reader.indice_papeis is not None else None,
+            "cache_autorizacao": cache_autorizacao.stats(),
+        }), 200
     except Exception as e:
         return jsonify({"status": "error", "ready": False, "error": str(e)}), 500
 
 
+@app.route('/health/cache', methods=['GET'])
+def health_cache():
+    """Estado dos caches em memória: itens, bytes estimados, acertos/faltas e despejos."""
+    try:
+        initialize_services()
+        return jsonify({
+            "contexto_assistente": reader.cache_contexto.stats(),
+            "galpao": reader.cache_galpao.stats(),
+            "autorizacao": cache_autorizacao.stats(),
+            "superadmin_config": _cache_superadmin_config.stats(),
+            "devolucoes_resumo": reader.devolucoes_resumo.stats() if reader.devolucoes_resumo is not None else None,
+        }), 200
+    except Exception as e:
+        return jsonify({"status": "error", "error": str(e)}), 500
+
+
+@app.route('/health/transport', methods=['GET'])
+def health_transport():
+    """Estatísticas dos pools HTTP (FCM, OpenRouteService, OpenAI) para ajuste de HTTP_POOL_MAXSIZE."""
+    return jsonify({"status": "ok", "transport": get_transport().stats()}), 200
+
+
+# Campos obrigatórios de cada tipo de notificação (validados antes de processar ou enfileirar)
+_CAMPOS_NOTIFY = {
+    "motorista": ("baseId", "motoristaId", "title", "body"),
+    "base": ("baseId", "title", "body"),
+    "status-change": ("baseId", "motoristaId", "status"),
+}
+
+# Status e chamadas individuais passam na frente dos broadcasts (fila, cota FCM e conexões)
+_PRIORIDADE_NOTIFY = {
+    "motorista": PRIORIDADE_ALTA,
+    "base": PRIORIDADE_NORMAL,
+    "status-change": PRIORIDADE_ALTA,
+}
+
+fila: Optional[NotificationQueue] = None
+_fila_lock = threading.Lock()
+
+
+def _modo_fila_padrao() -> bool:
+    """True se NOTIFY_MODO_FILA=1 (todas as requisições usam a fila)."""
+    return os.getenv('NOTIFY_MODO_FILA', '').strip() in ('1', 'true', 'True')
+
+
+def _modo_fila() -> bool:
+    """
+    Modo fila: o endpoint grava um job e responde 202 com o jobId, sem esperar o FCM.
+    Ativado para todas as requisições com NOTIFY_MODO_FILA=1, ou por requisição com ?modo=fila.
+    """
+    modo = (request.args.get('modo') or '').strip().lower()
+    if modo:
+        return modo == 'fila'
+    return _modo_fila_padrao()
+
+
+def _processar_job(tipo: str, payload: dict) -> Tuple[dict, int]:
+    """Executa um job da fila (mesmo processamento do modo síncrono)."""
+    initialize_services()
+    return _PROCESSADORES_NOTIFY[tipo](payload)
+
+
+def get_fila() -> NotificationQueue:
+    """
+    Fila durável de notificações, com os workers iniciados na primeira chamada.
+    initialize_services() já chama ao subir quando o modo fila está ativo ou o arquivo da fila existe.
+    """
+    global fila
+    if fila is None:
+        with _fila_lock:
+            if fila is None:
+                nova = NotificationQueue()
+                nova.start_workers(_processar_job, int(os.getenv('NOTIFY_FILA_WORKERS') or 2))
+                fila = nova
+    return fila
+
+
+def _campo_preenchido(valor) -> bool:
+    """Campo obrigatório presente: texto só com espaços conta como vazio."""
+    if isinstance(valor, str):
+        return bool(valor.strip())
+    return bool(valor)
+
+
+def _responder_notify(tipo: str):
+    """
+    Valida o body e processa a notificação na hora (200) ou enfileira (202), conforme _modo_fila().
+    """
+    initialize_services()
+
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Body JSON é obrigatório"}), 400
+
+    # Mesmo critério dos processadores (status só com espaços é vazio): no modo fila o erro
+    # precisa sair aqui, não só depois do 202, dentro do job
+    campos = _CAMPOS_NOTIFY[tipo]
+    if not all(_campo_preenchido(data.get(c)) for c in campos):
+        return jsonify({"error": "Campos obrigatórios: " + ", ".join(campos)}), 400
+
+    if _modo_fila():
+        job_id = get_fila().enqueue(tipo, data, _PRIORIDADE_NOTIFY[tipo])
+        print(f"📥 Notificação {tipo} enfileirada: job {job_id}")
+        return jsonify({
+            "success": True,
+            "jobId": job_id,
+            "status": "pendente",
+            "statusUrl": f"/notify/jobs/{job_id}",
+        }), 202
+
+    resposta, http_status = _PROCESSADORES_NOTIFY[tipo](data)
+    return jsonify(resposta), http_status
+
+
+def _processar_notify_motorista(data: dict) -> Tuple[dict, int]:
+    """Envia a notificação de /notify/motorista. Retorna (resposta, http_status)."""
+    base_id = data.get('baseId')
+    motorista_id = data.get('motoristaId')
+    title = data.get('title')
+    body = data.get('body')
+    data_dict = data.get('data')
+    
+    # Buscar token do motorista
+    print(f"📖 Buscando token para motorista {motorista_id} na base {base_id}...")
+    token_info = reader.get_motorista_token(base_id, motorista_id)
+    
+    if not token_info:
+        print(f"❌ Motorista {motorista_id} não encontrado ou sem FCM token no Firestore")
+        return {
+            "error": f"Motorista {motorista_id} não encontrado ou sem FCM token. O motorista precisa fazer login no app para receber notificações."
+        }, 404
+    
+    # Enviar notificação
+    success, error = sender.send_to_token(
+        token=token_info['fcmToken'],
+        title=title,
+        body=body,
+        data=data_dict
+    )
+    
+    if success:
+        print(f"✅ Notificação enviada via FCM para {token_info.get('nome', motorista_id)}")
+        return {
+            "success": True,
+            "message": f"Notificação enviada para {token_info.get('nome', motorista_id)}",
+            "motorista": token_info.get('nome', 'N/A')
+        }, 200
+    else:
+        return {
+            "success": False,
+            "error": error or "Erro desconhecido ao enviar notificação"
+        }, 500
+
+
 @app.route('/notify/motorista', methods=['POST'])
 def notify_motorista():
     """
@@ -118,56 +311,11 @@ def notify_motorista():
             "rota": "S-7"
         }
     }
+
+    Com ?modo=fila (ou NOTIFY_MODO_FILA=1) responde 202 com jobId; ver /notify/jobs/<jobId>.
     """
     try:
-        initialize_services()
-        
-        # Validar dados da requisição
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "Body JSON é obrigatório"}), 400
-        
-        base_id = data.get('baseId')
-        motorista_id = data.get('motoristaId')
-        title = data.get('title')
-        body = data.get('body')
-        data_dict = data.get('data')
-        
-        if not all([base_id, motorista_id, title, body]):
-            return jsonify({
-                "error": "Campos obrigatórios: baseId, motoristaId, title, body"
-            }), 400
-        
-        # Buscar token do motorista
-        print(f"📖 Buscando token para motorista {motorista_id} na base {base_id}...")
-        token_info = reader.get_motorista_token(base_id, motorista_id)
-        
-        if not token_info:
-            print(f"❌ Motorista {motorista_id} não encontrado ou sem FCM token no Firestore")
-            return jsonify({
-                "error": f"Motorista {motorista_id} não encontrado ou sem FCM token. O motorista precisa fazer login no app para receber notificações."
-            }), 404
-        
-        # Enviar notificação
-        success, error = sender.send_to_token(
-            token=token_info['fcmToken'],
-            title=title,
-            body=body,
-            data=data_dict
-        )
-        
-        if success:
-            print(f"✅ Notificação enviada via FCM para {token_info.get('nome', motorista_id)}")
-            return jsonify({
-                "success": True,
-                "message": f"Notificação enviada para {token_info.get('nome', motorista_id)}",
-                "motorista": token_info.get('nome', 'N/A')
-            }), 200
-        else:
-            return jsonify({
-                "success": False,
-                "error": error or "Erro desconhecido ao enviar notificação"
-            }), 500
+        return _responder_notify("motorista")
     
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
@@ -178,6 +326,81 @@ def notify_motorista():
         return jsonify({"error": f"Erro interno: {str(e)}"}), 500
 
 
+topicos: Optional[TopicSubscriptions] = None
+
+
+def get_topicos() -> TopicSubscriptions:
+    """Inscrições dos tópicos por base (criadas na primeira chamada; requer initialize_services)."""
+    global topicos
+    if topicos is None:
+        topicos = TopicSubscriptions(sender)
+    return topicos
+
+
+def _modo_topico(data: dict) -> bool:
+    """
+    Broadcast por tópico FCM: "modoEnvio": "topico" no body, ou NOTIFY_BASE_TOPICO=1 para todas.
+    "modoEnvio": "tokens" força o envio por token.
+    """
+    modo = str(data.get('modoEnvio') or '').strip().lower()
+    if modo:
+        return modo == 'topico'
+    return os.getenv('NOTIFY_BASE_TOPICO', '').strip() in ('1', 'true', 'True')
+
+
+def _processar_notify_base(data: dict) -> Tuple[dict, int]:
+    """Envia a notificação de /notify/base. Retorna (resposta, http_status)."""
+    base_id = data.get('baseId')
+    title = data.get('title')
+    body = data.get('body')
+    data_dict = data.get('data')
+
+    if _modo_topico(data):
+        inscricoes = get_topicos()
+        inscricoes.observar_base(reader, base_id)
+        if inscricoes.pronta(base_id):
+            topico = topico_da_base(base_id)
+            envio = sender.send_to_topic(topico, title, body, data_dict)
+            if not envio['sucesso']:
+                return {
+                    "success": False,
+                    "error": envio['erro'] or "Erro desconhecido ao enviar notificação",
+                    "modoEnvio": "topico"
+                }, 500
+            return {
+                "success": True,
+                "message": f"Notificação enviada para o tópico {topico}",
+                "modoEnvio": "topico",
+                "topico": topico
+            }, 200
+        # Primeira sincronização do tópico ainda em andamento: este broadcast vai por token
+        print(f"⏳ Tópico da base {base_id} ainda sincronizando; enviando por token")
+    
+    # Buscar todos os tokens da base
+    tokens = reader.get_motoristas_tokens(base_id)
+    
+    if not tokens:
+        return {
+            "error": f"Nenhum token FCM encontrado para a base {base_id}"
+        }, 404
+    
+    # Enviar notificações
+    resultado = sender.send_to_multiple_tokens(
+        tokens=tokens,
+        title=title,
+        body=body,
+        data=data_dict
+    )
+    _remover_tokens_invalidos(base_id, tokens, resultado)
+    
+    return {
+        "success": True,
+        "message": f"Notificações enviadas para {resultado['sucessos']} motoristas",
+        "modoEnvio": "tokens",
+        "resultado": resultado
+    }, 200
+
+
 @app.route('/notify/base', methods=['POST'])
 def notify_base():
     """
@@ -192,46 +415,11 @@ def notify_base():
             "tipo": "escalacao"
         }
     }
+
+    Com ?modo=fila (ou NOTIFY_MODO_FILA=1) responde 202 com jobId; ver /notify/jobs/<jobId>.
     """
     try:
-        initialize_services()
-        
-        # Validar dados da requisição
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "Body JSON é obrigatório"}), 400
-        
-        base_id = data.get('baseId')
-        title = data.get('title')
-        body = data.get('body')
-        data_dict = data.get('data')
-        
-        if not all([base_id, title, body]):
-            return jsonify({
-                "error": "Campos obrigatórios: baseId, title, body"
-            }), 400
-        
-        # Buscar todos os tokens da base
-        tokens = reader.get_motoristas_tokens(base_id)
-        
-        if not tokens:
-            return jsonify({
-                "error": f"Nenhum token FCM encontrado para a base {base_id}"
-            }), 404
-        
-        # Enviar notificações
-        resultado = sender.send_to_multiple_tokens(
-            tokens=tokens,
-            title=title,
-            body=body,
-            data=data_dict
-        )
-        
-        return jsonify({
-            "success": True,
-            "message": f"Notificações enviadas para {resultado['sucessos']} motoristas",
-            "resultado": resultado
-        }), 200
+        return _responder_notify("base")
     
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
@@ -242,6 +430,168 @@ def notify_base():
         return jsonify({"error": f"Erro interno: {str(e)}"}), 500
 
 
+coalescer = StatusCoalescer()
+
+
+def _mensagem_admin(eventos: list) -> Tuple[str, str, dict]:
+    """Título, corpo e data do aviso aos admins para um ou vários motoristas."""
+    if len(eventos) == 1:
+        e = eventos[0]
+        admin_msg = (
+            f"{e['motoristaNome']} chegou ao galpão" if e['status'] == "CHEGUEI"
+            else f"{e['motoristaNome']} concluiu o carregamento"
+        )
+        return (
+            "📢 Atualização de Motorista",
+            admin_msg,
+            {"type": "motorista_update", "motoristaId": e['motoristaId'], "status": e['status']},
+        )
+
+    chegaram = [e['motoristaNome'] for e in eventos if e['status'] == "CHEGUEI"]
+    concluiram = [e['motoristaNome'] for e in eventos if e['status'] == "CONCLUIDO"]
+    linhas = []
+    if chegaram:
+        linhas.append(f"Chegaram ao galpão ({len(chegaram)}): {', '.join(chegaram)}")
+    if concluiram:
+        linhas.append(f"Concluíram o carregamento ({len(concluiram)}): {', '.join(concluiram)}")
+    # motoristaId/status do aviso mais recente, como no aviso individual que o app lê
+    ultimo = eventos[-1]
+    return (
+        f"📢 Atualização de {len(eventos)} Motoristas",
+        "\n".join(linhas),
+        {
+            "type": "motorista_update",
+            "motoristaId": ultimo['motoristaId'],
+            "status": ultimo['status'],
+            "motoristaIds": ",".join(e['motoristaId'] for e in eventos),
+        },
+    )
+
+
+def _enviar_digest_admins(base_id: str, eventos: list):
+    """Envia aos admins da base um único aviso com os status que chegaram durante o envio anterior."""
+    admin_tokens = reader.get_admins_tokens(base_id)
+    if not admin_tokens:
+        print(f"⚠️ Nenhum admin com FCM token na base {base_id}")
+        return
+
+    title, body, data_dict = _mensagem_admin(eventos)
+    resultado = sender.send_to_multiple_tokens(
+        tokens=admin_tokens,
+        title=title,
+        body=body,
+        data=data_dict,
+        prioridade=PRIORIDADE_ALTA
+    )
+    _remover_tokens_invalidos(base_id, admin_tokens, resultado)
+    print(f"✅ Notificação para {resultado['sucessos']} admin(s): {body}")
+
+
+def _enviar_status_change(base_id: str, motorista_id: str, status: str, motorista_nome: str) -> Tuple[str, bool]:
+    """
+    Notifica motorista e admins de uma mudança de status.
+
+    Returns:
+        (motorista_nome, entregue): entregue é False se o push ao motorista falhou
+    """
+    # Buscar nome do motorista se não fornecido
+    if not motorista_nome:
+        token_info = reader.get_motorista_token(base_id, motorista_id)
+        motorista_nome = (token_info or {}).get('nome', 'Motorista')
+
+    # Mensagens para o motorista (como na Cloud Function)
+    status_messages = {
+        "A_CAMINHO": "Você está a caminho do galpão",
+        "CHEGUEI": "Você chegou ao galpão. O admin foi notificado. Aguarde instruções.",
+        "PROXIMO": "Você está próximo",
+        "IR_ESTACIONAMENTO": "Vá para o ESTACIONAMENTO e aguarde",
+        "ESTACIONAMENTO": "Você está no estacionamento",
+        "CARREGANDO": "Subir agora para carregar",
+        "CONCLUIDO": "Carregamento concluído! Ótimo trabalho!",
+    }
+    mensagem_motorista = status_messages.get(status) or f"Status atualizado para {status}"
+
+    titulos = {
+        "IR_ESTACIONAMENTO": "🅿️ Chamada para Estacionamento",
+        "CARREGANDO": "🚚 Chamada para Carregamento",
+        "CONCLUIDO": "✅ Carregamento Concluído",
+        "CHEGUEI": "📍 Chegou ao Galpão",
+        "ESTACIONAMENTO": "🅿️ No Estacionamento",
+    }
+    titulo_motorista = titulos.get(status) or "📍 Status Atualizado"
+
+    # 1. Notificar motorista
+    entregue = True
+    token_info = reader.get_motorista_token(base_id, motorista_id)
+    if token_info:
+        entregue, error = sender.send_to_token(
+            token=token_info['fcmToken'],
+            title=titulo_motorista,
+            body=mensagem_motorista,
+            data={"type": "status_update", "status": status}
+        )
+        if entregue:
+            print(f"✅ Notificação enviada para motorista {motorista_nome} ({status})")
+        else:
+            print(f"⚠️ Falha ao notificar motorista: {error}")
+    else:
+        print(f"⚠️ Motorista {motorista_id} sem FCM token, pulando notificação")
+
+    # 2. Notificar admins em CHEGUEI e CONCLUIDO, dentro da requisição/job (avisos simultâneos da
+    #    mesma base saem juntos, ver StatusCoalescer.notificar_admins e _enviar_digest_admins)
+    status_para_admin = ["CHEGUEI", "CONCLUIDO"]
+    if status in status_para_admin:
+        # Falha no aviso aos admins não desfaz o push ao motorista, que já saiu: só registra,
+        # sem 500 nem cancelar (uma nova tentativa reenviaria o push ao motorista)
+        try:
+            coalescer.notificar_admins(
+                base_id,
+                {"motoristaId": motorista_id, "motoristaNome": motorista_nome, "status": status},
+                _enviar_digest_admins
+            )
+        except Exception as e:
+            print(f"⚠️ Falha ao notificar admins da base {base_id} ({status} de {motorista_nome}): {e}")
+
+    return motorista_nome, entregue
+
+
+def _processar_notify_status_change(data: dict) -> Tuple[dict, int]:
+    """Envia as notificações de /notify/status-change. Retorna (resposta, http_status)."""
+    base_id = data.get('baseId')
+    motorista_id = data.get('motoristaId')
+    status = (data.get('status') or '').strip()
+    motorista_nome = (data.get('motoristaNome') or '').strip()
+
+    if not all([base_id, motorista_id, status]):
+        return {
+            "error": "Campos obrigatórios: baseId, motoristaId, status"
+        }, 400
+
+    # Mesmo status repetido pelo app (ou geofence oscilando) dentro da janela: não notifica de novo
+    if not coalescer.registrar(base_id, motorista_id, status):
+        print(f"⏭️ Status {status} repetido para motorista {motorista_id}; notificação ignorada")
+        return {
+            "success": True,
+            "message": f"Status {status} repetido em menos de {coalescer.janela_repeticao:.0f}s; notificação ignorada",
+            "coalescido": True
+        }, 200
+
+    try:
+        motorista_nome, entregue = _enviar_status_change(base_id, motorista_id, status, motorista_nome)
+    except Exception:
+        coalescer.cancelar(base_id, motorista_id, status)
+        raise
+    if not entregue:
+        # Push ao motorista falhou: a próxima tentativa dentro da janela não pode ser descartada
+        coalescer.cancelar(base_id, motorista_id, status)
+
+    return {
+        "success": True,
+        "message": f"Notificações de status {status} processadas",
+        "motoristaNome": motorista_nome
+    }, 200
+
+
 @app.route('/notify/status-change', methods=['POST'])
 def notify_status_change():
     """
@@ -255,90 +605,11 @@ def notify_status_change():
         "status": "CHEGUEI",
         "motoristaNome": "João Silva"  // opcional; se vazio, busca no Firestore
     }
+
+    Com ?modo=fila (ou NOTIFY_MODO_FILA=1) responde 202 com jobId; ver /notify/jobs/<jobId>.
     """
     try:
-        initialize_services()
-
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "Body JSON é obrigatório"}), 400
-
-        base_id = data.get('baseId')
-        motorista_id = data.get('motoristaId')
-        status = (data.get('status') or '').strip()
-        motorista_nome = (data.get('motoristaNome') or '').strip()
-
-        if not all([base_id, motorista_id, status]):
-            return jsonify({
-                "error": "Campos obrigatórios: baseId, motoristaId, status"
-            }), 400
-
-        # Buscar nome do motorista se não fornecido
-        if not motorista_nome:
-            token_info = reader.get_motorista_token(base_id, motorista_id)
-            motorista_nome = (token_info or {}).get('nome', 'Motorista')
-
-        # Mensagens para o motorista (como na Cloud Function)
-        status_messages = {
-            "A_CAMINHO": "Você está a caminho do galpão",
-            "CHEGUEI": "Você chegou ao galpão. O admin foi notificado. Aguarde instruções.",
-            "PROXIMO": "Você está próximo",
-            "IR_ESTACIONAMENTO": "Vá para o ESTACIONAMENTO e aguarde",
-            "ESTACIONAMENTO": "Você está no estacionamento",
-            "CARREGANDO": "Subir agora para carregar",
-            "CONCLUIDO": "Carregamento concluído! Ótimo trabalho!",
-        }
-        mensagem_motorista = status_messages.get(status) or f"Status atualizado para {status}"
-
-        titulos = {
-            "IR_ESTACIONAMENTO": "🅿️ Chamada para Estacionamento",
-            "CARREGANDO": "🚚 Chamada para Carregamento",
-            "CONCLUIDO": "✅ Carregamento Concluído",
-            "CHEGUEI": "📍 Chegou ao Galpão",
-            "ESTACIONAMENTO": "🅿️ No Estacionamento",
-        }
-        titulo_motorista = titulos.get(status) or "📍 Status Atualizado"
-
-        # 1. Notificar motorista
-        token_info = reader.get_motorista_token(base_id, motorista_id)
-        if token_info:
-            success, error = sender.send_to_token(
-                token=token_info['fcmToken'],
-                title=titulo_motorista,
-                body=mensagem_motorista,
-                data={"type": "status_update", "status": status}
-            )
-            if success:
-                print(f"✅ Notificação enviada para motorista {motorista_nome} ({status})")
-            else:
-                print(f"⚠️ Falha ao notificar motorista: {error}")
-        else:
-            print(f"⚠️ Motorista {motorista_id} sem FCM token, pulando notificação")
-
-        # 2. Notificar admins em CHEGUEI e CONCLUIDO
-        status_para_admin = ["CHEGUEI", "CONCLUIDO"]
-        if status in status_para_admin:
-            admin_msg = (
-                f"{motorista_nome} chegou ao galpão" if status == "CHEGUEI"
-                else f"{motorista_nome} concluiu o carregamento"
-            )
-            admin_tokens = reader.get_admins_tokens(base_id)
-            if admin_tokens:
-                resultado = sender.send_to_multiple_tokens(
-                    tokens=admin_tokens,
-                    title="📢 Atualização de Motorista",
-                    body=admin_msg,
-                    data={"type": "motorista_update", "motoristaId": motorista_id, "status": status}
-                )
-                print(f"✅ Notificação para {resultado['sucessos']} admin(s): {admin_msg}")
-            else:
-                print(f"⚠️ Nenhum admin com FCM token na base {base_id}")
-
-        return jsonify({
-            "success": True,
-            "message": f"Notificações de status {status} processadas",
-            "motoristaNome": motorista_nome
-        }), 200
+        return _responder_notify("status-change")
 
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
@@ -349,6 +620,25 @@ def notify_status_change():
         return jsonify({"error": str(e)}), 500
 
 
+_PROCESSADORES_NOTIFY = {
+    "motorista": _processar_notify_motorista,
+    "base": _processar_notify_base,
+    "status-change": _processar_notify_status_change,
+}
+
+
+@app.route('/notify/jobs/<job_id>', methods=['GET'])
+def notify_job_status(job_id: str):
+    """Status de uma notificação enfileirada (pendente, processando, concluido ou falhou)."""
+    try:
+        job = get_fila().get(job_id)
+        if not job:
+            return jsonify({"error": f"Job {job_id} não encontrado"}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno: {str(e)}"}), 500
+
+
 @app.route('/motorista/token', methods=['GET'])
 def get_motorista_token():
     """
@@ -396,6 +686,80 @@ def _uid_is_superadmin(uid: str) -> bool:
     return uid in allowed
 
 
+# Decisões de autorização de /location/*: papel resolvido por (uid, baseId).
+# Um motorista consultando localização repetidamente não faz leituras no Firestore para autorização.
+PAPEIS_LOCALIZACAO = ('admin', 'superadmin', 'auxiliar', 'ajudante')
+AUTH_CACHE_TTL_NEGATIVO_S = float(os.getenv('AUTH_CACHE_TTL_NEGATIVO_S') or 30)
+cache_autorizacao = criar_cache(
+    'autorizacao',
+    max_itens=int(os.getenv('AUTH_CACHE_MAX_ITENS') or 10000),
+    ttl_segundos=float(os.getenv('AUTH_CACHE_TTL_S') or 300),
+)
+# sistema/config.superadminUids (uma leitura por TTL, compartilhada por todos os UIDs)
+_SEM_DECISAO = object()
+_CHAVE_SUPERADMIN_CONFIG = ('sistema/config', 'superadminUids')
+_cache_superadmin_config = criar_cache(
+    'superadmin_config', max_itens=1, ttl_segundos=float(os.getenv('AUTH_CACHE_SUPERADMIN_TTL_S') or 60)
+)
+
+
+def _superadmin_uids_config() -> list:
+    return _cache_superadmin_config.obter_ou_calcular(
+        _CHAVE_SUPERADMIN_CONFIG,
+        lambda: sorted(set(reader.get_superadmin_uids_from_config() or []))
+    )
+
+
+def _resolver_papel(uid: str, base_id: str) -> Optional[str]:
+    """
+    Papel de uid para base_id: papel na base, em qualquer base, SUPERADMIN_UIDS ou sistema/config.
+    A decisão fica em cache_autorizacao (negativas com TTL menor, para liberar acesso rápido).
+    """
+    chave = (uid, base_id)
+    papel = cache_autorizacao.get(chave, _SEM_DECISAO)
+    if papel is not _SEM_DECISAO:
+        return papel
+    papel = reader.get_usuario_papel(base_id, uid) or reader.get_usuario_papel_in_any_base(uid)
+    if not papel and (_uid_is_superadmin(uid) or uid in _superadmin_uids_config()):
+        papel = 'superadmin'
+    ttl = None if papel in PAPEIS_LOCALIZACAO else AUTH_CACHE_TTL_NEGATIVO_S
+    cache_autorizacao.set(chave, papel, ttl)
+    return papel
+
+
+def _e_superadmin(uid: str) -> bool:
+    """Superadmin: SUPERADMIN_UIDS, sistema/config.superadminUids ou papel superadmin numa base."""
+    if _uid_is_superadmin(uid) or uid in _superadmin_uids_config():
+        return True
+    return str(reader.get_usuario_papel_in_any_base(uid) or '').strip().lower() == 'superadmin'
+
+
+def invalidar_cache_autorizacao(uid: Optional[str] = None, base_id: Optional[str] = None) -> int:
+    """
+    Descarta decisões em cache (de um UID, de uma base, de ambos, ou todas se nenhum for informado).
+    Sem filtros, também descarta a lista de superadmins de sistema/config.
+
+    Returns:
+        Quantidade de decisões descartadas
+    """
+    if uid is None and base_id is None:
+        _cache_superadmin_config.limpar()
+        quantidade = len(cache_autorizacao)
+        cache_autorizacao.limpar()
+        return quantidade
+    return cache_autorizacao.invalidar_onde(
+        lambda chave: (uid is None or chave[0] == uid) and (base_id is None or chave[1] == base_id)
+    )
+
+
+def _invalidar_autorizacao_por_uids(uids):
+    """Callback do RoleIndex: papel/vínculo mudou (uids=None: índice recarregado)."""
+    if uids is None:
+        cache_autorizacao.limpar()
+        return
+    cache_autorizacao.invalidar_onde(lambda chave: chave[0] in uids)
+
+
 def _verify_firebase_token():
     """Verifica Authorization: Bearer <idToken>. Retorna (uid, None) ou (None, error_tuple)."""
     auth_header = request.headers.get('Authorization')
@@ -430,14 +794,8 @@ def location_request():
         motorista_id = data.get('motoristaId')
         if not base_id or not motorista_id:
             return jsonify({"error": "baseId e motoristaId são obrigatórios"}), 400
-        papel = reader.get_usuario_papel(base_id, uid)
-        if not papel:
-            papel = reader.get_usuario_papel_in_any_base(uid)
-        if not papel and _uid_is_superadmin(uid):
-            papel = 'superadmin'
-        if not papel and uid in (reader.get_superadmin_uids_from_config() or []):
-            papel = 'superadmin'
-        if not papel or papel not in ('admin', 'superadmin', 'auxiliar', 'ajudante'):
+        papel = _resolver_papel(uid, base_id)
+        if not papel or papel not in PAPEIS_LOCALIZACAO:
             uids_env = (os.getenv('SUPERADMIN_UIDS') or '').strip()
             uid_suffix = uid[-6:] if len(uid) >= 6 else uid
             print(f"location/request 403: uid_fim={uid_suffix} papel={papel} SUPERADMIN_UIDS_definido={bool(uids_env)}")
@@ -498,12 +856,8 @@ def location_receive():
             return jsonify({"error": "lat e lng devem ser números"}), 400
         # Motorista envia sua própria localização; admin/superadmin pode enviar em nome do motorista (mesmo aparelho/teste)
         if uid != motorista_id:
-            papel = reader.get_usuario_papel(base_id, uid) or reader.get_usuario_papel_in_any_base(uid)
-            if not papel and _uid_is_superadmin(uid):
-                papel = 'superadmin'
-            if not papel and uid in (reader.get_superadmin_uids_from_config() or []):
-                papel = 'superadmin'
-            if not papel or papel not in ('admin', 'superadmin', 'auxiliar', 'ajudante'):
+            papel = _resolver_papel(uid, base_id)
+            if not papel or papel not in PAPEIS_LOCALIZACAO:
                 return jsonify({"error": "Apenas o motorista pode enviar sua localização"}), 403
         galpao = reader.get_galpao_coordenadas(base_id)
         if not galpao:
@@ -521,7 +875,7 @@ def location_receive():
             return jsonify({"ok": False, "error": "Serviço indisponível"}), 500
         url = "https://api.openrouteservice.org/v2/directions/driving-car"
         payload = {"coordinates": [[lng, lat], [galpao["lng"], galpao["lat"]]]}
-        resp = http_requests.post(url, json=payload, headers={"Authorization": ors_key, "Content-Type": "application/json"}, timeout=15)
+        resp = get_transport().post(url, json=payload, headers={"Authorization": ors_key, "Content-Type": "application/json"}, timeout=15)
         if resp.status_code != 200:
             reader.write_location_response(base_id, motorista_id, {
                 "status": "error", "error": "Erro ao calcular rota",
@@ -551,6 +905,93 @@ def location_receive():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/autorizacao/invalidar', methods=['POST'])
+def autorizacao_invalidar():
+    """
+    Descarta as decisões de autorização em cache depois que o app muda papéis ou vínculos
+    (necessário quando o índice de papéis está desligado; com ele ligado, a invalidação já é automática).
+    Body: {"uid": opcional, "baseId": opcional}. Admin/superadmin da base invalida a base informada;
+    sem baseId (todas as bases) só superadmin.
+    """
+    try:
+        initialize_services()
+        uid, err = _verify_firebase_token()
+        if err:
+            return jsonify(err[0]), err[1]
+        data = request.get_json(silent=True) or {}
+        alvo_uid = (data.get('uid') or '').strip() or None
+        base_id = (data.get('baseId') or '').strip() or None
+        if not _e_superadmin(uid):
+            if not base_id or str(reader.get_usuario_papel(base_id, uid) or '').strip().lower() != 'admin':
+                return jsonify({"error": "Apenas admin da base ou superadmin podem invalidar autorizações"}), 403
+        invalidadas = invalidar_cache_autorizacao(alvo_uid, base_id)
+        print(f"🔓 Autorizações em cache descartadas por {uid}: {invalidadas} (uid={alvo_uid}, baseId={base_id})")
+        return jsonify({"ok": True, "invalidadas": invalidadas}), 200
+    except Exception as e:
+        print(f"❌ Erro autorizacao/invalidar: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/devolucoes/resumo', methods=['GET'])
+def devolucoes_resumo():
+    """
+    Resumo de devoluções do mês de uma base (relatórios): totais por dia, semana e motorista,
+    devoluções recentes e tendência semanal. Um documento lido, em vez das devoluções do mês.
+    Query: baseId (obrigatório), mes=yyyy-mm (padrão: mês atual).
+    """
+    try:
+        initialize_services()
+        uid, err = _verify_firebase_token()
+        if err:
+            return jsonify(err[0]), err[1]
+        base_id = request.args.get('baseId')
+        mes = request.args.get('mes') or datetime.now(timezone.utc).strftime('%Y-%m')
+        if not base_id:
+            return jsonify({"error": "baseId é obrigatório"}), 400
+        try:
+            datetime.strptime(mes, '%Y-%m')
+        except ValueError:
+            return jsonify({"error": "mes deve estar no formato yyyy-mm"}), 400
+        papel = _resolver_papel(uid, base_id)
+        if not papel or papel not in PAPEIS_LOCALIZACAO:
+            return jsonify({"error": "Apenas admin, superadmin, auxiliar ou ajudante podem ver o resumo de devoluções"}), 403
+        if reader.devolucoes_resumo is None:
+            return jsonify({"error": "Resumo de devoluções desligado (DEVOLUCOES_RESUMO=0)"}), 503
+        resumo = reader.devolucoes_resumo.resumo(base_id, mes)
+        if resumo is None:
+            return jsonify({"error": "Sem resumo para este mês", "baseId": base_id, "mes": mes}), 404
+        resumo.pop('aplicadas', None)  # resumos da versão 1, ainda não reconstruídos
+        return jsonify({"ok": True, "baseId": base_id, **resumo}), 200
+    except Exception as e:
+        print(f"❌ Erro devolucoes/resumo: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/superadmin/motoristas', methods=['GET'])
+def superadmin_motoristas():
+    """
+    Visão do superadmin: motoristas ativos por base, no total e por modalidade.
+    Cada base custa agregações count() (ou nada, se o diretório dela está em memória), não o download dos motoristas.
+    """
+    try:
+        initialize_services()
+        uid, err = _verify_firebase_token()
+        if err:
+            return jsonify(err[0]), err[1]
+        if not _e_superadmin(uid):
+            return jsonify({"error": "Apenas superadmin pode ver a visão geral das bases"}), 403
+        bases = reader.resumo_motoristas_por_base()
+        totais = {}
+        for base in bases:
+            for chave, valor in base.items():
+                if isinstance(valor, int):
+                    totais[chave] = totais.get(chave, 0) + valor
+        return jsonify({"ok": True, "bases": bases, "totais": totais}), 200
+    except Exception as e:
+        print(f"❌ Erro superadmin/motoristas: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 # Prompt de sistema compartilhado pelo assistente (mesmo para texto e visão)
 _SYSTEM_PROMPT = (
     "IMPORTANTE: Nunca responda com JSON, códigos ou estruturas técnicas. O usuário deve ver APENAS texto em português. "
@@ -610,6 +1051,19 @@ _SYSTEM_PROMPT = (
 )
 
 
+_openai_client: Optional[openai.OpenAI] = None
+_openai_client_key: Optional[str] = None
+
+
+def _get_openai_client(api_key: str) -> openai.OpenAI:
+    """Cliente OpenAI reaproveitado entre chamadas, sobre o pool keep-alive compartilhado."""
+    global _openai_client, _openai_client_key
+    if _openai_client is None or _openai_client_key != api_key:
+        _openai_client = openai.OpenAI(api_key=api_key, http_client=get_transport().httpx_client())
+        _openai_client_key = api_key
+    return _openai_client
+
+
 def _assistente_via_openai(text: str, image_b64: Optional[str], context_base: Optional[str] = None, history: Optional[list] = None, user_name: str = "Usuário", user_role: str = "Membro", turno: Optional[str] = None) -> Optional[str]:
     """Usa OpenAI GPT-4o-mini. Suporta visão (imagem base64) + texto e histórico de conversa."""
     api_key = os.getenv('OPENAI_API_KEY')
@@ -617,7 +1071,7 @@ def _assistente_via_openai(text: str, image_b64: Optional[str], context_base: Op
         print("OPENAI_API_KEY não configurada.")
         return None
 
-    client = openai.OpenAI(api_key=api_key)
+    client = _get_openai_client(api_key)
     model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
     prompt = text or "Descreva o que está nesta imagem. Se for uma escala (lista de nomes com vagas e rotas), extraia cada motorista com vaga e rota, agrupando por ondas se houver."
 
@@ -843,9 +1297,11 @@ if __name__ == '__main__':
     print("=" * 60)
     print("\n📡 Endpoints disponíveis:")
     print("   GET  /health                    - Health check")
+    print("   GET  /health/transport          - Estatísticas dos pools HTTP")
     print("   POST /notify/motorista          - Notificar motorista específico")
     print("   POST /notify/base               - Notificar todos da base")
     print("   POST /notify/status-change      - Notificar mudança de status (motorista + admins)")
+    print("   GET  /notify/jobs/<jobId>       - Status de notificação enfileirada (?modo=fila)")
     print("   GET  /motorista/token           - Verificar token de motorista")
     print("   POST /location/request          - Pedir localização/ETA (admin)")
     print("   POST /location/receive          - Receber coordenadas (motorista)")
@@ -0,0 +1,215 @@
+"""
+base_directory.py
+
+Diretório em memória das pessoas de cada base (subcoleções motoristas e usuarios).
+
+Cada base é hidratada uma vez por um listener (on_snapshot) do Firestore, que depois mantém
+o diretório atualizado a cada mudança. Com o diretório quente, get_motoristas_tokens,
+get_admins_tokens, get_motorista_token e get_usuario_papel respondem da memória,
+sem leituras no Firestore. Enquanto a base hidrata, as consultas leem direto do Firestore
+(nenhuma requisição espera o listener).
+
+Só os campos usados pelo backend ficam em memória (CAMPOS_DIRETORIO).
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+
+COLECOES_DIRETORIO = ('usuarios', 'motoristas')
+CAMPOS_DIRETORIO = ('nome', 'papel', 'authUid', 'fcmToken', 'modalidade', 'ativo')
+
+
+def _entrada(doc) -> Dict[str, Any]:
+    data = doc.to_dict() or {}
+    entrada = {campo: data.get(campo) for campo in CAMPOS_DIRETORIO}
+    entrada['id'] = doc.id
+    return entrada
+
+
+class DiretorioDaBase:
+    """Pessoas de uma base, por coleção, indexadas por ID do documento e por authUid."""
+
+    def __init__(self, base_id: str, ao_mudar: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            base_id: ID da base
+            ao_mudar: Chamado com o nome da coleção a cada snapshot com mudanças
+        """
+        self.base_id = base_id
+        self.ao_mudar = ao_mudar
+        self._lock = threading.Lock()
+        self._docs: Dict[str, Dict[str, Dict[str, Any]]] = {col: {} for col in COLECOES_DIRETORIO}
+        self._por_auth_uid: Dict[str, Dict[str, str]] = {col: {} for col in COLECOES_DIRETORIO}
+        self._hidratadas = {col: threading.Event() for col in COLECOES_DIRETORIO}
+        self.watches: Dict[str, Any] = {}
+
+    def _indexar(self, col: str, entrada: Dict[str, Any]):
+        self._remover(col, entrada['id'])
+        self._docs[col][entrada['id']] = entrada
+        if entrada.get('authUid'):
+            self._por_auth_uid[col][entrada['authUid']] = entrada['id']
+
+    def _remover(self, col: str, doc_id: str):
+        anterior = self._docs[col].pop(doc_id, None)
+        if anterior and anterior.get('authUid'):
+            if self._por_auth_uid[col].get(anterior['authUid']) == doc_id:
+                del self._por_auth_uid[col][anterior['authUid']]
+
+    def aplicar_snapshot(self, col: str, docs, changes):
+        """Callback do on_snapshot: o primeiro snapshot carrega tudo, os seguintes só as mudanças."""
+        with self._lock:
+            if not self._hidratadas[col].is_set():
+                self._docs[col] = {}
+                self._por_auth_uid[col] = {}
+                for doc in docs:
+                    self._indexar(col, _entrada(doc))
+            else:
+                for change in changes:
+                    if change.type.name == 'REMOVED':
+                        self._remover(col, change.document.id)
+                    else:
+                        self._indexar(col, _entrada(change.document))
+        self._hidratadas[col].set()
+        if changes and self.ao_mudar is not None:
+            try:
+                self.ao_mudar(col)
+            except Exception as e:
+                print(f"⚠️ Erro no callback do diretório da base {self.base_id}: {e}")
+
+    def hidratado(self) -> bool:
+        """True se o primeiro snapshot de todas as coleções já chegou."""
+        return all(evento.is_set() for evento in self._hidratadas.values())
+
+    def ativo(self) -> bool:
+        """False se algum listener parou (o diretório deixaria de receber mudanças)."""
+        return all(getattr(w, 'is_active', True) for w in self.watches.values())
+
+    def encerrar(self):
+        for watch in self.watches.values():
+            try:
+                watch.unsubscribe()
+            except Exception:
+                pass
+
+    def listar(self, col: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._docs[col].values())
+
+    def documento(self, col: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._docs[col].get(doc_id)
+
+    def por_auth_uid(self, col: str, auth_uid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            doc_id = self._por_auth_uid[col].get(auth_uid)
+            return self._docs[col].get(doc_id) if doc_id else None
+
+    def tamanho(self) -> Dict[str, int]:
+        with self._lock:
+            return {col: len(docs) for col, docs in self._docs.items()}
+
+
+class BaseDirectory:
+    """
+    Diretórios das bases em uso, com no máximo max_bases listeners ativos
+    (a base usada há mais tempo é descartada primeiro).
+    """
+
+    MAX_BASES_PADRAO = 50
+
+    def __init__(self, db, max_bases: Optional[int] = None):
+        """
+        Args:
+            db: Cliente do Firestore
+            max_bases: Bases mantidas em memória (se None, usa FIRESTORE_DIRETORIO_MAX_BASES ou MAX_BASES_PADRAO)
+        """
+        if max_bases is None:
+            max_bases = int(os.getenv('FIRESTORE_DIRETORIO_MAX_BASES') or self.MAX_BASES_PADRAO)
+        self.db = db
+        self.max_bases = max(1, max_bases)
+
+        self._lock = threading.Lock()
+        self._bases: "OrderedDict[str, DiretorioDaBase]" = OrderedDict()
+        self._ao_mudar: List[Callable[[str, str], None]] = []
+
+        self.consultas = 0
+        self.hidratacoes = 0
+        self.indisponivel = 0
+        self.descartes = 0
+
+    def ao_mudar(self, callback: Callable[[str, str], None]):
+        """Registra callback(base_id, colecao), chamado quando uma coleção de uma base observada muda."""
+        with self._lock:
+            self._ao_mudar.append(callback)
+
+    def _notificar(self, base_id: str, col: str):
+        for callback in list(self._ao_mudar):
+            callback(base_id, col)
+
+    def _observar(self, base_id: str) -> DiretorioDaBase:
+        diretorio = DiretorioDaBase(base_id, ao_mudar=lambda col: self._notificar(base_id, col))
+        base_ref = self.db.collection('bases').document(base_id)
+        for col in COLECOES_DIRETORIO:
+            diretorio.watches[col] = base_ref.collection(col).on_snapshot(
+                lambda docs, changes, read_time, col=col: diretorio.aplicar_snapshot(col, docs, changes)
+            )
+        return diretorio
+
+    def se_hidratado(self, base_id: str) -> Optional[DiretorioDaBase]:
+        """
+        Diretório da base só se já estiver em memória e hidratado. Nunca cria listener
+        nem mexe na ordem de descarte (para varreduras de todas as bases, como a do superadmin).
+        """
+        with self._lock:
+            diretorio = self._bases.get(base_id)
+        if diretorio is None or not diretorio.ativo() or not diretorio.hidratado():
+            return None
+        return diretorio
+
+    def get(self, base_id: str) -> Optional[DiretorioDaBase]:
+        """
+        Diretório hidratado da base (cria o listener na primeira chamada). Não espera a hidratação.
+
+        Returns:
+            DiretorioDaBase, ou None enquanto a base ainda hidrata (o chamador lê direto do Firestore)
+        """
+        descartados = []
+        with self._lock:
+            self.consultas += 1
+            diretorio = self._bases.get(base_id)
+            if diretorio is not None and not diretorio.ativo():
+                descartados.append(self._bases.pop(base_id))
+                diretorio = None
+            if diretorio is None:
+                self.hidratacoes += 1
+                diretorio = self._bases[base_id] = self._observar(base_id)
+                print(f"👀 Hidratando diretório da base {base_id} em background; leitura direta até lá")
+                while len(self._bases) > self.max_bases:
+                    descartados.append(self._bases.popitem(last=False)[1])
+                    self.descartes += 1
+            else:
+                self._bases.move_to_end(base_id)
+
+        for antigo in descartados:
+            antigo.encerrar()
+
+        if not diretorio.hidratado():
+            with self._lock:
+                self.indisponivel += 1
+            return None
+        return diretorio
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            bases = {base_id: d.tamanho() for base_id, d in self._bases.items()}
+            return {
+                "max_bases": self.max_bases,
+                "bases": bases,
+                "consultas": self.consultas,
+                "hidratacoes": self.hidratacoes,
+                "indisponivel": self.indisponivel,
+                "descartes": self.descartes,
+            }
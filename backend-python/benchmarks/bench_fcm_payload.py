@@ -0,0 +1,53 @@
+"""
+bench_fcm_payload.py
+
+Micro-benchmark da montagem do corpo das mensagens de broadcast:
+mensagem montada e serializada por destinatário (_build_message + _encode_message)
+versus template pré-serializado (MessageTemplate.render), que só troca o token.
+
+Não precisa de Service Account nem de rede.
+
+Uso:
+    python benchmarks/bench_fcm_payload.py [quantidade_tokens] [repeticoes]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fcm_sender import FCMSender  # noqa: E402
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    # Só os métodos de montagem são usados: dispensa credenciais
+    sender = FCMSender.__new__(FCMSender)
+    tokens = [f"dEvIcE{i:05d}:APA91b" + "x" * 140 for i in range(quantidade)]
+    title = "🚛 Você foi escalado!"
+    body = "Você está escalado! Siga para o galpão e aguarde instruções."
+    data = {"tipo": "escalacao", "baseId": "xvtFbdOurhdNKVY08rDw", "onda": 2, "vaga": "01", "rota": "S-7"}
+
+    def por_destinatario():
+        return [sender._encode_message(sender._build_message(t, title, body, data)) for t in tokens]
+
+    def com_template():
+        template = sender._build_template(title, body, data)
+        return [template.render(t) for t in tokens]
+
+    assert por_destinatario() == com_template(), "payloads do template diferem da serialização completa"
+
+    t_completo = min(timeit.repeat(por_destinatario, number=1, repeat=repeticoes))
+    t_template = min(timeit.repeat(com_template, number=1, repeat=repeticoes))
+
+    print(f"📦 {quantidade} mensagens (melhor de {repeticoes} execuções)")
+    print(f"   Serialização por destinatário: {t_completo * 1000:8.2f} ms ({t_completo / quantidade * 1e6:6.2f} µs/msg)")
+    print(f"   Template pré-serializado:      {t_template * 1000:8.2f} ms ({t_template / quantidade * 1e6:6.2f} µs/msg)")
+    print(f"   Ganho: {t_completo / t_template:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
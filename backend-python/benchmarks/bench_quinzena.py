@@ -0,0 +1,90 @@
+"""
+bench_quinzena.py
+
+Benchmark do cálculo das quinzenas de um mês inteiro de escalas:
+percorrer todas as escalas para cada motorista (como uma marcação por motorista faria)
+versus a matriz motorista x dia do QuinzenaEngine (calcular_quinzenas), um passe para todos.
+
+Gera escalas sintéticas (AM e PM, ondas de 25 motoristas, ~70% da base escalada por turno).
+Não precisa de Service Account nem de rede.
+
+Uso:
+    python benchmarks/bench_quinzena.py [motoristas] [repeticoes]
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from quinzena_engine import calcular_quinzenas  # noqa: E402
+
+
+ANO, MES, DIAS = 2026, 10, 31
+
+
+def escalas_sinteticas(quantidade: int):
+    aleatorio = random.Random(42)
+    motoristas = [(f"mot{i:04d}", f"Motorista {i}") for i in range(quantidade)]
+    escalas_por_dia = []
+    for _ in range(DIAS):
+        do_dia = []
+        for turno in ('AM', 'PM'):
+            escalados = aleatorio.sample(motoristas, int(quantidade * 0.7))
+            ondas = [
+                {"nome": f"{n // 25 + 1}ª Onda", "itens": [
+                    {"motoristaId": mid, "nome": nome, "vaga": "01", "rota": "S-7", "sacas": 3}
+                    for mid, nome in escalados[n:n + 25]
+                ]}
+                for n in range(0, len(escalados), 25)
+            ]
+            do_dia.append({"turno": turno, "ondas": ondas})
+        escalas_por_dia.append(do_dia)
+    return escalas_por_dia
+
+
+def por_motorista(escalas_por_dia):
+    """Referência: para cada motorista, varre todas as escalas do mês."""
+    ids = {}
+    for escalas in escalas_por_dia:
+        for escala in escalas:
+            for onda in escala["ondas"]:
+                for item in onda["itens"]:
+                    ids.setdefault(item["motoristaId"], item["nome"])
+    resultado = {}
+    for mid, nome in ids.items():
+        datas = []
+        for dia, escalas in enumerate(escalas_por_dia, start=1):
+            if any(item["motoristaId"] == mid
+                   for escala in escalas for onda in escala["ondas"] for item in onda["itens"]):
+                datas.append(f"{dia:02d}/{MES:02d}/{ANO}")
+        q1 = [d for d in datas if int(d[:2]) <= 15]
+        q2 = [d for d in datas if int(d[:2]) > 15]
+        resultado[mid] = {
+            "motoristaNome": nome,
+            "primeiraQuinzena": {"diasTrabalhados": len(q1), "datas": q1},
+            "segundaQuinzena": {"diasTrabalhados": len(q2), "datas": q2},
+        }
+    return resultado
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    escalas = escalas_sinteticas(quantidade)
+
+    assert por_motorista(escalas) == calcular_quinzenas(escalas, ANO, MES), "matriz difere da varredura por motorista"
+
+    t_varredura = min(timeit.repeat(lambda: por_motorista(escalas), number=1, repeat=repeticoes))
+    t_matriz = min(timeit.repeat(lambda: calcular_quinzenas(escalas, ANO, MES), number=1, repeat=repeticoes))
+
+    print(f"🗓️ {quantidade} motoristas, {DIAS} dias x 2 turnos (melhor de {repeticoes} execuções)")
+    print(f"   Varredura por motorista: {t_varredura * 1000:9.2f} ms")
+    print(f"   Matriz NumPy:            {t_matriz * 1000:9.2f} ms")
+    print(f"   Ganho: {t_varredura / t_matriz:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+"""
+cache_backends.py
+
+Backends de cache compartilhados entre processos (vários workers do gunicorn na mesma máquina).
+
+Com CACHE_BACKEND=memoria (padrão) cada processo tem seus próprios caches (TTLCache).
+Com CACHE_BACKEND=sqlite ou redis, os caches do backend (contexto do assistente, coordenadas do galpão,
+decisões de autorização) ficam num armazenamento comum: o que um worker leu do Firestore os outros
+reaproveitam, e uma invalidação feita por um vale para todos.
+
+- sqlite: arquivo local (CACHE_SQLITE_PATH) em modo WAL, com mmap; não precisa de servidor.
+- redis: qualquer servidor que fale o protocolo Redis (RESP) em CACHE_REDIS_URL. O cliente é
+  implementado aqui (GET/SET/DEL/SCAN), sem dependência extra.
+
+CacheCompartilhado tem a mesma interface do TTLCache. Os valores são gravados em JSON
+(listas, dicts, textos, números e None); chaves em tupla são codificadas e decodificadas.
+Falhas do backend contam como falta de cache: nunca derrubam a requisição. Depois de uma falha,
+o backend fica suspenso por alguns segundos (sem novas tentativas de conexão a cada chamada).
+
+Uso:
+    cache = criar_cache('autorizacao', max_itens=10000, ttl_segundos=300)
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from ttl_cache import TTLCache, tamanho_aproximado
+
+
+BACKEND_MEMORIA = 'memoria'
+BACKEND_SQLITE = 'sqlite'
+BACKEND_REDIS = 'redis'
+
+_AUSENTE = object()
+
+
+class ErroRedis(Exception):
+    """Resposta de erro (-ERR ...) do servidor Redis."""
+
+
+class SQLiteCacheBackend:
+    """Chave -> (valor JSON, vencimento) num arquivo SQLite compartilhado pelos processos da máquina."""
+
+    INTERVALO_LIMPEZA_SEGUNDOS = 60.0
+    MMAP_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Args:
+            db_path: Caminho do arquivo (se None, usa CACHE_SQLITE_PATH ou cache_compartilhado.db na pasta do backend)
+        """
+        if db_path is None:
+            db_path = os.getenv('CACHE_SQLITE_PATH') or os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), 'cache_compartilhado.db'
+            )
+        self.db_path = db_path
+        self._proxima_limpeza = 0.0
+        self._criar_tabela()
+
+    def _conectar(self) -> sqlite3.Connection:
+        # Conexão curta por operação: seguro entre threads e entre processos
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute(f"PRAGMA mmap_size={self.MMAP_BYTES}")
+        return conn
+
+    def _criar_tabela(self):
+        conn = self._conectar()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache (
+                    chave TEXT PRIMARY KEY,
+                    valor TEXT NOT NULL,
+                    remover_em REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_remover ON cache (remover_em)")
+        finally:
+            conn.close()
+
+    def ler(self, chave: str) -> Optional[str]:
+        conn = self._conectar()
+        try:
+            row = conn.execute(
+                "SELECT valor FROM cache WHERE chave = ? AND remover_em > ?", (chave, time.time())
+            ).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def gravar(self, chave: str, valor: str, manter_segundos: float):
+        agora = time.time()
+        conn = self._conectar()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (chave, valor, remover_em) VALUES (?, ?, ?)",
+                (chave, valor, agora + manter_segundos)
+            )
+            if agora >= self._proxima_limpeza:
+                self._proxima_limpeza = agora + self.INTERVALO_LIMPEZA_SEGUNDOS
+                conn.execute("DELETE FROM cache WHERE remover_em <= ?", (agora,))
+        finally:
+            conn.close()
+
+    def apagar(self, chaves: List[str]) -> int:
+        if not chaves:
+            return 0
+        conn = self._conectar()
+        try:
+            apagadas = 0
+            for i in range(0, len(chaves), 500):
+                lote = chaves[i:i + 500]
+                cur = conn.execute(f"DELETE FROM cache WHERE chave IN ({','.join('?' * len(lote))})", lote)
+                apagadas += cur.rowcount
+            return apagadas
+        finally:
+            conn.close()
+
+    def chaves(self, prefixo: str) -> List[str]:
+        conn = self._conectar()
+        try:
+            # Faixa [prefixo, prefixo + U+FFFF): usa o índice da chave primária
+            rows = conn.execute(
+                "SELECT chave FROM cache WHERE chave >= ? AND chave < ? AND remover_em > ?",
+                (prefixo, prefixo + '\uffff', time.time())
+            ).fetchall()
+            return [row[0] for row in rows]
+        finally:
+            conn.close()
+
+    def descricao(self) -> str:
+        return f"sqlite:{self.db_path}"
+
+
+class RedisCacheBackend:
+    """Cliente RESP mínimo (GET/SET PX/DEL/SCAN) com uma conexão por thread."""
+
+    TIMEOUT_PADRAO = 2.0
+
+    def __init__(self, url: Optional[str] = None, timeout: Optional[float] = None):
+        """
+        Args:
+            url: redis://[:senha@]host[:porta][/db] (se None, usa CACHE_REDIS_URL ou redis://localhost:6379/0)
+            timeout: Segundos por operação (se None, usa CACHE_REDIS_TIMEOUT_S ou TIMEOUT_PADRAO)
+        """
+        if url is None:
+            url = os.getenv('CACHE_REDIS_URL') or 'redis://localhost:6379/0'
+        if timeout is None:
+            timeout = float(os.getenv('CACHE_REDIS_TIMEOUT_S') or self.TIMEOUT_PADRAO)
+        partes = urlparse(url)
+        self.host = partes.hostname or 'localhost'
+        self.porta = partes.port or 6379
+        self.senha = unquote(partes.password) if partes.password else None
+        self.usuario = unquote(partes.username) if partes.username else None
+        self.db = int((partes.path or '/0').lstrip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            sock = socket.create_connection((self.host, self.porta), timeout=self.timeout)
+            conexao = (sock, sock.makefile('rb'))
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                if self.senha:
+                    self._executar(conexao, *(['AUTH', self.usuario, self.senha] if self.usuario else ['AUTH', self.senha]))
+                if self.db:
+                    self._executar(conexao, 'SELECT', str(self.db))
+            except Exception:
+                # AUTH/SELECT recusado: não reaproveitar um socket sem autenticação
+                conexao[1].close()
+                sock.close()
+                raise
+            self._local.conexao = conexao
+        return conexao
+
+    def _fechar(self):
+        conexao = getattr(self._local, 'conexao', None)
+        self._local.conexao = None
+        if conexao is not None:
+            try:
+                conexao[1].close()
+                conexao[0].close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _codificar(*args: str) -> bytes:
+        partes = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            dados = arg.encode('utf-8') if isinstance(arg, str) else arg
+            partes.append(f"${len(dados)}\r\n".encode() + dados + b"\r\n")
+        return b"".join(partes)
+
+    @classmethod
+    def _ler_resposta(cls, arquivo) -> Any:
+        linha = arquivo.readline()
+        if not linha:
+            raise ConnectionError("Conexão com o Redis fechada")
+        tipo, conteudo = linha[:1], linha[1:-2]
+        if tipo == b'+':
+            return conteudo.decode()
+        if tipo == b'-':
+            raise ErroRedis(conteudo.decode())
+        if tipo == b':':
+            return int(conteudo)
+        if tipo == b'$':
+            tamanho = int(conteudo)
+            if tamanho < 0:
+                return None
+            dados = arquivo.read(tamanho + 2)
+            return dados[:-2].decode('utf-8')
+        if tipo == b'*':
+            quantidade = int(conteudo)
+            if quantidade < 0:
+                return None
+            return [cls._ler_resposta(arquivo) for _ in range(quantidade)]
+        raise ErroRedis(f"Resposta RESP inesperada: {linha!r}")
+
+    def _executar(self, conexao, *args: str) -> Any:
+        sock, arquivo = conexao
+        sock.sendall(self._codificar(*args))
+        return self._ler_resposta(arquivo)
+
+    def comando(self, *args: str) -> Any:
+        """Executa um comando; em erro de conexão reconecta uma vez."""
+        for tentativa in range(2):
+            try:
+                return self._executar(self._conexao(), *args)
+            except (OSError, ConnectionError):
+                self._fechar()
+                if tentativa == 1:
+                    raise
+
+    def ler(self, chave: str) -> Optional[str]:
+        return self.comando('GET', chave)
+
+    def gravar(self, chave: str, valor: str, manter_segundos: float):
+        self.comando('SET', chave, valor, 'PX', str(max(1, int(manter_segundos * 1000))))
+
+    def apagar(self, chaves: List[str]) -> int:
+        apagadas = 0
+        for i in range(0, len(chaves), 500):
+            apagadas += self.comando('DEL', *chaves[i:i + 500])
+        return apagadas
+
+    def chaves(self, prefixo: str) -> List[str]:
+        padrao = ''.join('\\' + c if c in '*?[]\\' else c for c in prefixo) + '*'
+        cursor, encontradas = '0', []
+        while True:
+            cursor, lote = self.comando('SCAN', cursor, 'MATCH', padrao, 'COUNT', '1000')
+            encontradas.extend(lote)
+            if cursor == '0':
+                return encontradas
+
+    def descricao(self) -> str:
+        return f"redis://{self.host}:{self.porta}/{self.db}"
+
+
+class CacheCompartilhado:
+    """
+    Mesma interface do TTLCache sobre um backend compartilhado (SQLite ou Redis).
+    Cada cache usa um namespace próprio dentro do backend.
+    """
+
+    SUSPENSAO_APOS_ERRO_SEGUNDOS = 10.0
+
+    def __init__(self, backend, namespace: str, ttl_segundos: float, janela_obsoleta: float = 0.0,
+                 max_bytes_item: Optional[int] = None):
+        """
+        Args:
+            backend: SQLiteCacheBackend ou RedisCacheBackend
+            namespace: Prefixo das chaves deste cache
+            ttl_segundos: Validade padrão de cada entrada
+            janela_obsoleta: Segundos após vencer em que a entrada ainda é devolvida por get_com_validade()
+            max_bytes_item: Entradas maiores que isso não são gravadas (None = sem limite)
+        """
+        self.backend = backend
+        self.namespace = namespace
+        self._prefixo = f"raiz:{namespace}:"
+        self.ttl_segundos = max(0.0, ttl_segundos)
+        self.janela_obsoleta = max(0.0, janela_obsoleta)
+        self.max_bytes_item = max_bytes_item
+        self._lock = threading.Lock()
+        self._suspenso_ate = 0.0
+
+        self.acertos = 0
+        self.faltas = 0
+        self.obsoletos = 0
+        self.invalidados = 0
+        self.rejeitados = 0
+        self.erros = 0
+
+    def _chave(self, chave: Hashable) -> str:
+        return self._prefixo + json.dumps(list(chave) if isinstance(chave, tuple) else chave, ensure_ascii=False)
+
+    def _decodificar_chave(self, chave: str) -> Hashable:
+        valor = json.loads(chave[len(self._prefixo):])
+        return tuple(valor) if isinstance(valor, list) else valor
+
+    def _contar(self, campo: str, n: int = 1):
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + n)
+
+    def _disponivel(self) -> bool:
+        return time.monotonic() >= self._suspenso_ate
+
+    def _erro(self, operacao: str, e: Exception):
+        with self._lock:
+            self.erros += 1
+            self._suspenso_ate = time.monotonic() + self.SUSPENSAO_APOS_ERRO_SEGUNDOS
+        print(f"⚠️ Cache compartilhado ({self.namespace}) falhou em {operacao}: {e}; "
+              f"suspenso por {self.SUSPENSAO_APOS_ERRO_SEGUNDOS:.0f}s")
+
+    def get(self, chave: Hashable, padrao: Any = None) -> Any:
+        """Valor da chave, ou padrao se ausente/expirado."""
+        valor, fresco = self._consultar(chave, padrao)
+        return valor if fresco else padrao
+
+    def get_com_validade(self, chave: Hashable, padrao: Any = None) -> Tuple[Any, bool]:
+        """
+        Returns:
+            (valor, fresco): valor vencido há menos de janela_obsoleta volta com fresco=False;
+            ausente volta (padrao, False)
+        """
+        return self._consultar(chave, padrao, aceitar_obsoleto=True)
+
+    def _consultar(self, chave: Hashable, padrao: Any, aceitar_obsoleto: bool = False) -> Tuple[Any, bool]:
+        bruto = None
+        if self._disponivel():
+            try:
+                bruto = self.backend.ler(self._chave(chave))
+            except Exception as e:
+                self._erro('ler', e)
+        try:
+            envelope = json.loads(bruto) if bruto is not None else None
+            valor, expira = envelope['v'], float(envelope['e'])
+        except (ValueError, TypeError, KeyError):
+            envelope = None  # valor corrompido ou gravado por outro programa: conta como falta
+        if envelope is None:
+            self._contar('faltas')
+            return padrao, False
+        if time.time() < expira:
+            self._contar('acertos')
+            return valor, True
+        if not aceitar_obsoleto:
+            self._contar('faltas')
+            return padrao, False
+        self._contar('obsoletos')
+        return valor, False
+
+    def contem(self, chave: Hashable) -> bool:
+        return self.get(chave, _AUSENTE) is not _AUSENTE
+
+    def set(self, chave: Hashable, valor: Any, ttl_segundos: Optional[float] = None):
+        """Grava a chave com TTL próprio (ou o padrão do cache)."""
+        ttl = self.ttl_segundos if ttl_segundos is None else max(0.0, ttl_segundos)
+        if self.max_bytes_item is not None and tamanho_aproximado(valor) > self.max_bytes_item:
+            self._contar('rejeitados')
+            return
+        if not self._disponivel():
+            return
+        envelope = json.dumps({"v": valor, "e": time.time() + ttl}, ensure_ascii=False)
+        try:
+            self.backend.gravar(self._chave(chave), envelope, ttl + self.janela_obsoleta)
+        except Exception as e:
+            self._erro('gravar', e)
+
+    def obter_ou_calcular(self, chave: Hashable, calcular: Callable[[], Any], ttl_segundos: Optional[float] = None) -> Any:
+        """Valor em cache ou calcular() (gravado no cache). Chamadas simultâneas podem calcular em paralelo."""
+        valor = self.get(chave, _AUSENTE)
+        if valor is _AUSENTE:
+            valor = calcular()
+            self.set(chave, valor, ttl_segundos)
+        return valor
+
+    def _apagar(self, chaves: List[str]) -> int:
+        if not chaves:
+            return 0
+        try:
+            apagadas = self.backend.apagar(chaves)
+        except Exception as e:
+            self._erro('apagar', e)
+            return 0
+        self._contar('invalidados', apagadas)
+        return apagadas
+
+    def invalidar(self, chave: Hashable) -> bool:
+        return self._apagar([self._chave(chave)]) > 0
+
+    def _chaves(self) -> List[str]:
+        try:
+            return self.backend.chaves(self._prefixo)
+        except Exception as e:
+            self._erro('listar', e)
+            return []
+
+    def invalidar_onde(self, condicao: Callable[[Hashable], bool]) -> int:
+        """Remove as chaves para as quais condicao(chave) é True. Returns: quantidade removida."""
+        return self._apagar([c for c in self._chaves() if condicao(self._decodificar_chave(c))])
+
+    def limpar(self):
+        self._apagar(self._chaves())
+
+    def __len__(self) -> int:
+        return len(self._chaves())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            consultas = self.acertos + self.faltas
+            return {
+                "backend": self.backend.descricao(),
+                "namespace": self.namespace,
+                "ttl_s": self.ttl_segundos,
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "taxa_acerto": round(self.acertos / consultas, 3) if consultas else None,
+                "invalidados": self.invalidados,
+                "rejeitados": self.rejeitados,
+                "erros": self.erros,
+                "suspenso": not self._disponivel(),
+                "janela_obsoleta_s": self.janela_obsoleta,
+                "obsoletos_servidos": self.obsoletos,
+            }
+
+
+_backend_lock = threading.Lock()
+_backends: Dict[str, Any] = {}
+
+
+def tipo_backend() -> str:
+    """CACHE_BACKEND: memoria (padrão), sqlite ou redis."""
+    tipo = (os.getenv('CACHE_BACKEND') or BACKEND_MEMORIA).strip().lower()
+    return tipo if tipo in (BACKEND_SQLITE, BACKEND_REDIS) else BACKEND_MEMORIA
+
+
+def _backend(tipo: str):
+    with _backend_lock:
+        if tipo not in _backends:
+            _backends[tipo] = SQLiteCacheBackend() if tipo == BACKEND_SQLITE else RedisCacheBackend()
+            print(f"🗄️ Cache compartilhado: {_backends[tipo].descricao()}")
+        return _backends[tipo]
+
+
+def criar_cache(
+    namespace: str,
+    max_itens: int,
+    ttl_segundos: float,
+    max_bytes: Optional[int] = None,
+    janela_obsoleta: float = 0.0
+):
+    """
+    Cache conforme CACHE_BACKEND: TTLCache por processo (memoria) ou CacheCompartilhado (sqlite/redis).
+
+    Args:
+        namespace: Nome do cache (prefixo das chaves no backend compartilhado)
+        max_itens: Limite de entradas (só no cache em memória; o compartilhado expira por TTL)
+        ttl_segundos: Validade padrão de cada entrada
+        max_bytes: Limite de bytes do cache em memória; no compartilhado, limite por entrada
+        janela_obsoleta: Stale-while-revalidate (ver TTLCache)
+    """
+    tipo = tipo_backend()
+    if tipo == BACKEND_MEMORIA:
+        return TTLCache(max_itens=max_itens, ttl_segundos=ttl_segundos, max_bytes=max_bytes,
+                        janela_obsoleta=janela_obsoleta)
+    return CacheCompartilhado(_backend(tipo), namespace, ttl_segundos, janela_obsoleta=janela_obsoleta,
+                              max_bytes_item=max_bytes)
@@ -0,0 +1,201 @@
+"""
+context_cache.py
+
+Cache por seção do contexto do assistente (get_contexto_base_para_assistente).
+
+Cada seção (base, config, motoristas, escala, ETA, disponibilidade, quinzena, devoluções, avisos)
+tem TTL próprio: o que muda pouco (plano, configuração, quinzena) fica mais tempo em cache, o que muda
+a todo momento (ETA) fica pouco. Quando o contexto expira, só as seções vencidas são relidas.
+
+Além do TTL:
+- escala: um listener (on_snapshot) nos documentos da escala de hoje descarta só a seção escala
+  da base quando ela é editada;
+- motoristas: o FirestoreReader descarta a seção quando o diretório da base (BaseDirectory) muda.
+
+Recargas: uma por (baseId, seção, dia) de cada vez (SingleFlight); chamadas simultâneas esperam a mesma.
+Uma seção vencida há menos de CONTEXTO_SWR_S segundos é entregue na hora e recarregada em background.
+Seções invalidadas por snapshot nunca são entregues vencidas.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache_backends import criar_cache
+from ttl_cache import SingleFlight
+
+
+# Segundos que cada seção vale (CONTEXTO_TTL_<SECAO>_S sobrescreve)
+TTL_SECOES_PADRAO: Dict[str, float] = {
+    'base': 600,
+    'config': 600,
+    'motoristas': 300,
+    'escala': 300,
+    'eta': 30,
+    'disponibilidade': 120,
+    'quinzena': 600,
+    'devolucoes': 120,
+    'avisos': 60,
+}
+TURNOS_ESCALA = ('AM', 'PM')
+
+
+class ContextCache:
+    """Seções do contexto por (baseId, seção, dia), com TTL por seção e invalidação por snapshot da escala."""
+
+    MAX_ITENS_PADRAO = 2000
+    MAX_BYTES_PADRAO = 32 * 1024 * 1024
+    MAX_ESCALAS_OBSERVADAS_PADRAO = 50
+    JANELA_OBSOLETA_PADRAO = 60.0
+
+    def __init__(
+        self,
+        db,
+        max_itens: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_escalas_observadas: Optional[int] = None,
+        janela_obsoleta: Optional[float] = None
+    ):
+        """
+        Args:
+            db: Cliente do Firestore (listeners da escala)
+            max_itens: Seções mantidas em cache (se None, usa CONTEXTO_CACHE_MAX_ITENS ou MAX_ITENS_PADRAO)
+            max_bytes: Memória estimada das seções em cache (se None, usa CONTEXTO_CACHE_MAX_BYTES ou MAX_BYTES_PADRAO)
+            max_escalas_observadas: Bases com listener na escala de hoje (se None, usa
+                                    CONTEXTO_ESCALAS_OBSERVADAS ou MAX_ESCALAS_OBSERVADAS_PADRAO)
+            janela_obsoleta: Segundos em que uma seção vencida ainda é entregue enquanto recarrega
+                             (se None, usa CONTEXTO_SWR_S ou JANELA_OBSOLETA_PADRAO; 0 desliga)
+        """
+        if max_itens is None:
+            max_itens = int(os.getenv('CONTEXTO_CACHE_MAX_ITENS') or self.MAX_ITENS_PADRAO)
+        if max_bytes is None:
+            max_bytes = int(os.getenv('CONTEXTO_CACHE_MAX_BYTES') or self.MAX_BYTES_PADRAO)
+        if max_escalas_observadas is None:
+            max_escalas_observadas = int(os.getenv('CONTEXTO_ESCALAS_OBSERVADAS') or self.MAX_ESCALAS_OBSERVADAS_PADRAO)
+        if janela_obsoleta is None:
+            swr = os.getenv('CONTEXTO_SWR_S')
+            janela_obsoleta = float(swr) if swr else self.JANELA_OBSOLETA_PADRAO
+        self.db = db
+        self.ttls = {
+            secao: float(os.getenv(f'CONTEXTO_TTL_{secao.upper()}_S') or padrao)
+            for secao, padrao in TTL_SECOES_PADRAO.items()
+        }
+        self._cache = criar_cache(
+            'contexto',
+            max_itens=max_itens,
+            ttl_segundos=max(self.ttls.values()),
+            max_bytes=max_bytes,
+            janela_obsoleta=janela_obsoleta,
+        )
+        self.recargas = SingleFlight()
+        self.max_escalas_observadas = max(0, max_escalas_observadas)
+        self._escalas_lock = threading.Lock()
+        self._escalas: "OrderedDict[str, Tuple[str, List[Any]]]" = OrderedDict()  # base_id -> (dia, watches)
+
+        self.invalidacoes_escala = 0
+        self.invalidacoes_motoristas = 0
+
+    def get(self, base_id: str, secao: str, dia: str) -> Optional[List[str]]:
+        """Partes do texto da seção, ou None se ausente/vencida."""
+        return self._cache.get((base_id, secao, dia))
+
+    def consultar(self, base_id: str, secao: str, dia: str) -> Tuple[Optional[List[str]], bool]:
+        """
+        Returns:
+            (partes, fresco): partes vencidas dentro da janela obsoleta voltam com fresco=False; ausente = (None, False)
+        """
+        return self._cache.get_com_validade((base_id, secao, dia))
+
+    def set(self, base_id: str, secao: str, dia: str, partes: List[str]):
+        self._cache.set((base_id, secao, dia), partes, self.ttls.get(secao))
+
+    def recarregando(self, base_id: str, secao: str, dia: str) -> bool:
+        """True se já há recarga da seção em andamento neste processo."""
+        return self.recargas.em_andamento((base_id, secao, dia))
+
+    def recarregar(
+        self,
+        base_id: str,
+        secao: str,
+        dia: str,
+        executor: Executor,
+        carregar: Callable[[], Tuple[List[str], float]]
+    ) -> Tuple[Future, bool]:
+        """
+        Recarrega a seção no executor e grava no cache; se já há recarga da mesma seção, devolve a dela.
+
+        Args:
+            carregar: Função que lê a seção e devolve (partes, milissegundos)
+
+        Returns:
+            (future com (partes, ms), novo)
+        """
+        def tarefa():
+            partes, ms = carregar()
+            self.set(base_id, secao, dia, partes)
+            return partes, ms
+        return self.recargas.submeter((base_id, secao, dia), executor, tarefa)
+
+    def invalidar(self, base_id: str, secao: Optional[str] = None) -> int:
+        """Descarta uma seção da base (ou todas, se secao for None). Returns: entradas descartadas."""
+        return self._cache.invalidar_onde(
+            lambda chave: chave[0] == base_id and (secao is None or chave[1] == secao)
+        )
+
+    def invalidar_motoristas(self, base_id: str):
+        """Callback do diretório: a lista de motoristas da base mudou."""
+        if self.invalidar(base_id, 'motoristas'):
+            self.invalidacoes_motoristas += 1
+
+    def _ao_mudar_escala(self, base_id: str, primeiro: List[bool]):
+        # O primeiro snapshot só confirma o estado atual; os seguintes são edições da escala
+        if primeiro[0]:
+            primeiro[0] = False
+            return
+        if self.invalidar(base_id, 'escala'):
+            self.invalidacoes_escala += 1
+            print(f"🔄 Escala da base {base_id} mudou; seção escala do contexto descartada")
+
+    def observar_escala(self, base_ref, base_id: str, dia: str):
+        """
+        Garante o listener nos documentos escalas/{dia}_AM e escalas/{dia}_PM da base
+        (idempotente; troca de dia ou listener parado recria).
+        """
+        if self.max_escalas_observadas == 0:
+            return
+        descartados: List[Any] = []
+        with self._escalas_lock:
+            atual = self._escalas.get(base_id)
+            if atual is not None and atual[0] == dia and all(getattr(w, 'is_active', True) for w in atual[1]):
+                self._escalas.move_to_end(base_id)
+                return
+            if atual is not None:
+                descartados.extend(self._escalas.pop(base_id)[1])
+            watches = []
+            for turno in TURNOS_ESCALA:
+                primeiro = [True]
+                watches.append(base_ref.collection('escalas').document(f"{dia}_{turno}").on_snapshot(
+                    lambda docs, changes, read_time, primeiro=primeiro: self._ao_mudar_escala(base_id, primeiro)
+                ))
+            self._escalas[base_id] = (dia, watches)
+            while len(self._escalas) > self.max_escalas_observadas:
+                descartados.extend(self._escalas.popitem(last=False)[1][1])
+        for watch in descartados:
+            try:
+                watch.unsubscribe()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._escalas_lock:
+            escalas = len(self._escalas)
+        return {
+            **self._cache.stats(),
+            "recargas": self.recargas.stats(),
+            "ttls_s": self.ttls,
+            "escalas_observadas": escalas,
+            "invalidacoes_escala": self.invalidacoes_escala,
+            "invalidacoes_motoristas": self.invalidacoes_motoristas,
+        }
@@ -0,0 +1,488 @@
+"""
+devolucao_rollup.py
+
+Resumo mensal das devoluções por base: bases/{baseId}/devolucoes_resumo/{yyyy-mm}.
+
+O app grava cada devolução em bases/{baseId}/devolucoes/{id} (data "dd/MM/yyyy", hora, timestamp em ms,
+idsPacotes, motoristaId, motoristaNome). O resumo do mês guarda:
+- totais do mês, por dia (yyyy-mm-dd), por semana ISO (2026-W42) e por motorista (com total por dia);
+- as devoluções mais recentes do mês, com os IDs dos pacotes (para o assistente);
+- tendenciaSemanal: última semana com devoluções comparada com a anterior (variação em %),
+  calculada na gravação (inclusive quando a semana anterior cai no mês anterior).
+
+Atualização incremental: um listener (collection_group devolucoes, últimos DEVOLUCOES_RESUMO_JANELA_DIAS)
+aplica cada devolução criada, alterada ou excluída numa transação. Cada devolução somada tem um marcador
+em bases/{baseId}/devolucoes_aplicadas/{id} (mês, motorista, dia e pacotes com que entrou), gravado na
+mesma transação do resumo; assim repetir um evento (outro worker, reinício do listener) não conta duas
+vezes, e uma alteração que muda a data para outro mês tira a devolução do mês antigo. O resumo do mês
+guarda só os agregados, então continua pequeno em bases com muitas devoluções.
+Exclusões de devoluções mais antigas que a janela, ou históricos anteriores ao resumo, são acertados
+pela reconstrução:
+
+    python devolucao_rollup.py <service_account.json> <baseId> [yyyy-mm]   # reconstrói do zero
+    python devolucao_rollup.py <service_account.json> --todas              # todas as bases
+
+A reconstrução completa (sem mês) grava bases/{baseId}/devolucoes_resumo/estado com reconstruidoEm e versao.
+Só depois disso o assistente confia nos resumos da base; antes, o listener pode ter criado um resumo
+com poucas devoluções recentes e o histórico ainda estaria fora dele. Resumos de uma versão anterior
+(com a lista de devoluções aplicadas dentro do documento) também voltam a valer só após reconstruir.
+"""
+
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from firebase_admin import firestore
+
+from query_planner import APLICADAS_DO_MES, DEVOLUCOES_RECENTES_GLOBAL
+
+
+COLECAO_RESUMO = 'devolucoes_resumo'
+COLECAO_APLICADAS = 'devolucoes_aplicadas'  # marcador por devolução somada: {mes, motorista, dia, qtd}
+DOC_ESTADO = 'estado'  # devolucoes_resumo/estado: {"reconstruidoEm": ms, "versao": n} após reconstruir a base inteira
+VERSAO_RESUMO = 2  # 2: devoluções aplicadas em marcadores, fora do resumo
+LOTE_EVENTOS = 100  # devoluções por transação (cada uma grava o próprio marcador)
+LOTE_ESCRITAS = 400  # escritas por batch na reconstrução (o Firestore aceita até 500)
+MAX_RECENTES = 50  # devoluções mais recentes guardadas por mês (com IDs dos pacotes)
+MAX_IDS_POR_RECENTE = 30
+
+
+def _data_iso(dados: Dict[str, Any]) -> Optional[str]:
+    """yyyy-mm-dd da devolução ("data" dd/MM/yyyy; sem ela, o timestamp em ms)."""
+    data_str = (dados.get('data') or '').strip()
+    try:
+        return datetime.strptime(data_str, '%d/%m/%Y').strftime('%Y-%m-%d')
+    except ValueError:
+        pass
+    ts = dados.get('timestamp')
+    if isinstance(ts, (int, float)) and ts > 0:
+        return datetime.utcfromtimestamp(ts / 1000.0).strftime('%Y-%m-%d')
+    return None
+
+
+def mes_da_devolucao(dados: Dict[str, Any]) -> Optional[str]:
+    """yyyy-mm do resumo em que a devolução entra (None se não tem data)."""
+    dia = _data_iso(dados)
+    return dia[:7] if dia else None
+
+
+def _semana_iso(dia: str) -> str:
+    ano, semana, _ = date.fromisoformat(dia).isocalendar()
+    return f"{ano}-W{semana:02d}"
+
+
+def _semana_anterior(semana: str) -> str:
+    ano, numero = semana.split('-W')
+    segunda = date.fromisocalendar(int(ano), int(numero), 1) - timedelta(days=7)
+    return _semana_iso(segunda.isoformat())
+
+
+def mes_anterior(mes: str) -> str:
+    ano, m = int(mes[:4]), int(mes[5:7])
+    return f"{ano - 1}-12" if m == 1 else f"{ano}-{m - 1:02d}"
+
+
+def _quantidade(dados: Dict[str, Any]) -> Tuple[int, List[str]]:
+    """(pacotes, ids) como a seção de devoluções do assistente sempre contou."""
+    ids = dados.get('idsPacotes') or []
+    if not isinstance(ids, list):
+        ids = [str(ids)] if ids else []
+    ids = [str(x).strip() for x in ids if x]
+    qtd = len(ids)
+    if qtd == 0:
+        try:
+            qtd = int(dados.get('quantidade') or 0)
+        except (TypeError, ValueError):
+            qtd = 0
+    return qtd, ids
+
+
+def resumo_vazio(mes: str) -> Dict[str, Any]:
+    return {
+        "mes": mes,
+        "totalDevolucoes": 0,
+        "totalPacotes": 0,
+        "porDia": {},
+        "porSemana": {},
+        "porMotorista": {},
+        "recentes": [],
+        "tendenciaSemanal": None,
+    }
+
+
+def base_reconstruida(estado: Optional[Dict[str, Any]]) -> bool:
+    """Se devolucoes_resumo/estado indica uma reconstrução completa no formato atual dos resumos."""
+    return bool(estado and estado.get('reconstruidoEm') and (estado.get('versao') or 1) >= VERSAO_RESUMO)
+
+
+def _somar(contador: Dict[str, Any], chave: str, devolucoes: int, pacotes: int):
+    atual = contador.get(chave) or {"devolucoes": 0, "pacotes": 0}
+    atual = {"devolucoes": atual["devolucoes"] + devolucoes, "pacotes": atual["pacotes"] + pacotes}
+    if atual["devolucoes"] <= 0:
+        contador.pop(chave, None)
+    else:
+        contador[chave] = atual
+
+
+def marcador_da_devolucao(dados: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Como a devolução entra no resumo: {"mes", "motorista", "dia", "qtd"} (None se não tem data)."""
+    dia = _data_iso(dados)
+    if dia is None:
+        return None
+    motorista_id = (dados.get('motoristaId') or '').strip()
+    nome = (dados.get('motoristaNome') or '').strip() or "Sem nome"
+    return {"mes": dia[:7], "motorista": motorista_id or nome, "dia": dia, "qtd": _quantidade(dados)[0]}
+
+
+def aplicar_no_resumo(resumo: Dict[str, Any], dev_id: str, dados: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Soma a devolução ao resumo (em memória), sem verificar se já foi somada (isso é o marcador).
+
+    Returns:
+        Marcador (marcador_da_devolucao) com que ela entrou, para remover_do_resumo; None se não tem data
+    """
+    marcador = marcador_da_devolucao(dados)
+    if marcador is None:
+        return None
+    dia, chave_motorista = marcador["dia"], marcador["motorista"]
+    qtd, ids = _quantidade(dados)
+    motorista_id = (dados.get('motoristaId') or '').strip()
+    nome = (dados.get('motoristaNome') or '').strip() or "Sem nome"
+
+    resumo["totalDevolucoes"] += 1
+    resumo["totalPacotes"] += qtd
+    _somar(resumo["porDia"], dia, 1, qtd)
+    _somar(resumo["porSemana"], _semana_iso(dia), 1, qtd)
+    motorista = resumo["porMotorista"].setdefault(
+        chave_motorista, {"nome": nome, "devolucoes": 0, "pacotes": 0, "porDia": {}}
+    )
+    motorista["nome"] = nome
+    motorista["devolucoes"] += 1
+    motorista["pacotes"] += qtd
+    _somar(motorista["porDia"], dia, 1, qtd)
+
+    recentes = [r for r in resumo["recentes"] if r["id"] != dev_id]
+    recentes.append({
+        "id": dev_id,
+        "motoristaId": motorista_id,
+        "motoristaNome": nome,
+        "data": (dados.get('data') or '').strip(),
+        "hora": (dados.get('hora') or '').strip(),
+        "timestamp": dados.get('timestamp') or 0,
+        "qtd": qtd,
+        "ids": ids[:MAX_IDS_POR_RECENTE],
+        "totalIds": len(ids),
+    })
+    recentes.sort(key=lambda r: r["timestamp"] or 0, reverse=True)
+    resumo["recentes"] = recentes[:MAX_RECENTES]
+    return marcador
+
+
+def remover_do_resumo(resumo: Dict[str, Any], dev_id: str, marcador: Dict[str, Any]):
+    """Desconta uma devolução somada com o marcador devolvido por aplicar_no_resumo."""
+    chave_motorista, dia, qtd = marcador["motorista"], marcador["dia"], marcador["qtd"]
+    resumo["totalDevolucoes"] -= 1
+    resumo["totalPacotes"] -= qtd
+    _somar(resumo["porDia"], dia, -1, -qtd)
+    _somar(resumo["porSemana"], _semana_iso(dia), -1, -qtd)
+    motorista = resumo["porMotorista"].get(chave_motorista)
+    if motorista is not None:
+        motorista["devolucoes"] -= 1
+        motorista["pacotes"] -= qtd
+        _somar(motorista["porDia"], dia, -1, -qtd)
+        if motorista["devolucoes"] <= 0:
+            del resumo["porMotorista"][chave_motorista]
+    resumo["recentes"] = [r for r in resumo["recentes"] if r["id"] != dev_id]
+
+
+def calcular_tendencia(resumo: Dict[str, Any], resumo_anterior: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Última semana com devoluções no mês x semana anterior (que pode estar no mês anterior)."""
+    if not resumo["porSemana"]:
+        return None
+    semana = max(resumo["porSemana"])
+    anterior = _semana_anterior(semana)
+    atual = resumo["porSemana"][semana]["devolucoes"]
+    antes = (resumo["porSemana"].get(anterior) or {}).get("devolucoes", 0)
+    if resumo_anterior is not None:
+        antes += ((resumo_anterior.get("porSemana") or {}).get(anterior) or {}).get("devolucoes", 0)
+    return {
+        "semana": semana,
+        "semanaAnterior": anterior,
+        "devolucoes": atual,
+        "devolucoesAnterior": antes,
+        "variacaoPct": round((atual - antes) * 100.0 / antes, 1) if antes else None,
+    }
+
+
+class DevolucaoRollup:
+    """Mantém bases/{baseId}/devolucoes_resumo/{yyyy-mm} a partir de bases/{baseId}/devolucoes."""
+
+    JANELA_DIAS_PADRAO = 7
+    RENOVAR_LISTENER_SEGUNDOS = 24 * 3600  # a janela do listener anda uma vez por dia
+
+    def __init__(
+        self,
+        db,
+        janela_dias: Optional[int] = None,
+        ao_mudar: Optional[Callable[[str], None]] = None
+    ):
+        """
+        Args:
+            db: Cliente do Firestore
+            janela_dias: Dias de devoluções observados pelo listener (se None, usa DEVOLUCOES_RESUMO_JANELA_DIAS)
+            ao_mudar: Chamado com o baseId a cada devolução observada (mesmo já aplicada por outro processo),
+                      para quem guarda algo derivado do resumo (ex.: cache do contexto)
+        """
+        if janela_dias is None:
+            janela_dias = int(os.getenv('DEVOLUCOES_RESUMO_JANELA_DIAS') or self.JANELA_DIAS_PADRAO)
+        self.db = db
+        self.janela_dias = max(1, janela_dias)
+        self.ao_mudar = ao_mudar
+        self._lock = threading.Lock()
+        self._watch = None
+        self._watch_desde = 0.0
+
+        self.eventos = 0
+        self.alterados = 0  # eventos que mudaram o resumo (o resto já estava aplicado)
+        self.erros = 0
+        self.reconstrucoes = 0
+
+    def _ref(self, base_id: str, mes: str):
+        return self.db.collection('bases').document(base_id).collection(COLECAO_RESUMO).document(mes)
+
+    def ref_estado(self, base_id: str):
+        """Documento com reconstruidoEm: presente quando o histórico da base inteira está nos resumos."""
+        return self.db.collection('bases').document(base_id).collection(COLECAO_RESUMO).document(DOC_ESTADO)
+
+    def _ref_aplicada(self, base_id: str, dev_id: str):
+        return self.db.collection('bases').document(base_id).collection(COLECAO_APLICADAS).document(dev_id)
+
+    def resumo(self, base_id: str, mes: str) -> Optional[Dict[str, Any]]:
+        doc = self._ref(base_id, mes).get()
+        return doc.to_dict() if doc.exists else None
+
+    def aplicar(self, base_id: str, dev_id: str, dados: Dict[str, Any]) -> bool:
+        """Soma uma devolução registrada ao resumo do mês dela (idempotente)."""
+        return self.aplicar_eventos(base_id, [('ADDED', dev_id, dados)]) > 0
+
+    def remover(self, base_id: str, dev_id: str, dados: Dict[str, Any]) -> bool:
+        """Desconta uma devolução excluída."""
+        return self.aplicar_eventos(base_id, [('REMOVED', dev_id, dados)]) > 0
+
+    def aplicar_eventos(self, base_id: str, eventos: List[Tuple[str, str, Dict[str, Any]]]) -> int:
+        """
+        Aplica eventos da coleção devolucoes da base: uma transação por lote de LOTE_EVENTOS devoluções.
+
+        Args:
+            eventos: [(tipo, id da devolução, dados)], tipo 'ADDED', 'MODIFIED' ou 'REMOVED'
+                     (ADDED já aplicado com os mesmos dados é ignorado; MODIFIED desconta a versão do marcador,
+                     inclusive de outro mês, e soma a nova; REMOVED desconta e apaga o marcador)
+
+        Returns:
+            Eventos que alteraram o resumo (repetidos e sem data não contam)
+        """
+        ultimos: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        for tipo, dev_id, dados in eventos:
+            ultimos[dev_id] = (tipo, dados)
+        itens = list(ultimos.items())
+        alterados = 0
+        for inicio in range(0, len(itens), LOTE_EVENTOS):
+            alterados += self._aplicar_lote(base_id, itens[inicio:inicio + LOTE_EVENTOS])
+        return alterados
+
+    def _aplicar_lote(self, base_id: str, itens: List[Tuple[str, Tuple[str, Dict[str, Any]]]]) -> int:
+        """
+        Numa transação: lê os marcadores das devoluções e os resumos dos meses afetados (e dos meses anteriores,
+        para a tendência), desconta/soma e grava resumos e marcadores juntos.
+        """
+        refs_marcador = {dev_id: self._ref_aplicada(base_id, dev_id) for dev_id, _ in itens}
+
+        @firestore.transactional
+        def executar(transaction) -> int:
+            marcadores = {
+                doc.id: doc.to_dict() or {}
+                for doc in self.db.get_all(list(refs_marcador.values()), transaction=transaction) if doc.exists
+            }
+            # (id, marcador a descontar, dados a somar)
+            mudancas: List[Tuple[str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]] = []
+            for dev_id, (tipo, dados) in itens:
+                antigo = marcadores.get(dev_id)
+                novo = None if tipo == 'REMOVED' else marcador_da_devolucao(dados)
+                if antigo is None and novo is None:
+                    continue
+                if tipo == 'ADDED' and antigo is not None and antigo == novo:
+                    continue  # repetição (outro worker ou reinício do listener)
+                mudancas.append((dev_id, antigo, dados if novo is not None else None))
+            if not mudancas:
+                return 0
+
+            meses = {
+                marcador["mes"] for _, antigo, dados in mudancas
+                for marcador in (antigo, dados and marcador_da_devolucao(dados)) if marcador
+            }
+            refs_mes = {mes: self._ref(base_id, mes) for mes in meses | {mes_anterior(mes) for mes in meses}}
+            lidos = {
+                doc.id: doc.to_dict() or {}
+                for doc in self.db.get_all(list(refs_mes.values()), transaction=transaction) if doc.exists
+            }
+            resumos = {mes: lidos.get(mes) or resumo_vazio(mes) for mes in meses}
+
+            for dev_id, antigo, dados in mudancas:
+                if antigo is not None:
+                    remover_do_resumo(resumos[antigo["mes"]], dev_id, antigo)
+                marcador = None
+                if dados is not None:
+                    marcador = aplicar_no_resumo(resumos[mes_da_devolucao(dados)], dev_id, dados)
+                if marcador is None:
+                    transaction.delete(refs_marcador[dev_id])
+                else:
+                    transaction.set(refs_marcador[dev_id], marcador)
+
+            agora = int(time.time() * 1000)
+            for mes in sorted(meses):
+                resumo = resumos[mes]
+                resumo.pop("aplicadas", None)  # formato anterior (versão 1), com as devoluções dentro do resumo
+                anterior = resumos.get(mes_anterior(mes)) or lidos.get(mes_anterior(mes))
+                resumo["tendenciaSemanal"] = calcular_tendencia(resumo, anterior)
+                resumo["atualizadoEm"] = agora
+                transaction.set(refs_mes[mes], resumo)
+            return len(mudancas)
+
+        return executar(self.db.transaction())
+
+    def _gravar_em_lotes(self, escritas: List[Tuple[Any, Optional[Dict[str, Any]]]]):
+        """Grava [(ref, dados)] em batches de LOTE_ESCRITAS, na ordem (dados None apaga o documento)."""
+        for inicio in range(0, len(escritas), LOTE_ESCRITAS):
+            batch = self.db.batch()
+            for ref, dados in escritas[inicio:inicio + LOTE_ESCRITAS]:
+                if dados is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, dados)
+            batch.commit()
+
+    def reconstruir(self, base_id: str, mes: Optional[str] = None) -> Dict[str, int]:
+        """
+        Recalcula do zero os resumos e os marcadores da base a partir de todas as devoluções
+        (ou só as do mês informado). Sem mês, também marca a base como reconstruída
+        (devolucoes_resumo/estado.reconstruidoEm e versao), por último.
+
+        Returns:
+            {mes: devoluções no resumo}
+        """
+        base_ref = self.db.collection('bases').document(base_id)
+        resumos: Dict[str, Dict[str, Any]] = {}
+        marcadores: Dict[str, Dict[str, Any]] = {}
+        for doc in base_ref.collection('devolucoes').stream():
+            dados = doc.to_dict() or {}
+            mes_dev = mes_da_devolucao(dados)
+            if mes_dev is None or (mes is not None and mes_dev != mes):
+                continue
+            marcadores[doc.id] = aplicar_no_resumo(resumos.setdefault(mes_dev, resumo_vazio(mes_dev)), doc.id, dados)
+        if mes is not None:
+            resumos.setdefault(mes, resumo_vazio(mes))
+
+        # Marcadores que não correspondem mais a uma devolução (excluída ou que saiu do mês)
+        aplicadas_ref = base_ref.collection(COLECAO_APLICADAS)
+        existentes = (
+            APLICADAS_DO_MES.montar(aplicadas_ref, mes) if mes is not None else aplicadas_ref.select(['mes'])
+        ).stream()
+        escritas: List[Tuple[Any, Optional[Dict[str, Any]]]] = [
+            (doc.reference, None) for doc in existentes if doc.id not in marcadores
+        ]
+        escritas.extend((aplicadas_ref.document(dev_id), marcador) for dev_id, marcador in marcadores.items())
+
+        agora = int(time.time() * 1000)
+        for mes_res, resumo in sorted(resumos.items()):
+            anterior = resumos.get(mes_anterior(mes_res))
+            if anterior is None and mes is not None:
+                anterior = self.resumo(base_id, mes_anterior(mes_res))
+            resumo["tendenciaSemanal"] = calcular_tendencia(resumo, anterior)
+            resumo["atualizadoEm"] = agora
+            escritas.append((self._ref(base_id, mes_res), resumo))
+        if mes is None:
+            escritas.append((self.ref_estado(base_id), {"reconstruidoEm": agora, "versao": VERSAO_RESUMO}))
+        self._gravar_em_lotes(escritas)
+        with self._lock:
+            self.reconstrucoes += 1
+        print(f"📦 Resumo de devoluções da base {base_id} reconstruído: {len(resumos)} mês(es), "
+              f"{len(marcadores)} devolução(ões)")
+        return {m: r["totalDevolucoes"] for m, r in sorted(resumos.items())}
+
+    def _ao_mudar(self, changes):
+        por_base: Dict[str, List[Tuple[str, str, Dict[str, Any]]]] = {}
+        for change in changes:
+            doc = change.document
+            base_ref = doc.reference.parent.parent
+            if base_ref is None or base_ref.parent.id != 'bases':
+                continue
+            por_base.setdefault(base_ref.id, []).append((change.type.name, doc.id, doc.to_dict() or {}))
+        for base_id, eventos in por_base.items():
+            try:
+                alterados = self.aplicar_eventos(base_id, eventos)
+                with self._lock:
+                    self.eventos += len(eventos)
+                    self.alterados += alterados
+            except Exception as e:
+                with self._lock:
+                    self.erros += 1
+                print(f"⚠️ Resumo de devoluções da base {base_id}: falha ao aplicar {len(eventos)} evento(s): {e}")
+            if self.ao_mudar is not None:
+                try:
+                    self.ao_mudar(base_id)
+                except Exception as e:
+                    print(f"⚠️ Erro no callback do resumo de devoluções: {e}")
+
+    def observar(self):
+        """
+        Garante o listener das devoluções dos últimos janela_dias de todas as bases (idempotente;
+        recriado se parou ou uma vez por dia, para a janela acompanhar a data).
+        """
+        with self._lock:
+            agora = time.time()
+            if (self._watch is not None and getattr(self._watch, 'is_active', True)
+                    and agora - self._watch_desde < self.RENOVAR_LISTENER_SEGUNDOS):
+                return
+            antigo, self._watch = self._watch, None
+            self._watch_desde = agora
+            desde_ms = int((agora - self.janela_dias * 86400) * 1000)
+            consulta = DEVOLUCOES_RECENTES_GLOBAL.montar(self.db.collection_group('devolucoes'), desde_ms)
+            self._watch = consulta.on_snapshot(lambda docs, changes, read_time: self._ao_mudar(changes))
+        if antigo is not None:
+            try:
+                antigo.unsubscribe()
+            except Exception:
+                pass
+        print(f"👀 Resumo de devoluções: observando os últimos {self.janela_dias} dias")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "observando": self._watch is not None and getattr(self._watch, 'is_active', True),
+                "janela_dias": self.janela_dias,
+                "eventos": self.eventos,
+                "alterados": self.alterados,
+                "erros": self.erros,
+                "reconstrucoes": self.reconstrucoes,
+            }
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Uso: python devolucao_rollup.py <service_account.json> <baseId|--todas> [yyyy-mm]")
+        sys.exit(1)
+    from firestore_reader import FirestoreReader
+
+    reader = FirestoreReader(sys.argv[1], usar_diretorio=False, usar_indice_papeis=False)
+    mes = sys.argv[3] if len(sys.argv) > 3 else None
+    base_ids = reader.get_all_bases() if sys.argv[2] == '--todas' else [sys.argv[2]]
+    for base_id in base_ids:
+        totais = reader.devolucoes_resumo.reconstruir(base_id, mes)
+        for mes_res, total in totais.items():
+            print(f"  {base_id} {mes_res}: {total} devolução(ões)")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,303 @@ Envia notificações push via Firebase Cloud Messaging (FCM) HTTP v1 API.
 Usa Service Account para autenticação.
 """
 
-import requests
 import json
 import os
-from typing import Dict, List, Optional, Tuple
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
+from http_transport import HttpTransport, get_transport
+from rate_limiter import PRIORIDADE_ALTA, PRIORIDADE_NORMAL, BucketComPrioridade, TokenBucket, bucket_do_projeto
+
+
+# Classificação das falhas de envio (ver classificar_falha)
+FALHA_TOKEN_INVALIDO = "token_invalido"  # token morto: remover do Firestore
+FALHA_TEMPORARIA = "temporaria"          # 429/5xx/rede: pode tentar de novo
+FALHA_OUTRA = "outra"
+
+
+def classificar_falha(status_code: int, response_text: str) -> str:
+    """
+    Classifica a resposta de erro do FCM HTTP v1.
+
+    Token inválido (permanente): 404 / errorCode UNREGISTERED (app desinstalado, token expirado)
+    ou 400 INVALID_ARGUMENT cuja mensagem aponta o registration token.
+    Um INVALID_ARGUMENT por payload inválido NÃO conta como token morto.
+
+    Returns:
+        FALHA_TOKEN_INVALIDO, FALHA_TEMPORARIA ou FALHA_OUTRA
+    """
+    error_code = None
+    mensagem = ""
+    try:
+        erro = (json.loads(response_text) or {}).get("error") or {}
+        mensagem = str(erro.get("message") or "")
+        for detalhe in erro.get("details") or []:
+            if isinstance(detalhe, dict) and detalhe.get("errorCode"):
+                error_code = detalhe["errorCode"]
+                break
+        error_code = error_code or erro.get("status")
+    except (ValueError, AttributeError, TypeError):
+        pass
+
+    if status_code == 404 or error_code == "UNREGISTERED":
+        return FALHA_TOKEN_INVALIDO
+    if status_code == 400 and error_code == "INVALID_ARGUMENT" and "registration token" in mensagem.lower():
+        return FALHA_TOKEN_INVALIDO
+    if status_code == 429 or status_code >= 500:
+        return FALHA_TEMPORARIA
+    return FALHA_OUTRA
+
+
+# Retentativas de falhas temporárias (429/5xx/rede): backoff exponencial com jitter
+BACKOFF_BASE_SEGUNDOS = 0.5
+BACKOFF_MAX_SEGUNDOS = 10.0
+
+
+def retry_after_segundos(headers) -> Optional[float]:
+    """Lê o cabeçalho Retry-After (em segundos) da resposta do FCM, se houver."""
+    valor = (headers or {}).get('Retry-After') or (headers or {}).get('retry-after')
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except (TypeError, ValueError):
+        return None  # formato data HTTP: usa o backoff normal
+
+
+def espera_backoff(tentativa: int, retry_after: Optional[float] = None) -> float:
+    """
+    Espera antes da retentativa número `tentativa` (1, 2, ...).
+    Respeita Retry-After quando o FCM informa; senão usa backoff exponencial com jitter completo.
+    """
+    if retry_after is not None:
+        return retry_after
+    teto = min(BACKOFF_MAX_SEGUNDOS, BACKOFF_BASE_SEGUNDOS * (2 ** (tentativa - 1)))
+    return random.uniform(0, teto)
+
+
+class ControleRetentativas:
+    """
+    Política de retentativas de um envio ao FCM, compartilhada por FCMSender e AsyncFCMSender.
+
+    Cada sender só faz o POST e as esperas (time.sleep ou asyncio.sleep); aqui ficam a cota do
+    rate limiter, a classificação da resposta, a decisão de tentar de novo e o cálculo do backoff.
+    """
+
+    def __init__(self, rate_limiter, max_retentativas: int, prioridade: int):
+        self.rate_limiter = rate_limiter
+        self.max_retentativas = max_retentativas
+        self.prioridade = prioridade
+        self.tentativa = 0
+        self.espera_throttle = 0.0
+        self.espera_retentativa = 0.0
+
+    def espera_cota(self) -> float:
+        """Reserva uma mensagem no rate limiter; retorna quanto esperar antes do POST."""
+        espera = self.rate_limiter.reservar(prioridade=self.prioridade)
+        if espera > 0:
+            self.espera_throttle += espera
+        return espera
+
+    def _resultado(self, sucesso: bool, erro: Optional[str], falha: Optional[str]) -> Dict[str, Any]:
+        return {"sucesso": sucesso, "erro": erro, "falha": falha,
+                "retentativas": self.tentativa, "espera_throttle": self.espera_throttle}
+
+    def registrar_resposta(self, response) -> Optional[Dict[str, Any]]:
+        """
+        Avalia a resposta HTTP do FCM.
+
+        Returns:
+            Resultado final do envio, ou None se deve tentar de novo após espera_retentativa segundos
+        """
+        if response.status_code == 200:
+            try:
+                nome = (response.json() or {}).get('name', 'N/A')
+            except ValueError:
+                nome = 'N/A'
+            print(f"  ✅ Notificação enviada com sucesso: {nome}")
+            return self._resultado(True, None, None)
+
+        error_msg = f"Erro {response.status_code}: {response.text}"
+        falha = classificar_falha(response.status_code, response.text)
+        retry_after = None
+        if falha == FALHA_TEMPORARIA:
+            retry_after = retry_after_segundos(response.headers)
+            if response.status_code == 429:
+                self.rate_limiter.pausar(retry_after or espera_backoff(self.tentativa + 1))
+        return self._decidir(error_msg, falha, retry_after)
+
+    def registrar_excecao(self, erro: Exception) -> Optional[Dict[str, Any]]:
+        """Erro de rede/token: falha temporária (mesmo retorno de registrar_resposta)."""
+        return self._decidir(f"Exceção ao enviar notificação: {str(erro)}", FALHA_TEMPORARIA, None)
+
+    def _decidir(self, error_msg: str, falha: str, retry_after: Optional[float]) -> Optional[Dict[str, Any]]:
+        if falha != FALHA_TEMPORARIA or self.tentativa >= self.max_retentativas:
+            if falha == FALHA_TOKEN_INVALIDO:
+                print(f"  🗑️ Token inválido/não registrado: {error_msg}")
+            else:
+                print(f"  ❌ Falha ao enviar: {error_msg}")
+            return self._resultado(False, error_msg, falha)
+
+        self.tentativa += 1
+        self.espera_retentativa = espera_backoff(self.tentativa, retry_after)
+        print(f"  🔁 {error_msg[:120]} — nova tentativa {self.tentativa}/{self.max_retentativas} "
+              f"em {self.espera_retentativa:.1f}s")
+        return None
+
+
+class MessageTemplate:
+    """
+    Mensagem de broadcast serializada uma única vez.
+
+    O corpo JSON é gerado com um marcador no lugar do token e dividido em prefixo e sufixo;
+    render(token) só concatena os bytes com o token codificado em JSON. O resultado é idêntico
+    byte a byte a FCMSender._encode_message(mensagem com o token), sem refazer a conversão
+    dos campos de data nem o json.dumps da mensagem inteira a cada destinatário.
+    """
+
+    MARCADOR_TOKEN = "__fcm_token__"
+
+    def __init__(self, message: Dict):
+        """
+        Args:
+            message: Mensagem FCM com MARCADOR_TOKEN em message["message"]["token"]
+        """
+        self._message = message
+        encoded = FCMSender._encode_message(message)
+        marcador = json.dumps(self.MARCADOR_TOKEN).encode("utf-8")
+        partes = encoded.split(marcador)
+        if len(partes) == 2:
+            self._prefixo, self._sufixo = partes
+        else:
+            # O marcador também aparece nos dados: serializa por destinatário
+            self._prefixo = self._sufixo = None
+
+    def render(self, token: str) -> bytes:
+        """Corpo JSON da mensagem para um token."""
+        if self._prefixo is None:
+            message = json.loads(json.dumps(self._message))
+            message["message"]["token"] = token
+            return FCMSender._encode_message(message)
+        return self._prefixo + json.dumps(token, ensure_ascii=False).encode("utf-8") + self._sufixo
+
+
+class AccessTokenManager:
+    """
+    Mantém o token OAuth2 do Service Account válido, renovando em background
+    antes de expirar. Apenas uma renovação acontece por vez (single-flight):
+    envios concorrentes nunca disparam várias renovações ao mesmo tempo.
+    """
+
+    # Renovar quando faltar menos que isso para expirar (tokens do Google duram 1h)
+    MARGEM_RENOVACAO_SEGUNDOS = 300
+    # Espera antes de tentar de novo após falha na renovação em background
+    ESPERA_APOS_FALHA_SEGUNDOS = 10
+
+    def __init__(self, credentials, session=None, margem_segundos: Optional[int] = None):
+        """
+        Args:
+            credentials: Credenciais google.oauth2 (Service Account)
+            session: requests.Session usada nas chamadas ao OAuth do Google (pool compartilhado)
+            margem_segundos: Antecedência da renovação (se None, usa MARGEM_RENOVACAO_SEGUNDOS)
+        """
+        self.credentials = credentials
+        self._session = session
+        self.margem_segundos = self.MARGEM_RENOVACAO_SEGUNDOS if margem_segundos is None else margem_segundos
+        self._refresh_lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.ultima_renovacao: Optional[float] = None  # epoch (time.time)
+        self.duracao_ultima_renovacao: Optional[float] = None  # segundos
+        self.renovacoes = 0
+        self.falhas_renovacao = 0
+
+    def _segundos_para_expirar(self) -> float:
+        """Segundos até o token atual expirar (0 se não houver token)."""
+        expiry = self.credentials.expiry
+        if not self.credentials.token or expiry is None:
+            return 0.0
+        # google-auth usa datetime UTC sem timezone em expiry
+        return (expiry - datetime.utcnow()).total_seconds()
+
+    def _precisa_renovar(self) -> bool:
+        return self._segundos_para_expirar() <= self.margem_segundos
+
+    def _renovar(self):
+        """Renova o token (single-flight). Quem chega durante uma renovação só aguarda o resultado."""
+        with self._refresh_lock:
+            if not self._precisa_renovar():
+                return  # outra thread acabou de renovar
+            inicio = time.monotonic()
+            try:
+                self.credentials.refresh(Request(session=self._session))
+            except Exception:
+                self.falhas_renovacao += 1
+                raise
+            self.duracao_ultima_renovacao = time.monotonic() - inicio
+            self.ultima_renovacao = time.time()
+            self.renovacoes += 1
+            print(f"🔑 Token OAuth renovado em {self.duracao_ultima_renovacao * 1000:.0f} ms "
+                  f"(expira em {int(self._segundos_para_expirar())}s)")
+
+    def _loop(self):
+        while True:
+            try:
+                if self._precisa_renovar():
+                    self._renovar()
+                espera = max(1.0, self._segundos_para_expirar() - self.margem_segundos)
+            except Exception as e:
+                print(f"⚠️ Falha ao renovar token OAuth em background: {e}")
+                espera = self.ESPERA_APOS_FALHA_SEGUNDOS
+            self._acordar.wait(timeout=espera)
+            self._acordar.clear()
+
+    def start(self):
+        """Inicia a thread de renovação (já renova o primeiro token em background)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="fcm-token-refresh", daemon=True)
+            self._thread.start()
+
+    def token_valido(self) -> bool:
+        """True se já existe um token não expirado (get_token não vai bloquear)."""
+        return self._segundos_para_expirar() > 0
+
+    def get_token(self) -> str:
+        """
+        Retorna o token de acesso atual.
+        Se estiver perto de expirar, pede renovação à thread de background e devolve o atual,
+        que ainda é válido. Só bloqueia se não houver token válido (ex.: antes do primeiro).
+        """
+        restante = self._segundos_para_expirar()
+        if restante > self.margem_segundos:
+            return self.credentials.token
+        if restante > 0 and self._thread is not None and self._thread.is_alive():
+            self._acordar.set()
+            return self.credentials.token
+        self._renovar()
+        return self.credentials.token
+
+    def stats(self) -> Dict[str, Any]:
+        """Quando o token foi renovado pela última vez, quanto demorou e quando expira."""
+        return {
+            "ultima_renovacao": (
+                datetime.utcfromtimestamp(self.ultima_renovacao).isoformat() + "Z"
+                if self.ultima_renovacao else None
+            ),
+            "duracao_ultima_renovacao_ms": (
+                round(self.duracao_ultima_renovacao * 1000, 1)
+                if self.duracao_ultima_renovacao is not None else None
+            ),
+            "expira_em_segundos": int(max(0.0, self._segundos_para_expirar())),
+            "renovacoes": self.renovacoes,
+            "falhas_renovacao": self.falhas_renovacao,
+        }
 
 
 class FCMSender:
@@ -18,14 +309,39 @@ class FCMSender:
     
     # URL da API FCM HTTP v1
     FCM_ENDPOINT = "https://fcm.googleapis.com/v1/projects/{project_id}/messages:send"
+
+    # Máximo de envios simultâneos em send_to_multiple_tokens (FCM_MAX_CONCURRENCY)
+    MAX_CONCURRENCY_PADRAO = 10
+    # Limite de mensagens por segundo por projeto (FCM_MAX_MSGS_POR_SEGUNDO)
+    MAX_MSGS_POR_SEGUNDO_PADRAO = 500
+    # Retentativas para falhas temporárias (FCM_MAX_RETENTATIVAS)
+    MAX_RETENTATIVAS_PADRAO = 3
+    # Conexões do pool HTTP que os envios de prioridade normal não podem ocupar (FCM_CONEXOES_PRIORITARIAS)
+    CONEXOES_PRIORITARIAS_PADRAO = 4
     
-    def __init__(self, service_account_path: Optional[str] = None, project_id: Optional[str] = None):
+    def __init__(
+        self,
+        service_account_path: Optional[str] = None,
+        project_id: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        transport: Optional[HttpTransport] = None,
+        rate_limiter: Optional[Union[BucketComPrioridade, TokenBucket]] = None,
+        max_retentativas: Optional[int] = None,
+        conexoes_prioritarias: Optional[int] = None
+    ):
         """
         Inicializa o FCM Sender
         
         Args:
             service_account_path: Caminho para o arquivo JSON do Service Account
             project_id: ID do projeto Firebase (se None, será lido do Service Account)
+            max_concurrency: Máximo de envios em paralelo nos broadcasts
+                             (se None, usa FCM_MAX_CONCURRENCY ou MAX_CONCURRENCY_PADRAO)
+            transport: Transporte HTTP com pool keep-alive (se None, usa o compartilhado do processo)
+            rate_limiter: Token bucket dos envios (se None, usa o do projeto com FCM_MAX_MSGS_POR_SEGUNDO)
+            max_retentativas: Retentativas para 429/5xx/erros de rede (se None, usa FCM_MAX_RETENTATIVAS)
+            conexoes_prioritarias: Conexões do pool reservadas aos envios de prioridade alta
+                                   (se None, usa FCM_CONEXOES_PRIORITARIAS ou CONEXOES_PRIORITARIAS_PADRAO)
         """
         if service_account_path:
             if not os.path.exists(service_account_path):
@@ -61,21 +377,40 @@ class FCMSender:
         
         self.project_id = project_id
         self.endpoint = self.FCM_ENDPOINT.format(project_id=project_id)
+
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv('FCM_MAX_CONCURRENCY') or self.MAX_CONCURRENCY_PADRAO)
+        self.max_concurrency = max(1, max_concurrency)
+        self.transport = transport or get_transport()
+        self.token_manager = AccessTokenManager(self.credentials, session=self.transport.session)
+        self.token_manager.start()
+
+        if rate_limiter is None:
+            taxa = float(os.getenv('FCM_MAX_MSGS_POR_SEGUNDO') or self.MAX_MSGS_POR_SEGUNDO_PADRAO)
+            rate_limiter = bucket_do_projeto(project_id, taxa)
+        self.rate_limiter = rate_limiter
+        if max_retentativas is None:
+            max_retentativas = int(os.getenv('FCM_MAX_RETENTATIVAS') or self.MAX_RETENTATIVAS_PADRAO)
+        self.max_retentativas = max(0, max_retentativas)
+
+        # Envios normais (broadcasts) em andamento ao mesmo tempo, somando todos os broadcasts do processo:
+        # as conexões restantes do pool ficam livres para status, chamadas e pedidos de localização
+        if conexoes_prioritarias is None:
+            conexoes_prioritarias = int(os.getenv('FCM_CONEXOES_PRIORITARIAS') or self.CONEXOES_PRIORITARIAS_PADRAO)
+        self.vagas_normais = max(1, self.transport.pool_maxsize - max(0, conexoes_prioritarias))
+        self._semaforo_normal = threading.BoundedSemaphore(self.vagas_normais)
         
-        print(f"✅ FCM Sender inicializado para projeto: {project_id}")
+        print(f"✅ FCM Sender inicializado para projeto: {project_id} (concorrência: {self.max_concurrency})")
     
     def _get_access_token(self) -> str:
         """
-        Obtém token de acesso OAuth2 para autenticação na API FCM
+        Obtém token de acesso OAuth2 para autenticação na API FCM.
+        A renovação acontece em background (AccessTokenManager), fora do caminho do envio.
         
         Returns:
             Token de acesso
         """
-        # Atualizar credenciais se necessário
-        if not self.credentials.valid:
-            self.credentials.refresh(Request())
-        
-        return self.credentials.token
+        return self.token_manager.get_token()
     
     def _build_message_data_only(self, token: str, title: str, body: str, data: Optional[Dict] = None) -> Dict:
         """
@@ -101,6 +436,43 @@ class FCMSender:
             }
         }
 
+    def _build_silent_message(self, token: str, data: Dict[str, str]) -> Dict:
+        """
+        Constrói mensagem FCM APENAS com data (silenciosa), usada nos pedidos de localização.
+        """
+        return {
+            "message": {
+                "token": token,
+                "data": {str(k): str(v) for k, v in data.items()},
+                "android": {
+                    "priority": "high",
+                },
+                "apns": {
+                    "headers": {"apns-priority": "10"},
+                    "payload": {
+                        "aps": {
+                            "contentAvailable": True,
+                        }
+                    }
+                }
+            }
+        }
+
+    @staticmethod
+    def _encode_message(message: Dict) -> bytes:
+        """
+        Serializa a mensagem no corpo JSON enviado ao FCM.
+        Usado pelo FCMSender e pelo AsyncFCMSender, para que os payloads sejam idênticos byte a byte.
+        """
+        return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    @staticmethod
+    def _build_headers(access_token: str) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json; charset=UTF-8"
+        }
+
     def _build_message(self, token: str, title: str, body: str, data: Optional[Dict] = None) -> Dict:
         """
         Constrói a mensagem FCM data-only (evita duplicação no app).
@@ -108,7 +480,58 @@ class FCMSender:
         """
         return self._build_message_data_only(token, title, body, data)
     
-    def send_to_token(self, token: str, title: str, body: str, data: Optional[Dict] = None) -> Tuple[bool, Optional[str]]:
+    def _build_template(self, title: str, body: str, data: Optional[Dict] = None) -> "MessageTemplate":
+        """Template pré-serializado da mensagem de um broadcast (só o token varia)."""
+        return MessageTemplate(self._build_message(MessageTemplate.MARCADOR_TOKEN, title, body, data))
+
+    def _send_message(self, message: Dict, prioridade: int = PRIORIDADE_NORMAL) -> Dict[str, Any]:
+        """Serializa e envia uma mensagem já construída (ver _send_payload)."""
+        return self._send_payload(self._encode_message(message), prioridade)
+
+    def _post(self, payload: bytes, prioridade: int):
+        """POST ao FCM; envios normais esperam uma das vagas_normais conexões."""
+        headers = self._build_headers(self._get_access_token())
+        if prioridade >= PRIORIDADE_ALTA:
+            return self.transport.post(self.endpoint, headers=headers, data=payload, timeout=10)
+        with self._semaforo_normal:
+            return self.transport.post(self.endpoint, headers=headers, data=payload, timeout=10)
+
+    def _send_payload(self, payload: bytes, prioridade: int = PRIORIDADE_NORMAL) -> Dict[str, Any]:
+        """
+        Envia um corpo JSON já serializado, respeitando o rate limiter do projeto.
+        Falhas temporárias (429/5xx/rede) são retentadas com backoff exponencial e jitter,
+        respeitando Retry-After; um 429 também pausa o bucket para os demais envios.
+        Envios PRIORIDADE_ALTA usam a cota e as conexões reservadas (não esperam broadcasts).
+
+        Returns:
+            {"sucesso": bool, "erro": Optional[str], "falha": Optional[str],
+             "retentativas": int, "espera_throttle": float (segundos)},
+            com falha em FALHA_TOKEN_INVALIDO, FALHA_TEMPORARIA ou FALHA_OUTRA
+        """
+        controle = ControleRetentativas(self.rate_limiter, self.max_retentativas, prioridade)
+        while True:
+            espera = controle.espera_cota()
+            if espera > 0:
+                time.sleep(espera)
+
+            try:
+                response = self._post(payload, prioridade)
+            except Exception as e:
+                resultado = controle.registrar_excecao(e)
+            else:
+                resultado = controle.registrar_resposta(response)
+            if resultado is not None:
+                return resultado
+            time.sleep(controle.espera_retentativa)
+
+    def send_to_token(
+        self,
+        token: str,
+        title: str,
+        body: str,
+        data: Optional[Dict] = None,
+        prioridade: int = PRIORIDADE_ALTA
+    ) -> Tuple[bool, Optional[str]]:
         """
         Envia notificação push para um único token
         
@@ -117,87 +540,98 @@ class FCMSender:
             title: Título da notificação
             body: Corpo da notificação
             data: Dados adicionais (opcional)
+            prioridade: PRIORIDADE_ALTA (padrão: chamada individual) ou PRIORIDADE_NORMAL
         
         Returns:
             Tupla (sucesso: bool, mensagem_erro: Optional[str])
         """
-        try:
-            # Obter token de acesso
-            access_token = self._get_access_token()
-            
-            # Construir mensagem
-            message = self._build_message(token, title, body, data)
-            
-            # Fazer requisição HTTP
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(
-                self.endpoint,
-                headers=headers,
-                json=message,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                print(f"  ✅ Notificação enviada com sucesso: {result.get('name', 'N/A')}")
-                return True, None
-            else:
-                error_msg = f"Erro {response.status_code}: {response.text}"
-                print(f"  ❌ Falha ao enviar: {error_msg}")
-                return False, error_msg
-        
-        except Exception as e:
-            error_msg = f"Exceção ao enviar notificação: {str(e)}"
-            print(f"  ❌ Erro: {error_msg}")
-            return False, error_msg
+        resultado = self._send_message(self._build_message(token, title, body, data), prioridade)
+        return resultado["sucesso"], resultado["erro"]
     
     def send_to_multiple_tokens(
         self,
         tokens: List[Dict[str, str]],
         title: str,
         body: str,
-        data: Optional[Dict] = None
-    ) -> Dict[str, int]:
+        data: Optional[Dict] = None,
+        max_concurrency: Optional[int] = None,
+        prioridade: int = PRIORIDADE_NORMAL
+    ) -> Dict[str, Any]:
         """
-        Envia notificação push para múltiplos tokens
+        Envia notificação push para múltiplos tokens.
+        Os envios são feitos em paralelo, com no máximo max_concurrency requisições em andamento.
+        A mensagem é serializada uma única vez (MessageTemplate); por destinatário só o token muda.
         
         Args:
             tokens: Lista de dicionários com 'fcmToken' e 'motorista_id'
             title: Título da notificação
             body: Corpo da notificação
             data: Dados adicionais (opcional)
+            max_concurrency: Limite de envios simultâneos (se None, usa self.max_concurrency)
+            prioridade: PRIORIDADE_NORMAL (padrão: broadcast) ou PRIORIDADE_ALTA (ex.: aviso aos admins)
         
         Returns:
-            Dicionário com estatísticas: {"sucessos": int, "falhas": int}
+            Dicionário com estatísticas e resultado por token (na mesma ordem de tokens):
+            {"sucessos": int, "falhas": int, "tokens_invalidos": int,
+             "retentativas": int, "espera_throttle_s": float,
+             "resultados": [{"motorista_id": str, "sucesso": bool, "erro": Optional[str],
+                             "token_invalido": bool, "retentativas": int}, ...]}
+            Use tokens_para_remover(tokens, resultado) para obter os tokens mortos.
         """
-        sucessos = 0
-        falhas = 0
-        
-        print(f"\n📤 Enviando notificações para {len(tokens)} dispositivos...")
-        
-        for token_info in tokens:
+        concorrencia = max(1, max_concurrency or self.max_concurrency)
+
+        template = self._build_template(title, body, data)
+
+        print(f"\n📤 Enviando notificações para {len(tokens)} dispositivos (concorrência: {concorrencia})...")
+
+        def _enviar(token_info: Dict[str, str]) -> Dict[str, Any]:
             token = token_info.get('fcmToken')
             motorista_id = token_info.get('motorista_id', 'N/A')
             
             if not token:
-                print(f"  ⚠️ Token vazio para motorista {motorista_id}, pulando...")
-                falhas += 1
-                continue
-            
-            success, error = self.send_to_token(token, title, body, data)
+                return resultado_token_vazio(motorista_id)
             
-            if success:
-                sucessos += 1
-            else:
-                falhas += 1
-        
-        print(f"\n📊 Resultado: {sucessos} sucessos, {falhas} falhas")
-        
-        return {"sucessos": sucessos, "falhas": falhas}
+            envio = self._send_payload(template.render(token), prioridade)
+            return resultado_por_token(motorista_id, envio)
+
+        if concorrencia == 1 or len(tokens) <= 1:
+            resultados = [_enviar(t) for t in tokens]
+        else:
+            with ThreadPoolExecutor(max_workers=min(concorrencia, len(tokens))) as executor:
+                resultados = list(executor.map(_enviar, tokens))
+
+        return resumir_resultados(resultados)
+
+    def _build_topic_message(self, topic: str, title: str, body: str, data: Optional[Dict] = None) -> Dict:
+        """Mesma mensagem data-only de _build_message, endereçada a um tópico em vez de um token."""
+        message = self._build_message("", title, body, data)
+        del message["message"]["token"]
+        message["message"]["topic"] = topic
+        return message
+
+    def send_to_topic(
+        self,
+        topic: str,
+        title: str,
+        body: str,
+        data: Optional[Dict] = None,
+        prioridade: int = PRIORIDADE_NORMAL
+    ) -> Dict[str, Any]:
+        """
+        Envia UMA mensagem para todos os dispositivos inscritos no tópico.
+
+        Args:
+            topic: Nome do tópico (sem /topics/, ex.: base_xvtFbdOurhdNKVY08rDw)
+            title: Título da notificação
+            body: Corpo da notificação
+            data: Dados adicionais (opcional)
+            prioridade: PRIORIDADE_NORMAL (padrão: broadcast) ou PRIORIDADE_ALTA
+
+        Returns:
+            Mesmo formato de _send_payload: {"sucesso", "erro", "falha", "retentativas", "espera_throttle"}
+        """
+        print(f"\n📤 Enviando notificação para o tópico {topic}...")
+        return self._send_message(self._build_topic_message(topic, title, body, data), prioridade)
 
     def send_silent_data_only(self, token: str, data: Dict[str, str]) -> Tuple[bool, Optional[str]]:
         """
@@ -211,52 +645,61 @@ class FCMSender:
         Returns:
             Tupla (sucesso: bool, mensagem_erro: Optional[str])
         """
-        try:
-            access_token = self._get_access_token()
-
-            # FCM HTTP v1: mensagem data-only (sem notification)
-            message = {
-                "message": {
-                    "token": token,
-                    "data": {str(k): str(v) for k, v in data.items()},
-                    "android": {
-                        "priority": "high",
-                    },
-                    "apns": {
-                        "headers": {"apns-priority": "10"},
-                        "payload": {
-                            "aps": {
-                                "contentAvailable": True,
-                            }
-                        }
-                    }
-                }
-            }
+        # FCM HTTP v1: mensagem data-only (sem notification), na faixa prioritária
+        resultado = self._send_message(self._build_silent_message(token, data), PRIORIDADE_ALTA)
+        return resultado["sucesso"], resultado["erro"]
 
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
 
-            response = requests.post(
-                self.endpoint,
-                headers=headers,
-                json=message,
-                timeout=10
-            )
+def resultado_token_vazio(motorista_id: str) -> Dict[str, Any]:
+    """Resultado de um item do broadcast sem fcmToken (não é enviado)."""
+    print(f"  ⚠️ Token vazio para motorista {motorista_id}, pulando...")
+    return {"motorista_id": motorista_id, "sucesso": False, "erro": "Token vazio",
+            "token_invalido": False, "retentativas": 0, "espera_throttle": 0.0}
 
-            if response.status_code == 200:
-                print(f"  ✅ Push silenciosa enviada com sucesso")
-                return True, None
-            else:
-                error_msg = f"Erro {response.status_code}: {response.text}"
-                print(f"  ❌ Falha ao enviar push silenciosa: {error_msg}")
-                return False, error_msg
-
-        except Exception as e:
-            error_msg = f"Exceção: {str(e)}"
-            print(f"  ❌ Erro: {error_msg}")
-            return False, error_msg
+
+def resultado_por_token(motorista_id: str, envio: Dict[str, Any]) -> Dict[str, Any]:
+    """Resultado de um token no broadcast, a partir do retorno de _send_message."""
+    return {
+        "motorista_id": motorista_id,
+        "sucesso": envio["sucesso"],
+        "erro": envio["erro"],
+        "token_invalido": envio["falha"] == FALHA_TOKEN_INVALIDO,
+        "retentativas": envio["retentativas"],
+        "espera_throttle": round(envio["espera_throttle"], 3),
+    }
+
+
+def resumir_resultados(resultados: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Monta o dicionário de retorno de send_to_multiple_tokens a partir dos resultados por token."""
+    sucessos = sum(1 for r in resultados if r["sucesso"])
+    falhas = len(resultados) - sucessos
+    tokens_invalidos = sum(1 for r in resultados if r.get("token_invalido"))
+    retentativas = sum(r.get("retentativas", 0) for r in resultados)
+    espera_throttle = sum(r.get("espera_throttle", 0.0) for r in resultados)
+
+    print(f"\n📊 Resultado: {sucessos} sucessos, {falhas} falhas ({tokens_invalidos} tokens inválidos, "
+          f"{retentativas} retentativas, {espera_throttle:.1f}s aguardando cota)")
+
+    return {
+        "sucessos": sucessos,
+        "falhas": falhas,
+        "tokens_invalidos": tokens_invalidos,
+        "retentativas": retentativas,
+        "espera_throttle_s": round(espera_throttle, 3),
+        "resultados": resultados,
+    }
+
+
+def tokens_para_remover(tokens: List[Dict[str, str]], resultado: Dict[str, Any]) -> List[Dict[str, str]]:
+    """
+    Retorna os itens de tokens cujo envio falhou com token inválido/não registrado
+    (resultado de send_to_multiple_tokens, mesma ordem da lista enviada).
+    """
+    return [
+        token_info
+        for token_info, r in zip(tokens, resultado.get("resultados") or [])
+        if r.get("token_invalido")
+    ]
 
 
 if __name__ == "__main__":
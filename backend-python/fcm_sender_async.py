@@ -0,0 +1,202 @@
+"""
+fcm_sender_async.py
+
+Versão asyncio do FCMSender: envia notificações push via FCM HTTP v1 com httpx.AsyncClient.
+Permite disparar milhares de pushes a partir de um único event loop, sem uma thread por envio.
+
+Os payloads são montados e serializados pelos mesmos métodos do FCMSender
+(_build_message_data_only, _build_silent_message, _encode_message e MessageTemplate),
+então o corpo enviado é idêntico byte a byte ao do envio síncrono.
+
+Uso:
+    async with AsyncFCMSender(service_account_path) as sender:
+        resultado = await sender.send_to_multiple_tokens(tokens, "Título", "Corpo")
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from fcm_sender import (
+    ControleRetentativas,
+    FCMSender,
+    resultado_por_token,
+    resultado_token_vazio,
+    resumir_resultados,
+)
+from http_transport import FCM_HOST
+from rate_limiter import PRIORIDADE_ALTA, PRIORIDADE_NORMAL
+
+
+class AsyncFCMSender:
+    """Envia notificações push via FCM HTTP v1 com corrotinas (mesma API do FCMSender)."""
+
+    def __init__(
+        self,
+        service_account_path: Optional[str] = None,
+        project_id: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        sender: Optional[FCMSender] = None,
+        client: Optional[httpx.AsyncClient] = None
+    ):
+        """
+        Inicializa o sender assíncrono
+
+        Args:
+            service_account_path: Caminho para o arquivo JSON do Service Account
+            project_id: ID do projeto Firebase (se None, será lido do Service Account)
+            max_concurrency: Máximo de envios em andamento nos broadcasts
+                             (se None, usa o mesmo valor do FCMSender)
+            sender: FCMSender já inicializado, para reaproveitar credenciais e renovação do token
+            client: httpx.AsyncClient próprio (se None, é criado no primeiro envio)
+        """
+        self._sender = sender or FCMSender(service_account_path, project_id)
+        self.project_id = self._sender.project_id
+        self.endpoint = self._sender.endpoint
+        self.max_concurrency = max(1, max_concurrency or self._sender.max_concurrency)
+        self._client = client
+        self._client_proprio = client is None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            transport = self._sender.transport
+            limits = httpx.Limits(
+                max_connections=max(self.max_concurrency, transport.pool_maxsize),
+                max_keepalive_connections=transport.pool_maxsize,
+            )
+            self._client = httpx.AsyncClient(http2=FCM_HOST in transport.http2_hosts, limits=limits)
+        return self._client
+
+    async def aclose(self):
+        """Fecha o cliente HTTP (se foi criado por este sender)."""
+        if self._client is not None and self._client_proprio:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> "AsyncFCMSender":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def _get_access_token(self) -> str:
+        """Token OAuth2 atual; só sai do event loop se for preciso esperar a primeira renovação."""
+        token_manager = self._sender.token_manager
+        if token_manager.token_valido():
+            return token_manager.get_token()
+        return await asyncio.to_thread(token_manager.get_token)
+
+    async def _send_message(self, message: Dict, prioridade: int = PRIORIDADE_NORMAL) -> Dict[str, Any]:
+        """Serializa e envia uma mensagem já construída (ver _send_payload)."""
+        return await self._send_payload(self._sender._encode_message(message), prioridade)
+
+    async def _send_payload(self, payload: bytes, prioridade: int = PRIORIDADE_NORMAL) -> Dict[str, Any]:
+        """
+        Envia um corpo JSON já serializado (mesmo retorno de FCMSender._send_payload).
+        Usa o mesmo rate limiter e a mesma política de retentativas (ControleRetentativas) do sender síncrono.
+        """
+        controle = ControleRetentativas(self._sender.rate_limiter, self._sender.max_retentativas, prioridade)
+        while True:
+            espera = controle.espera_cota()
+            if espera > 0:
+                await asyncio.sleep(espera)
+
+            try:
+                access_token = await self._get_access_token()
+                response = await self._get_client().post(
+                    self.endpoint,
+                    headers=self._sender._build_headers(access_token),
+                    content=payload,
+                    timeout=10
+                )
+            except Exception as e:
+                resultado = controle.registrar_excecao(e)
+            else:
+                resultado = controle.registrar_resposta(response)
+            if resultado is not None:
+                return resultado
+            await asyncio.sleep(controle.espera_retentativa)
+
+    async def send_to_token(
+        self,
+        token: str,
+        title: str,
+        body: str,
+        data: Optional[Dict] = None,
+        prioridade: int = PRIORIDADE_ALTA
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Envia notificação push para um único token
+
+        Args:
+            token: Token FCM do dispositivo
+            title: Título da notificação
+            body: Corpo da notificação
+            data: Dados adicionais (opcional)
+            prioridade: PRIORIDADE_ALTA (padrão: chamada individual) ou PRIORIDADE_NORMAL
+
+        Returns:
+            Tupla (sucesso: bool, mensagem_erro: Optional[str])
+        """
+        resultado = await self._send_message(self._sender._build_message(token, title, body, data), prioridade)
+        return resultado["sucesso"], resultado["erro"]
+
+    async def send_to_multiple_tokens(
+        self,
+        tokens: List[Dict[str, str]],
+        title: str,
+        body: str,
+        data: Optional[Dict] = None,
+        max_concurrency: Optional[int] = None,
+        prioridade: int = PRIORIDADE_NORMAL
+    ) -> Dict[str, Any]:
+        """
+        Envia notificação push para múltiplos tokens, com no máximo max_concurrency envios em andamento.
+
+        Args:
+            tokens: Lista de dicionários com 'fcmToken' e 'motorista_id'
+            title: Título da notificação
+            body: Corpo da notificação
+            data: Dados adicionais (opcional)
+            max_concurrency: Limite de envios simultâneos (se None, usa self.max_concurrency)
+            prioridade: PRIORIDADE_NORMAL (padrão: broadcast) ou PRIORIDADE_ALTA
+
+        Returns:
+            Mesmo formato do FCMSender.send_to_multiple_tokens:
+            {"sucessos": int, "falhas": int, "tokens_invalidos": int,
+             "retentativas": int, "espera_throttle_s": float, "resultados": [...]}
+        """
+        concorrencia = max(1, max_concurrency or self.max_concurrency)
+        semaforo = asyncio.Semaphore(concorrencia)
+        template = self._sender._build_template(title, body, data)
+
+        print(f"\n📤 Enviando notificações para {len(tokens)} dispositivos (async, concorrência: {concorrencia})...")
+
+        async def _enviar(token_info: Dict[str, str]) -> Dict[str, Any]:
+            token = token_info.get('fcmToken')
+            motorista_id = token_info.get('motorista_id', 'N/A')
+
+            if not token:
+                return resultado_token_vazio(motorista_id)
+
+            async with semaforo:
+                envio = await self._send_payload(template.render(token), prioridade)
+            return resultado_por_token(motorista_id, envio)
+
+        resultados = list(await asyncio.gather(*(_enviar(t) for t in tokens)))
+        return resumir_resultados(resultados)
+
+    async def send_silent_data_only(self, token: str, data: Dict[str, str]) -> Tuple[bool, Optional[str]]:
+        """
+        Envia mensagem FCM APENAS com data (silenciosa) - sem notification.
+
+        Args:
+            token: Token FCM do dispositivo
+            data: Dados no formato {"chave": "valor"} - todos strings
+
+        Returns:
+            Tupla (sucesso: bool, mensagem_erro: Optional[str])
+        """
+        resultado = await self._send_message(self._sender._build_silent_message(token, data), PRIORIDADE_ALTA)
+        return resultado["sucesso"], resultado["erro"]
@@ -0,0 +1,407 @@
+"""
+fcm_topics.py
+
+Broadcast por tópico FCM: os dispositivos dos motoristas de cada base ficam inscritos no
+tópico base_<baseId>, e um /notify/base vira UMA mensagem para o tópico, com custo constante
+independente do tamanho da base.
+
+As inscrições são mantidas pela API de Instance ID (iid.googleapis.com/iid/v1:batchAdd e
+:batchRemove, até 1000 tokens por chamada). Um listener do Firestore na subcoleção
+motoristas acompanha as mudanças de fcmToken e só o que mudou é inscrito/desinscrito.
+No máximo max_bases bases ficam com listener (a usada há mais tempo sai primeiro), e um listener
+que parou é recriado no próximo broadcast da base, com nova reconciliação.
+As inscrições confirmadas ficam num SQLite, então um reinício não reinscreve a base inteira.
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from fcm_sender import FCMSender
+
+
+IID_BATCH_ADD = "https://iid.googleapis.com/iid/v1:batchAdd"
+IID_BATCH_REMOVE = "https://iid.googleapis.com/iid/v1:batchRemove"
+IID_MAX_TOKENS_POR_LOTE = 1000
+
+
+def topico_da_base(base_id: str) -> str:
+    """Nome do tópico FCM da base (ex.: base_xvtFbdOurhdNKVY08rDw)."""
+    return f"base_{base_id}"
+
+
+def _token_valido(token) -> Optional[str]:
+    return token if isinstance(token, str) and len(token) > 0 else None
+
+
+class _Observacao:
+    """Listener de tokens de uma base (watch é None enquanto o on_snapshot está sendo criado)."""
+
+    def __init__(self):
+        self.watch = None
+
+    def ativa(self) -> bool:
+        return self.watch is None or getattr(self.watch, 'is_active', True)
+
+    def encerrar(self):
+        if self.watch is not None:
+            try:
+                self.watch.unsubscribe()
+            except Exception:
+                pass
+
+
+class TopicSubscriptions:
+    """
+    Mantém os tokens dos motoristas de cada base inscritos no tópico da base.
+
+    Mudanças de token são acumuladas por alguns segundos (janela_lote) e aplicadas em lote:
+    primeiro batchRemove dos tokens antigos, depois batchAdd dos novos.
+    Se a IID falhar, o lote é reagendado com backoff exponencial até passar.
+    Snapshots, reconciliações e lotes de uma mesma base rodam um de cada vez (lock por base).
+    """
+
+    JANELA_LOTE_PADRAO = 2.0
+    MAX_BASES_PADRAO = 50
+    RETENTATIVA_BASE_SEGUNDOS = 5.0
+    RETENTATIVA_MAX_SEGUNDOS = 300.0
+
+    def __init__(
+        self,
+        sender: FCMSender,
+        db_path: Optional[str] = None,
+        janela_lote: Optional[float] = None,
+        max_bases: Optional[int] = None
+    ):
+        """
+        Args:
+            sender: FCMSender (fornece o token OAuth e o transporte HTTP)
+            db_path: SQLite das inscrições confirmadas (se None, usa FCM_TOPICOS_DB ou fcm_topics.db
+                     na pasta do backend)
+            janela_lote: Segundos acumulando mudanças de token antes de chamar a IID
+                         (se None, usa FCM_TOPICOS_JANELA_S ou JANELA_LOTE_PADRAO)
+            max_bases: Bases com listener de tokens ao mesmo tempo
+                       (se None, usa FCM_TOPICOS_MAX_BASES ou MAX_BASES_PADRAO)
+        """
+        if db_path is None:
+            db_path = os.getenv('FCM_TOPICOS_DB') or os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), 'fcm_topics.db'
+            )
+        if janela_lote is None:
+            janela_lote = float(os.getenv('FCM_TOPICOS_JANELA_S') or self.JANELA_LOTE_PADRAO)
+        if max_bases is None:
+            max_bases = int(os.getenv('FCM_TOPICOS_MAX_BASES') or self.MAX_BASES_PADRAO)
+        self.sender = sender
+        self.db_path = db_path
+        self.janela_lote = max(0.0, janela_lote)
+        self.max_bases = max(1, max_bases)
+
+        self._lock = threading.RLock()
+        self._confirmadas: Dict[str, Dict[str, str]] = {}              # base_id -> {motorista_id: token}
+        self._pendentes: Dict[str, Dict[str, Optional[str]]] = {}      # base_id -> {motorista_id: token desejado}
+        self._timers: Dict[str, threading.Timer] = {}
+        self._observadas: "OrderedDict[str, _Observacao]" = OrderedDict()  # base_id -> listener (ordem de uso)
+        self._locks_base: Dict[str, threading.RLock] = {}              # serializa snapshots e lotes da base
+        self._reconciliando = set()                                    # sincronizar() ainda não aplicado
+        self._prontas = set()
+        self._falhas_seguidas: Dict[str, int] = {}                     # base_id -> falhas da IID em sequência
+
+        self.inscritos = 0
+        self.desinscritos = 0
+        self.tokens_rejeitados = 0
+        self.chamadas_iid = 0
+        self.falhas_iid = 0
+        self.listeners_recriados = 0
+        self.listeners_descartados = 0
+
+        self._criar_tabela()
+
+    def _conectar(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _criar_tabela(self):
+        conn = self._conectar()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS inscricoes (
+                    base_id TEXT NOT NULL,
+                    motorista_id TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    atualizado_em REAL NOT NULL,
+                    PRIMARY KEY (base_id, motorista_id)
+                )
+                """
+            )
+        finally:
+            conn.close()
+
+    def _confirmadas_da_base(self, base_id: str) -> Dict[str, str]:
+        confirmadas = self._confirmadas.get(base_id)
+        if confirmadas is None:
+            conn = self._conectar()
+            try:
+                rows = conn.execute(
+                    "SELECT motorista_id, token FROM inscricoes WHERE base_id = ?", (base_id,)
+                ).fetchall()
+            finally:
+                conn.close()
+            confirmadas = self._confirmadas[base_id] = {m: t for m, t in rows}
+        return confirmadas
+
+    def _lock_da_base(self, base_id: str) -> threading.RLock:
+        with self._lock:
+            lock = self._locks_base.get(base_id)
+            if lock is None:
+                lock = self._locks_base[base_id] = threading.RLock()
+            return lock
+
+    def pronta(self, base_id: str) -> bool:
+        """True se a base já foi sincronizada inteira ao menos uma vez (tópico pode ser usado)."""
+        with self._lock:
+            return base_id in self._prontas
+
+    def atualizar_token(self, base_id: str, motorista_id: str, token: Optional[str]):
+        """
+        Registra o token atual de um motorista (None se removido ou sem token).
+        A inscrição é ajustada no próximo lote da base.
+        """
+        token = _token_valido(token)
+        with self._lock_da_base(base_id), self._lock:
+            confirmado = self._confirmadas_da_base(base_id).get(motorista_id)
+            pendentes = self._pendentes.setdefault(base_id, {})
+            if token == pendentes.get(motorista_id, confirmado):
+                return
+            if token == confirmado:
+                pendentes.pop(motorista_id, None)  # voltou ao que já está inscrito
+            else:
+                pendentes[motorista_id] = token
+            if not pendentes or base_id in self._timers:
+                return  # já há um lote (ou uma retentativa) agendado para a base
+            self._agendar(base_id, self.janela_lote)
+
+    def _agendar(self, base_id: str, espera: float):
+        """Agenda aplicar(base_id) daqui a `espera` segundos (chamar com o lock)."""
+        timer = threading.Timer(espera, self._disparar, args=(base_id,))
+        timer.daemon = True
+        self._timers[base_id] = timer
+        timer.start()
+
+    def sincronizar(self, base_id: str, tokens: Dict[str, Optional[str]]):
+        """
+        Reconciliação completa da base: tokens é o estado atual {motorista_id: fcmToken}.
+        Só as diferenças em relação às inscrições confirmadas geram chamadas à IID.
+        A base fica pronta quando essas diferenças forem aplicadas (na hora ou numa retentativa).
+        """
+        with self._lock_da_base(base_id):
+            with self._lock:
+                self._reconciliando.add(base_id)
+                motoristas = (
+                    set(tokens) | set(self._confirmadas_da_base(base_id)) | set(self._pendentes.get(base_id, {}))
+                )
+                for motorista_id in motoristas:
+                    self.atualizar_token(base_id, motorista_id, tokens.get(motorista_id))
+            self.aplicar(base_id)
+
+    def _disparar(self, base_id: str):
+        try:
+            self.aplicar(base_id)
+        except Exception as e:
+            print(f"⚠️ Erro ao sincronizar inscrições do tópico da base {base_id}: {e}")
+
+    def _aplicado(self, base_id: str):
+        """Lote aplicado com sucesso: zera o backoff e, se era a reconciliação, libera o tópico (com o lock)."""
+        self._falhas_seguidas.pop(base_id, None)
+        if base_id in self._reconciliando and not self._pendentes.get(base_id):
+            self._reconciliando.discard(base_id)
+            self._prontas.add(base_id)
+
+    def _reagendar_apos_falha(self, base_id: str) -> float:
+        """Agenda nova tentativa da base com backoff exponencial e jitter (com o lock)."""
+        falhas = self._falhas_seguidas.get(base_id, 0) + 1
+        self._falhas_seguidas[base_id] = falhas
+        teto = min(self.RETENTATIVA_MAX_SEGUNDOS, self.RETENTATIVA_BASE_SEGUNDOS * (2 ** (falhas - 1)))
+        espera = random.uniform(teto / 2, teto)
+        if base_id not in self._timers:
+            self._agendar(base_id, espera)
+        return espera
+
+    def _chamar_iid(self, url: str, topico: str, tokens: List[str]) -> List[Optional[str]]:
+        """
+        Chama batchAdd/batchRemove em lotes de até IID_MAX_TOKENS_POR_LOTE.
+
+        Returns:
+            Erro por token (None = ok), na mesma ordem de tokens
+        """
+        erros: List[Optional[str]] = []
+        for i in range(0, len(tokens), IID_MAX_TOKENS_POR_LOTE):
+            lote = tokens[i:i + IID_MAX_TOKENS_POR_LOTE]
+            self.chamadas_iid += 1
+            response = self.sender.transport.post(
+                url,
+                json={"to": f"/topics/{topico}", "registration_tokens": lote},
+                headers={
+                    "Authorization": f"Bearer {self.sender._get_access_token()}",
+                    "access_token_auth": "true",
+                },
+                timeout=30
+            )
+            if response.status_code != 200:
+                self.falhas_iid += 1
+                raise RuntimeError(f"IID {response.status_code}: {response.text[:200]}")
+            resultados = (response.json() or {}).get("results") or []
+            erros.extend((r or {}).get("error") for r in resultados)
+            erros.extend([None] * (len(lote) - len(resultados)))
+        return erros
+
+    def aplicar(self, base_id: str):
+        """
+        Aplica agora as mudanças pendentes da base (batchRemove + batchAdd).
+        Segura o lock da base até confirmar, para que um snapshot não reenfileire o que está em andamento.
+        """
+        with self._lock_da_base(base_id):
+            self._aplicar(base_id)
+
+    def _aplicar(self, base_id: str):
+        with self._lock:
+            timer = self._timers.pop(base_id, None)
+            if timer is not None:
+                timer.cancel()
+            pendentes = self._pendentes.pop(base_id, {})
+            confirmadas = dict(self._confirmadas_da_base(base_id))
+            if not pendentes:
+                self._aplicado(base_id)
+                return
+
+        topico = topico_da_base(base_id)
+        remover = sorted({confirmadas[m] for m in pendentes if confirmadas.get(m)})
+        adicionar = {m: t for m, t in pendentes.items() if t}
+        try:
+            if remover:
+                self._chamar_iid(IID_BATCH_REMOVE, topico, remover)
+            erros = self._chamar_iid(IID_BATCH_ADD, topico, list(adicionar.values())) if adicionar else []
+        except Exception:
+            # Falha da IID: as mudanças voltam para os pendentes e uma nova tentativa é agendada
+            with self._lock:
+                novos = self._pendentes.setdefault(base_id, {})
+                for motorista_id, token in pendentes.items():
+                    novos.setdefault(motorista_id, token)
+                espera = self._reagendar_apos_falha(base_id)
+            print(f"🔁 Inscrições do tópico {topico}: nova tentativa em {espera:.0f}s")
+            raise
+
+        rejeitados = {m for (m, _), erro in zip(adicionar.items(), erros) if erro}
+        agora = time.time()
+        conn = self._conectar()
+        try:
+            conn.execute("BEGIN")
+            with self._lock:
+                confirmadas = self._confirmadas_da_base(base_id)
+                for motorista_id, token in pendentes.items():
+                    if token and motorista_id not in rejeitados:
+                        confirmadas[motorista_id] = token
+                        conn.execute(
+                            "INSERT OR REPLACE INTO inscricoes (base_id, motorista_id, token, atualizado_em) "
+                            "VALUES (?, ?, ?, ?)",
+                            (base_id, motorista_id, token, agora),
+                        )
+                    else:
+                        confirmadas.pop(motorista_id, None)
+                        conn.execute(
+                            "DELETE FROM inscricoes WHERE base_id = ? AND motorista_id = ?",
+                            (base_id, motorista_id),
+                        )
+                self.inscritos += len(adicionar) - len(rejeitados)
+                self.desinscritos += len(remover)
+                self.tokens_rejeitados += len(rejeitados)
+                self._aplicado(base_id)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        print(f"🔔 Tópico {topico}: +{len(adicionar) - len(rejeitados)} inscritos, "
+              f"-{len(remover)} removidos, {len(rejeitados)} tokens rejeitados")
+
+    def observar_base(self, reader, base_id: str):
+        """
+        Começa a acompanhar os fcmToken da base (idempotente; recria o listener se ele parou).
+        O primeiro snapshot faz a reconciliação completa; os seguintes só aplicam as mudanças.
+        Acima de max_bases, o listener da base usada há mais tempo é encerrado e ela volta a não estar
+        pronta (o próximo broadcast dela vai por token enquanto reconcilia de novo).
+
+        Args:
+            reader: FirestoreReader
+            base_id: ID da base
+        """
+        encerrar: List[_Observacao] = []
+        with self._lock:
+            observacao = self._observadas.get(base_id)
+            if observacao is not None:
+                if observacao.ativa():
+                    self._observadas.move_to_end(base_id)
+                    return
+                # Listener parou: as mudanças de token deixaram de chegar, então a base reconcilia de novo
+                encerrar.append(self._observadas.pop(base_id))
+                self._prontas.discard(base_id)
+                self.listeners_recriados += 1
+                print(f"🔁 Listener de tokens da base {base_id} parou; recriando")
+            observacao = self._observadas[base_id] = _Observacao()
+            while len(self._observadas) > self.max_bases:
+                antigo_id, antiga = self._observadas.popitem(last=False)
+                self._prontas.discard(antigo_id)
+                self.listeners_descartados += 1
+                encerrar.append(antiga)
+        for antiga in encerrar:
+            antiga.encerrar()
+
+        def _on_snapshot(docs, changes, read_time):
+            try:
+                with self._lock_da_base(base_id):
+                    with self._lock:
+                        if self._observadas.get(base_id) is not observacao:
+                            return  # listener substituído ou descartado
+                    if not self.pronta(base_id):
+                        self.sincronizar(base_id, {doc.id: (doc.to_dict() or {}).get('fcmToken') for doc in docs})
+                        return
+                    for change in changes:
+                        removido = change.type.name == 'REMOVED'
+                        token = None if removido else (change.document.to_dict() or {}).get('fcmToken')
+                        self.atualizar_token(base_id, change.document.id, token)
+            except Exception as e:
+                print(f"⚠️ Erro ao processar mudanças de tokens da base {base_id}: {e}")
+
+        try:
+            watch = reader.observar_motoristas(base_id, _on_snapshot)
+        except Exception:
+            with self._lock:
+                if self._observadas.get(base_id) is observacao:
+                    del self._observadas[base_id]
+            raise
+        with self._lock:
+            observacao.watch = watch
+            descartada = self._observadas.get(base_id) is not observacao
+        if descartada:
+            observacao.encerrar()  # descartada pelo limite enquanto o listener era criado
+            return
+        print(f"👀 Acompanhando tokens da base {base_id} para o tópico {topico_da_base(base_id)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "bases_observadas": len(self._observadas),
+                "max_bases": self.max_bases,
+                "listeners_recriados": self.listeners_recriados,
+                "listeners_descartados": self.listeners_descartados,
+                "bases_prontas": len(self._prontas),
+                "inscritos": self.inscritos,
+                "desinscritos": self.desinscritos,
+                "tokens_rejeitados": self.tokens_rejeitados,
+                "chamadas_iid": self.chamadas_iid,
+                "falhas_iid": self.falhas_iid,
+                "mudancas_pendentes": sum(len(p) for p in self._pendentes.values()),
+                "bases_em_retentativa": len(self._falhas_seguidas),
+            }
@@ -6,27 +6,89 @@ Conecta ao Firestore usando Firebase Admin SDK com Service Account.
 """
 
 import os
+import threading
 import time
 from collections import Counter
-from typing import List, Dict, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from base_directory import BaseDirectory, DiretorioDaBase
+from context_cache import ContextCache
+from devolucao_rollup import (
+    COLECAO_RESUMO,
+    DOC_ESTADO,
+    DevolucaoRollup,
+    MAX_RECENTES,
+    aplicar_no_resumo,
+    base_reconstruida,
+    mes_anterior,
+    resumo_vazio,
+)
+from query_planner import (
+    ADMINS_DA_BASE,
+    DISPONIBILIDADES_DO_DIA,
+    MOTORISTA_POR_AUTH_UID,
+    MODALIDADES,
+    MOTORISTA_POR_AUTH_UID_GLOBAL,
+    MOTORISTAS_COM_MODALIDADE,
+    MOTORISTAS_DA_BASE,
+    MOTORISTAS_INATIVOS,
+    MOTORISTAS_INATIVOS_COM_MODALIDADE,
+    MOTORISTAS_INATIVOS_POR_MODALIDADE,
+    MOTORISTAS_POR_MODALIDADE,
+    MOTORISTAS_COM_TOKEN,
+    PAPEIS_ADMIN,
+    QUINZENAS_DO_MES,
+    USUARIO_POR_AUTH_UID,
+    USUARIO_POR_AUTH_UID_GLOBAL,
+    variantes_modalidade,
+)
+from role_index import COLECOES_INDICE, RoleIndex, papel_por_precedencia
+from cache_backends import criar_cache
+
 
 class FirestoreReader:
     """Classe para ler dados do Firestore"""
 
-    # Cache em memória: { base_id: (timestamp, contexto_str) }
-    _contexto_cache: Dict[str, tuple] = {}
-    _CACHE_TTL_SEGUNDOS = 120  # 2 minutos
+    # Seções do contexto do assistente, na ordem em que aparecem no texto (lidas em paralelo)
+    _SECOES_CONTEXTO = (
+        'base', 'config', 'motoristas', 'escala', 'eta',
+        'disponibilidade', 'quinzena', 'devolucoes', 'avisos',
+    )
+    _executor_secoes: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+    # Agregações count() da visão do superadmin (pool próprio, para não ocupar o das seções do contexto)
+    _CONTAGEM_WORKERS_PADRAO = 8
+    _executor_contagens: Optional[ThreadPoolExecutor] = None
+    # Seções que leem documentos fixos (buscados juntos num único get_all quando mais de uma precisa recarregar)
+    _SECOES_COM_DOCUMENTOS = ('base', 'config', 'escala', 'devolucoes')
+    # Documentos por chamada de get_all
+    _TAMANHO_LOTE_GET_ALL = 100
+    # Coordenadas do galpão (lidas a cada /location/receive; mudam raramente)
+    _GALPAO_TTL_SEGUNDOS = 300
     
-    def __init__(self, service_account_path: Optional[str] = None):
+    def __init__(
+        self,
+        service_account_path: Optional[str] = None,
+        usar_diretorio: Optional[bool] = None,
+        usar_indice_papeis: Optional[bool] = None,
+        usar_resumo_devolucoes: Optional[bool] = None
+    ):
         """
         Inicializa o Firebase Admin SDK
         
         Args:
             service_account_path: Caminho para o arquivo JSON do Service Account.
                                 Se None, tenta usar variável de ambiente ou inicialização padrão.
+            usar_diretorio: Responder tokens e papéis do diretório em memória por base (BaseDirectory).
+                            Se None, usa FIRESTORE_DIRETORIO (padrão: ligado; "0" desliga).
+            usar_indice_papeis: Resolver get_usuario_papel_in_any_base pelo índice UID -> base (RoleIndex).
+                                Se None, usa FIRESTORE_INDICE_PAPEIS (padrão: ligado; "0" desliga).
+            usar_resumo_devolucoes: Manter e ler bases/{baseId}/devolucoes_resumo/{yyyy-mm} (DevolucaoRollup).
+                                    Se None, usa DEVOLUCOES_RESUMO (padrão: ligado; "0" desliga).
         """
         # Verificar se já foi inicializado
         if not firebase_admin._apps:
@@ -47,7 +109,76 @@ class FirestoreReader:
             firebase_admin.initialize_app(cred)
         
         self.db = firestore.client()
+        if usar_diretorio is None:
+            usar_diretorio = os.getenv('FIRESTORE_DIRETORIO', '1').strip() not in ('0', 'false', 'False')
+        self.diretorio = BaseDirectory(self.db) if usar_diretorio else None
+        if usar_indice_papeis is None:
+            usar_indice_papeis = os.getenv('FIRESTORE_INDICE_PAPEIS', '1').strip() not in ('0', 'false', 'False')
+        self.indice_papeis = RoleIndex(self.db) if usar_indice_papeis else None
+        # Contexto do assistente em cache por seção (TTL próprio; escala e motoristas invalidados por snapshot)
+        self.cache_contexto = ContextCache(self.db)
+        if self.diretorio is not None:
+            self.diretorio.ao_mudar(self._ao_mudar_diretorio)
+        if usar_resumo_devolucoes is None:
+            usar_resumo_devolucoes = os.getenv('DEVOLUCOES_RESUMO', '1').strip() not in ('0', 'false', 'False')
+        self.devolucoes_resumo = DevolucaoRollup(
+            self.db, ao_mudar=lambda base_id: self.cache_contexto.invalidar(base_id, 'devolucoes')
+        ) if usar_resumo_devolucoes else None
+        self.cache_galpao = criar_cache(
+            'galpao',
+            max_itens=int(os.getenv('FIRESTORE_DIRETORIO_MAX_BASES') or BaseDirectory.MAX_BASES_PADRAO) * 4,
+            ttl_segundos=float(os.getenv('GALPAO_CACHE_TTL_S') or self._GALPAO_TTL_SEGUNDOS),
+        )
         print("✅ Firebase Admin SDK inicializado com sucesso")
+
+    def _ao_mudar_diretorio(self, base_id: str, col: str):
+        if col == 'motoristas':
+            self.cache_contexto.invalidar_motoristas(base_id)
+
+    def _diretorio_da_base(self, base_id: str) -> Optional[DiretorioDaBase]:
+        """Diretório em memória da base, ou None (desligado ou ainda não hidratado)."""
+        if self.diretorio is None:
+            return None
+        return self.diretorio.get(base_id)
+
+    def ler_documentos(self, refs: Iterable[Any], field_paths: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Lê documentos conhecidos com get_all (uma RPC por lote de _TAMANHO_LOTE_GET_ALL), em vez de um get() por documento.
+
+        Args:
+            refs: DocumentReferences (repetidas são lidas uma vez)
+            field_paths: Campos a trazer (None = documento inteiro)
+
+        Returns:
+            {caminho: DocumentSnapshot}; documentos inexistentes vêm com exists=False
+        """
+        unicas = list({ref.path: ref for ref in refs}.values())
+        snapshots = {}
+        for i in range(0, len(unicas), self._TAMANHO_LOTE_GET_ALL):
+            for snap in self.db.get_all(unicas[i:i + self._TAMANHO_LOTE_GET_ALL], field_paths=field_paths):
+                snapshots[snap.reference.path] = snap
+        return snapshots
+
+    @staticmethod
+    def _ler(ref, lote: Optional[Future]):
+        """Snapshot de ref: do lote get_all já disparado (se o incluiu), senão get() direto."""
+        if lote is not None:
+            snap = lote.result().get(ref.path)
+            if snap is not None:
+                return snap
+        return ref.get()
+
+    @staticmethod
+    def _token_info(motorista_id: str, data: Dict, nome_padrao: str) -> Optional[Dict[str, str]]:
+        """{"motorista_id", "fcmToken", "nome"} se o documento tem fcmToken válido."""
+        fcm_token = data.get('fcmToken')
+        if fcm_token and isinstance(fcm_token, str) and len(fcm_token) > 0:
+            return {
+                "motorista_id": motorista_id,
+                "fcmToken": fcm_token,
+                "nome": data.get('nome') or nome_padrao
+            }
+        return None
     
     def get_motoristas_tokens(self, base_id: str) -> List[Dict[str, str]]:
         """
@@ -63,14 +194,24 @@ class FirestoreReader:
                 {"motorista_id": "def456", "fcmToken": "token2"}
             ]
         """
+        diretorio = self._diretorio_da_base(base_id)
+        if diretorio is not None:
+            tokens = [
+                info for info in (
+                    self._token_info(m['id'], m, 'Motorista') for m in diretorio.listar('motoristas')
+                ) if info
+            ]
+            print(f"📊 Total de tokens encontrados (diretório): {len(tokens)}")
+            return tokens
+
         motoristas_ref = self.db.collection('bases').document(base_id).collection('motoristas')
         
-        # Buscar todos os documentos
-        docs = motoristas_ref.stream()
+        # Só documentos com fcmToken não vazio, e só os campos fcmToken e nome
+        docs = MOTORISTAS_COM_TOKEN.montar(motoristas_ref, "").stream()
         
         tokens = []
         for doc in docs:
-            data = doc.to_dict()
+            data = doc.to_dict() or {}
             motorista_id = doc.id
             fcm_token = data.get('fcmToken')
             
@@ -82,12 +223,22 @@ class FirestoreReader:
                     "nome": data.get('nome', 'Motorista')
                 })
                 print(f"  ✅ Token encontrado para motorista {motorista_id} ({data.get('nome', 'N/A')})")
-            else:
-                print(f"  ⚠️ Motorista {motorista_id} não possui fcmToken válido")
         
         print(f"\n📊 Total de tokens encontrados: {len(tokens)}")
         return tokens
     
+    def observar_motoristas(self, base_id: str, callback):
+        """
+        Registra um listener (on_snapshot) na subcoleção motoristas da base.
+        callback(docs, changes, read_time) roda numa thread do Firestore a cada mudança;
+        o primeiro snapshot traz todos os documentos.
+
+        Returns:
+            Watch do Firestore (use .unsubscribe() para parar)
+        """
+        motoristas_ref = self.db.collection('bases').document(base_id).collection('motoristas')
+        return motoristas_ref.on_snapshot(callback)
+
     def get_admins_tokens(self, base_id: str) -> List[Dict[str, str]]:
         """
         Busca tokens FCM de admins, auxiliares e superadmins da base.
@@ -96,13 +247,23 @@ class FirestoreReader:
         Returns:
             Lista de dicionários com motorista_id, fcmToken e nome
         """
+        diretorio = self._diretorio_da_base(base_id)
+        if diretorio is not None:
+            return [
+                info for info in (
+                    self._token_info(m['id'], m, 'Admin') for m in diretorio.listar('motoristas')
+                    if (m.get('papel') or '').strip().lower() in PAPEIS_ADMIN
+                ) if info
+            ]
+
         motoristas_ref = self.db.collection('bases').document(base_id).collection('motoristas')
-        docs = motoristas_ref.stream()
+        # Só os campos usados; o papel é normalizado aqui (strip/lower), como no diretório
+        docs = ADMINS_DA_BASE.montar(motoristas_ref).stream()
         tokens = []
         for doc in docs:
-            data = doc.to_dict()
+            data = doc.to_dict() or {}
             papel = (data.get('papel') or '').strip().lower()
-            if papel not in ('admin', 'auxiliar', 'superadmin', 'ajudante'):
+            if papel not in PAPEIS_ADMIN:
                 continue
             fcm_token = data.get('fcmToken')
             if fcm_token and isinstance(fcm_token, str) and len(fcm_token) > 0:
@@ -124,8 +285,13 @@ class FirestoreReader:
         Returns:
             Dicionário com motorista_id, fcmToken e nome, ou None se não encontrado
         """
+        diretorio = self._diretorio_da_base(base_id)
+        if diretorio is not None:
+            motorista = diretorio.documento('motoristas', motorista_id)
+            return self._token_info(motorista_id, motorista, 'Motorista') if motorista else None
+
         motorista_ref = self.db.collection('bases').document(base_id).collection('motoristas').document(motorista_id)
-        doc = motorista_ref.get()
+        doc = motorista_ref.get(field_paths=['fcmToken', 'nome'])
         
         if not doc.exists:
             return None
@@ -142,6 +308,46 @@ class FirestoreReader:
         
         return None
     
+    def remover_tokens_invalidos(self, base_id: str, tokens: List[Dict[str, str]]) -> int:
+        """
+        Limpa fcmToken dos motoristas cujos tokens o FCM rejeitou como inválidos/não registrados.
+        Relê os documentos num único get_all e só apaga o campo se ainda for o mesmo token
+        (o app pode ter registrado um token novo enquanto o envio acontecia).
+        As escritas vão em lotes (batch) de até 500 operações.
+
+        Args:
+            base_id: ID da base no Firestore
+            tokens: Itens {"motorista_id", "fcmToken"} (ex.: fcm_sender.tokens_para_remover)
+
+        Returns:
+            Quantidade de tokens removidos
+        """
+        mortos = {t.get('motorista_id'): t.get('fcmToken') for t in tokens if t.get('motorista_id') and t.get('fcmToken')}
+        if not mortos:
+            return 0
+
+        motoristas_ref = self.db.collection('bases').document(base_id).collection('motoristas')
+        refs = [motoristas_ref.document(mid) for mid in mortos]
+
+        removidos = 0
+        batch = self.db.batch()
+        pendentes = 0
+        for doc in self.db.get_all(refs, field_paths=['fcmToken']):
+            if not doc.exists or (doc.to_dict() or {}).get('fcmToken') != mortos.get(doc.id):
+                continue
+            batch.update(doc.reference, {'fcmToken': firestore.DELETE_FIELD})
+            pendentes += 1
+            removidos += 1
+            if pendentes == 500:
+                batch.commit()
+                batch = self.db.batch()
+                pendentes = 0
+        if pendentes:
+            batch.commit()
+
+        print(f"🗑️ Tokens FCM inválidos removidos na base {base_id}: {removidos} de {len(mortos)}")
+        return removidos
+
     def get_all_bases(self) -> List[str]:
         """
         Retorna lista de IDs de todas as bases no Firestore
@@ -156,13 +362,98 @@ class FirestoreReader:
         print(f"📋 Bases encontradas: {len(base_ids)}")
         return base_ids
 
+    @staticmethod
+    def contar(query) -> int:
+        """Quantidade de documentos da consulta com count() no servidor (sem baixar os documentos)."""
+        resultado = query.count(alias='total').get()
+        return int(resultado[0][0].value) if resultado else 0
+
+    @staticmethod
+    def _contagem_vazia() -> Dict[str, int]:
+        return {"total": 0, **{modalidade: 0 for modalidade in MODALIDADES}, "OUTRAS": 0}
+
+    def contar_motoristas_ativos_bases(self, base_ids: Iterable[str]) -> Dict[str, Dict[str, int]]:
+        """
+        Motoristas ativos (papel motorista) de cada base, no total e por modalidade, sem baixar documentos.
+        Bases com diretório já hidratado são contadas em memória (sem criar listeners para as demais);
+        as outras com agregações count(), disparadas em paralelo no pool de contagens (FIRESTORE_CONTAGEM_WORKERS).
+        Mesma regra nos dois caminhos: ativo ausente é ativo, modalidade ausente ou vazia é FROTA e
+        OUTRAS é o total menos as modalidades conhecidas. Nas agregações, a caixa da modalidade só é
+        reconhecida nas grafias de variantes_modalidade (as demais caem em OUTRAS).
+
+        Returns:
+            {baseId: {"total", "FROTA", "PASSEIO", "DEDICADO", "UTILITARIO", "OUTRAS"}}
+        """
+        contagens: Dict[str, Dict[str, int]] = {}
+        futuros: List[Tuple[str, str, int, Future]] = []
+        for base_id in base_ids:
+            diretorio = self.diretorio.se_hidratado(base_id) if self.diretorio is not None else None
+            if diretorio is not None:
+                contagem = self._contagem_vazia()
+                for m in diretorio.listar('motoristas'):
+                    if m.get('papel') == 'motorista' and m.get('ativo') is not False:
+                        modalidade = (m.get('modalidade') or 'FROTA').upper()
+                        contagem["total"] += 1
+                        contagem[modalidade if modalidade in MODALIDADES else "OUTRAS"] += 1
+                contagens[base_id] = contagem
+                continue
+            motoristas_ref = self.db.collection('bases').document(base_id).collection('motoristas')
+            # ativo ausente conta como ativo: contagem de todos menos a dos inativos (ativo == false)
+            consultas = [
+                ("total", 1, MOTORISTAS_DA_BASE.montar(motoristas_ref, 'motorista', projetar=False)),
+                ("total", -1, MOTORISTAS_INATIVOS.montar(motoristas_ref, 'motorista', False)),
+            ]
+            # Cada modalidade conhecida contada explicitamente (FROTA também com modalidade vazia)
+            for modalidade in MODALIDADES:
+                variantes = variantes_modalidade(modalidade) + ([''] if modalidade == 'FROTA' else [])
+                consultas.append((modalidade, 1, MOTORISTAS_POR_MODALIDADE.montar(motoristas_ref, 'motorista', variantes)))
+                consultas.append((modalidade, -1, MOTORISTAS_INATIVOS_POR_MODALIDADE.montar(
+                    motoristas_ref, 'motorista', variantes, False
+                )))
+            # Sem o campo modalidade (ou null) também é FROTA: fora de qualquer filtro, sai do total menos quem tem
+            consultas.append(("_com_modalidade", 1, MOTORISTAS_COM_MODALIDADE.montar(motoristas_ref, 'motorista', None)))
+            consultas.append(("_com_modalidade", -1, MOTORISTAS_INATIVOS_COM_MODALIDADE.montar(
+                motoristas_ref, 'motorista', False, None
+            )))
+            for chave, sinal, consulta in consultas:
+                futuros.append((base_id, chave, sinal, self._executor_contagem().submit(self.contar, consulta)))
+        for base_id, chave, sinal, futuro in futuros:
+            contagem = contagens.setdefault(base_id, dict(self._contagem_vazia(), _com_modalidade=0))
+            contagem[chave] += sinal * futuro.result()
+        for base_id in {base_id for base_id, _, _, _ in futuros}:
+            contagem = contagens[base_id]
+            contagem["FROTA"] += contagem["total"] - contagem.pop("_com_modalidade")
+            contagem["OUTRAS"] = contagem["total"] - sum(contagem[m] for m in MODALIDADES)
+        if futuros:
+            print(f"🔢 Motoristas ativos contados por agregação em {len(futuros)} consulta(s) count()")
+        return contagens
+
+    def contar_motoristas_ativos(self, base_id: str) -> Dict[str, int]:
+        """Motoristas ativos da base no total e por modalidade (ver contar_motoristas_ativos_bases)."""
+        return self.contar_motoristas_ativos_bases([base_id])[base_id]
+
+    def resumo_motoristas_por_base(self) -> List[Dict[str, Any]]:
+        """
+        Visão do superadmin: motoristas ativos por base e modalidade.
+        Lê só o nome das bases e conta os motoristas com agregações (ou no diretório em memória).
+        """
+        nomes = {doc.id: (doc.to_dict() or {}).get('nome') for doc in self.db.collection('bases').select(['nome']).stream()}
+        contagens = self.contar_motoristas_ativos_bases(nomes)
+        return [
+            {"baseId": base_id, "nome": nomes[base_id] or base_id, **contagens[base_id]}
+            for base_id in sorted(nomes, key=lambda b: (nomes[b] or b).lower())
+        ]
+
     def get_galpao_coordenadas(self, base_id: str) -> Optional[Dict[str, float]]:
         """
-        Busca coordenadas do galpão em configuracao/principal
+        Busca coordenadas do galpão em configuracao/principal (em cache por GALPAO_CACHE_TTL_S)
 
         Returns:
             {"lat": float, "lng": float} ou None
         """
+        return self.cache_galpao.obter_ou_calcular(base_id, lambda: self._get_galpao_coordenadas_firestore(base_id))
+
+    def _get_galpao_coordenadas_firestore(self, base_id: str) -> Optional[Dict[str, float]]:
         config_ref = self.db.collection('bases').document(base_id).collection('configuracao').document('principal')
         doc = config_ref.get()
         if not doc.exists:
@@ -178,20 +469,41 @@ class FirestoreReader:
     def get_usuario_papel(self, base_id: str, user_id: str) -> Optional[str]:
         """Retorna o papel do usuário (admin, auxiliar, superadmin, etc) na base ou None.
         Busca por ID do documento e, se não achar, por campo authUid (Firebase Auth UID)."""
-        for col in ['usuarios', 'motoristas']:
-            ref = self.db.collection('bases').document(base_id).collection(col).document(user_id)
-            doc = ref.get()
-            if doc.exists:
+        diretorio = self._diretorio_da_base(base_id)
+        if diretorio is not None:
+            for col in ['usuarios', 'motoristas']:
+                doc = diretorio.documento(col, user_id) or diretorio.por_auth_uid(col, user_id)
+                if doc is not None:
+                    return doc.get('papel')
+            return None
+        return self._get_usuario_papel_firestore(base_id, user_id)
+
+    def _refs_papel(self, base_id: str, user_id: str) -> List[Any]:
+        """usuarios/{uid} e motoristas/{uid} da base (ordem de precedência de get_usuario_papel)."""
+        base_ref = self.db.collection('bases').document(base_id)
+        return [base_ref.collection(col).document(user_id) for col in ('usuarios', 'motoristas')]
+
+    def _get_usuario_papel_firestore(
+        self,
+        base_id: str,
+        user_id: str,
+        documentos: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
+        """
+        get_usuario_papel lendo direto do Firestore (sem diretório).
+        Os dois documentos por ID vêm de um único get_all (ou de documentos, se já lidos em lote).
+        """
+        if documentos is None:
+            documentos = self.ler_documentos(self._refs_papel(base_id, user_id), field_paths=['papel'])
+        consultas_auth_uid = {'usuarios': USUARIO_POR_AUTH_UID, 'motoristas': MOTORISTA_POR_AUTH_UID}
+        for col, ref in zip(['usuarios', 'motoristas'], self._refs_papel(base_id, user_id)):
+            col_ref = ref.parent
+            doc = documentos.get(ref.path)
+            if doc is not None and doc.exists:
                 return (doc.to_dict() or {}).get('papel')
             # Login anônimo: documento pode ter ID diferente do Auth UID; buscar por authUid
             try:
-                q = (
-                    self.db.collection('bases')
-                    .document(base_id)
-                    .collection(col)
-                    .where('authUid', '==', user_id)
-                    .limit(1)
-                )
+                q = consultas_auth_uid[col].montar(col_ref, user_id).limit(1)
                 for d in q.stream():
                     return (d.to_dict() or {}).get('papel')
             except Exception:
@@ -199,9 +511,38 @@ class FirestoreReader:
         return None
 
     def get_usuario_papel_in_any_base(self, user_id: str) -> Optional[str]:
-        """Retorna o papel do usuário em qualquer base (ex.: superadmin que não está na base atual)."""
-        for base_id in self.get_all_bases():
-            papel = self.get_usuario_papel(base_id, user_id)
+        """
+        Retorna o papel do usuário em qualquer base (ex.: superadmin que não está na base atual).
+        Usa o índice UID -> base (RoleIndex); enquanto ele não hidratou, busca o authUid por
+        collection_group e, por último, percorre as bases.
+        """
+        if self.indice_papeis is not None:
+            disponivel, papel = self.indice_papeis.papel_em_qualquer_base(user_id)
+            if disponivel:
+                return papel
+
+            # Mesma precedência do índice: em cada base, usuarios antes de motoristas, mesmo sem papel
+            vinculos = []
+            for consulta, col in ((USUARIO_POR_AUTH_UID_GLOBAL, 'usuarios'), (MOTORISTA_POR_AUTH_UID_GLOBAL, 'motoristas')):
+                try:
+                    for d in consulta.montar(self.db.collection_group(col), user_id).stream():
+                        base_ref = d.reference.parent.parent
+                        if base_ref is not None and base_ref.parent.id == 'bases':
+                            vinculos.append((base_ref.id, col, (d.to_dict() or {}).get('papel')))
+                except Exception as e:
+                    print(f"⚠️ Busca de authUid por collection_group em {col} falhou: {e}")
+            papel = papel_por_precedencia(sorted(vinculos, key=lambda v: (v[0], COLECOES_INDICE.index(v[1]))))
+            if papel:
+                return papel
+
+        # Leitura direta: hidratar o diretório de todas as bases só para esta busca custaria mais.
+        # Os documentos por ID de todas as bases vêm em lote; as consultas por authUid seguem base a base.
+        base_ids = self.get_all_bases()
+        documentos = self.ler_documentos(
+            [ref for base_id in base_ids for ref in self._refs_papel(base_id, user_id)], field_paths=['papel']
+        )
+        for base_id in base_ids:
+            papel = self._get_usuario_papel_firestore(base_id, user_id, documentos)
             if papel:
                 return papel
         return None
@@ -225,289 +566,432 @@ class FirestoreReader:
             print(f"get_superadmin_uids_from_config: {e}")
             return []
 
-    def invalidar_cache_contexto(self, base_id: str):
-        """Força a invalidação do cache de contexto para uma base específica."""
-        FirestoreReader._contexto_cache.pop(base_id, None)
+    def invalidar_cache_contexto(self, base_id: str, secao: Optional[str] = None):
+        """Força a invalidação do cache de contexto para uma base específica (todas as seções ou só uma)."""
+        self.cache_contexto.invalidar(base_id, secao)
         print(f"🔄 Cache de contexto invalidado para base {base_id}")
 
+    @classmethod
+    def _executor_contexto(cls) -> ThreadPoolExecutor:
+        """Pool compartilhado que lê as seções do contexto em paralelo (FIRESTORE_CONTEXTO_WORKERS)."""
+        with cls._executor_lock:
+            if cls._executor_secoes is None:
+                workers = int(os.getenv('FIRESTORE_CONTEXTO_WORKERS') or len(cls._SECOES_CONTEXTO) * 2)
+                cls._executor_secoes = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='contexto')
+            return cls._executor_secoes
+
+    @classmethod
+    def _executor_contagem(cls) -> ThreadPoolExecutor:
+        """Pool limitado das agregações count() (FIRESTORE_CONTAGEM_WORKERS)."""
+        with cls._executor_lock:
+            if cls._executor_contagens is None:
+                workers = int(os.getenv('FIRESTORE_CONTAGEM_WORKERS') or cls._CONTAGEM_WORKERS_PADRAO)
+                cls._executor_contagens = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='contagem')
+            return cls._executor_contagens
+
+    def _medir_secao(
+        self,
+        secao: str,
+        base_ref,
+        base_id: str,
+        hoje: str,
+        lote: Optional[Future] = None
+    ) -> Tuple[List[str], float]:
+        """Executa _contexto_<secao>. Returns: (partes do texto, milissegundos)."""
+        inicio = time.perf_counter()
+        parts = getattr(self, f"_contexto_{secao}")(base_ref, base_id, hoje, lote)
+        return parts, (time.perf_counter() - inicio) * 1000
+
+    @staticmethod
+    def _documentos_da_secao(secao: str, base_ref, hoje: str) -> List[Any]:
+        """Documentos fixos lidos pela seção (para o get_all em lote)."""
+        if secao == 'base':
+            return [base_ref]
+        if secao == 'config':
+            return [base_ref.collection('configuracao').document('principal')]
+        if secao == 'escala':
+            return [base_ref.collection('escalas').document(f"{hoje}_{turno}") for turno in ('AM', 'PM')]
+        if secao == 'devolucoes':
+            resumos = base_ref.collection(COLECAO_RESUMO)
+            return [resumos.document(hoje[:7]), resumos.document(mes_anterior(hoje[:7])), resumos.document(DOC_ESTADO)]
+        return []
+
     def get_contexto_base_para_assistente(self, base_id: str) -> str:
         """
         Monta um resumo completo da base para o assistente: escala (onda, hora, AM/PM, rota, vaga, sacas),
         tempo estimado (ETA), disponibilidade, quinzena e devoluções (id, quem devolveu).
-        Resultado é cacheado por _CACHE_TTL_SEGUNDOS segundos para reduzir leituras no Firestore.
-        """
-        from datetime import datetime
-        # Verificar cache
-        agora = time.monotonic()
-        cached = FirestoreReader._contexto_cache.get(base_id)
-        if cached is not None:
-            ts, contexto = cached
-            if agora - ts < FirestoreReader._CACHE_TTL_SEGUNDOS:
-                print(f"⚡ Contexto da base {base_id} servido do cache ({int(agora - ts)}s atrás)")
-                return contexto
+        Cada seção (_contexto_<secao>) fica em cache com TTL próprio (ContextCache); só as vencidas são relidas,
+        em paralelo, e o texto é montado na ordem de _SECOES_CONTEXTO.
+        Chamadas simultâneas da mesma base esperam a mesma releitura; seção vencida há pouco
+        (janela CONTEXTO_SWR_S) é entregue na hora e relida em background.
+        Os documentos fixos das seções relidas (base, configuracao/principal, escalas do dia, resumos de devoluções
+        do mês e do anterior) vêm num único get_all.
+        """
         try:
-            parts = []
             base_ref = self.db.collection('bases').document(base_id)
-            base_doc = base_ref.get()
-            base_data = base_doc.to_dict() or {}
-            nome_base = base_data.get('nome', 'Base') if base_doc.exists else 'Base'
-            parts.append(f"Base atual: {nome_base} (id: {base_id}).")
-
-            # --- MONETIZAÇÃO (PLANOS) ---
-            plano = base_data.get('plano', 'gratuito')
-            parts.append(f"Plano da base: {plano}.")
-            if plano == 'trial':
-                fim_trial = base_data.get('dataFimTrial')
-                if fim_trial:
-                    try:
-                        dt_fim = datetime.fromtimestamp(fim_trial / 1000.0)
-                        dias_restantes = (dt_fim - datetime.utcnow()).days
-                        parts.append(f"Período de teste (Trial) termina em: {dt_fim.strftime('%d/%m/%Y')} ({max(0, dias_restantes)} dias restantes).")
-                    except: pass
-
-            # --- CONFIGURAÇÃO E REGRAS DA BASE ---
-            try:
-                config_ref = base_ref.collection('configuracao').document('principal')
-                config_doc = config_ref.get()
-                if config_doc.exists:
-                    c_data = config_doc.to_dict() or {}
-                    galpao = c_data.get('galpao') or {}
-                    if galpao.get('lat') and galpao.get('lng'):
-                        parts.append(f"Regra de Localização: Galpão em ({galpao.get('lat')}, {galpao.get('lng')}) com raio de detecção de {galpao.get('raio', 100)} metros.")
-                    
-                    limites = c_data.get('limitesOndas') or {}
-                    if limites:
-                        limites_str = ", ".join([f"{k}: {v} motoristas" for k, v in limites.items()])
-                        parts.append(f"Limites de motoristas por onda: {limites_str}.")
-            except Exception as e_cfg:
-                print(f"get_contexto config: {e_cfg}")
-
-            motoristas_ref = base_ref.collection('motoristas')
-            motoristas_docs = list(motoristas_ref.stream())
-            
-            # Contagem por modalidade
-            contagem_modalidade = Counter()
-            motoristas_nomes = []
-            for d in motoristas_docs:
-                m_data = d.to_dict() or {}
-                if m_data.get('papel') == 'motorista' and m_data.get('ativo', True):
-                    nome = m_data.get('nome', '').strip()
-                    modalidade = m_data.get('modalidade', 'FROTA').upper()
-                    if nome:
-                        motoristas_nomes.append(nome)
-                        contagem_modalidade[modalidade] += 1
-            
-            motoristas_nomes.sort()
-            total_motoristas = len(motoristas_nomes)
-            parts.append(f"Total de motoristas na base: {total_motoristas}.")
-            
-            if contagem_modalidade:
-                resumo_mod = ", ".join([f"{count} {mod}" for mod, count in sorted(contagem_modalidade.items())])
-                parts.append(f"Contagem por modalidade: {resumo_mod}.")
-
-            if motoristas_nomes:
-                parts.append("Motoristas que podem ser escalados (use estes nomes exatos): " + ", ".join(motoristas_nomes) + ".")
-
             hoje = datetime.utcnow().strftime('%Y-%m-%d')
-            escalados_hoje = set()
-            # --- ESCALA DETALHADA: turno (AM/PM), onda, hora da onda, vaga, rota, sacas por motorista ---
-            escala_detalhes = []
-            for turno in ('AM', 'PM'):
-                doc_id = f"{hoje}_{turno}"
-                escala_ref = base_ref.collection('escalas').document(doc_id)
-                escala_doc = escala_ref.get()
-                if not escala_doc.exists:
-                    continue
-                data = escala_doc.to_dict() or {}
-                ondas = data.get('ondas') or []
-                for idx, onda in enumerate(ondas):
-                    nome_onda = onda.get('nome') or f'Onda'
-                    horario_onda = (onda.get('horario') or '').strip()
-                    itens = onda.get('itens') or []
-                    for item in itens:
-                        mid = (item.get('motoristaId') or '').strip()
-                        nome = (item.get('nome') or '').strip()
-                        vaga = (item.get('vaga') or '').strip()
-                        rota = (item.get('rota') or '').strip()
-                        horario_item = (item.get('horario') or '').strip()
-                        sacas = item.get('sacas')
-                        sacas_str = str(sacas) if sacas is not None else "-"
-                        if mid:
-                            escalados_hoje.add((mid, nome))
-                        linha = f"  {turno} | {nome_onda} (hora onda: {horario_onda or '-'}) | {nome} | vaga {vaga or '-'} | rota {rota or '-'} | sacas {sacas_str}"
-                        if horario_item:
-                            linha += f" | horário motorista: {horario_item}"
-                        escala_detalhes.append(linha)
-            total_escalados = len(escalados_hoje)
-            nomes_escalados = sorted(set(n for _, n in escalados_hoje if n))
-            parts.append(f"Escala de hoje ({hoje}): {total_escalados} motoristas escalados.")
-            parts.append("Motoristas já escalados (NÃO adicionar de novo; para mudar vaga/rota/sacas use atualização): " + ", ".join(nomes_escalados[:40]) + ("..." if len(nomes_escalados) > 40 else "") + ".")
-            if escala_detalhes:
-                parts.append("Detalhe da escala (turno | onda e hora | motorista | vaga | rota | sacas):")
-                parts.extend(escala_detalhes[:50])
-                if len(escala_detalhes) > 50:
-                    parts.append(f"  ... e mais {len(escala_detalhes) - 50} itens.")
-            elif total_escalados > 0:
-                parts.append("Nomes escalados hoje: " + ", ".join(nomes_escalados[:20]) + ("..." if total_escalados > 20 else "") + ".")
-
-            # --- TEMPO ESTIMADO (ETA): location_responses com status ready ---
-            try:
-                resp_ref = base_ref.collection('location_responses')
-                resp_docs = list(resp_ref.stream())
-                etas = []
-                for d in resp_docs:
-                    data = d.to_dict() or {}
-                    if data.get('status') != 'ready':
-                        continue
-                    nome = (data.get('motoristaNome') or '').strip()
-                    dist = data.get('distanceKm')
-                    eta_min = data.get('etaMinutes')
-                    if nome and eta_min is not None:
-                        dist_str = f"{dist:.1f} km" if dist is not None else "?"
-                        etas.append(f"{nome}: ~{eta_min} min ({dist_str})")
-                if etas:
-                    parts.append("Tempo estimado ao galpão (ETA): " + "; ".join(etas) + ".")
-            except Exception as e_eta:
-                print(f"get_contexto ETA: {e_eta}")
-
-            # --- DISPONIBILIDADE: solicitações recentes (hoje e amanhã) ---
-            try:
-                from datetime import timedelta
-                amanha = (datetime.utcnow() + timedelta(days=1)).strftime('%Y-%m-%d')
-                disp_ref = self.db.collection('disponibilidades')
-                disp_docs = disp_ref.where('baseId', '==', base_id).limit(30).stream()
-                disp_listas = []
-                for d in disp_docs:
-                    data_disp = d.to_dict() or {}
-                    data_str = (data_disp.get('data') or '').strip()
-                    if data_str not in (hoje, amanha):
-                        continue
-                    motoristas = data_disp.get('motoristas') or []
-                    resumos = []
-                    counts = Counter()
-                    for m in motoristas:
-                        nome_m = (m.get('nome') or '').strip()
-                        disp = m.get('disponivel')
-                        status_str = "não respondeu"
-                        if disp is True:
-                            status_str = "disponível"
-                        elif disp is False:
-                            status_str = "indisponível"
-                        
-                        counts[status_str] += 1
-                        resumos.append(f"{nome_m}: {status_str}")
-                    
-                    if resumos:
-                        resumo_counts = f"({counts['disponível']} disponíveis, {counts['indisponível']} indisponíveis, {counts['não respondeu']} sem resposta)"
-                        disp_listas.append(f"Data {data_str} {resumo_counts}: " + "; ".join(resumos[:15]))
-                if disp_listas:
-                    parts.append("Disponibilidade (hoje/amanhã): " + " | ".join(disp_listas))
-            except Exception as e_disp:
-                print(f"get_contexto disponibilidade: {e_disp}")
-
-            # --- QUINZENA: dias trabalhados no mês atual (1ª e 2ª quinzena) ---
-            try:
-                now = datetime.utcnow()
-                mes, ano = now.month, now.year
-                quinzenas_ref = self.db.collection('quinzenas')
-                q_docs = quinzenas_ref.where('baseId', '==', base_id).where('mes', '==', mes).where('ano', '==', ano).limit(50).stream()
-                q_resumos = []
-                for d in q_docs:
-                    data_q = d.to_dict() or {}
-                    nome_q = (data_q.get('motoristaNome') or '').strip()
-                    p1 = data_q.get('primeiraQuinzena') or {}
-                    p2 = data_q.get('segundaQuinzena') or {}
-                    d1 = p1.get('diasTrabalhados') if isinstance(p1.get('diasTrabalhados'), (int, float)) else 0
-                    d2 = p2.get('diasTrabalhados') if isinstance(p2.get('diasTrabalhados'), (int, float)) else 0
-                    if nome_q:
-                        q_resumos.append(f"{nome_q}: 1ª quinzena {d1} dia(s), 2ª quinzena {d2} dia(s)")
-                if q_resumos:
-                    parts.append("Quinzena do mês (dias trabalhados): " + "; ".join(q_resumos[:25]))
-            except Exception as e_q:
-                print(f"get_contexto quinzena: {e_q}")
-
-            # --- DEVOLUÇÕES: por motorista → Total por dia → depois cada devolução (data hora — N pacotes. IDs: ...) ---
-            try:
-                dev_ref = base_ref.collection('devolucoes')
-                dev_docs = list(dev_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(50).stream())
-                if dev_docs:
-                    by_motorista = {}
-                    for d in dev_docs:
-                        data_dev = d.to_dict() or {}
-                        dev_id = d.id
-                        quem = (data_dev.get('motoristaNome') or '').strip() or "Sem nome"
-                        data_str = (data_dev.get('data') or '').strip()
-                        hora_str = (data_dev.get('hora') or '').strip()
-                        ids_pacotes = data_dev.get('idsPacotes') or []
-                        if not isinstance(ids_pacotes, list):
-                            ids_pacotes = [str(ids_pacotes)] if ids_pacotes else []
-                        ids_pacotes = [str(x).strip() for x in ids_pacotes if x]
-                        qtd = len(ids_pacotes) if ids_pacotes else 0
-                        if qtd == 0:
-                            try:
-                                qtd = int(data_dev.get('quantidade') or 0)
-                            except (TypeError, ValueError):
-                                qtd = 0
-                        entry = {
-                            "data": data_str,
-                            "hora": hora_str,
-                            "id": dev_id,
-                            "qtd": qtd,
-                            "ids": ids_pacotes,
-                        }
-                        by_motorista.setdefault(quem, []).append(entry)
-                    dev_blocks = []
-                    for motorista, entradas in sorted(by_motorista.items(), key=lambda x: x[0]):
-                        # Total por dia (agrupar por data)
-                        por_dia = Counter(e["data"] for e in entradas[:15] if e.get("data"))
-                        total_por_dia = "; ".join(f"{data} {c} devolução(ões)" for data, c in sorted(por_dia.items()))
-                        linhas = [f"[Motorista: {motorista}]", f"Total por dia: {total_por_dia}."]
-                        for e in entradas[:15]:
-                            data_hora = f"{e['data']} {e['hora']}".strip()
-                            ids_str = ", ".join(e["ids"][:30]) if e["ids"] else "(sem IDs)"
-                            if len(e["ids"]) > 30:
-                                ids_str += f" ... (+{len(e['ids']) - 30} mais)"
-                            linhas.append(f"  • {data_hora} — {e['qtd']} pacote(s). IDs: {ids_str}")
-                        dev_blocks.append("\n".join(linhas))
-                    if dev_blocks:
-                        parts.append("Devoluções (apresente EXATAMENTE neste formato: primeiro Total por dia do motorista, depois cada linha com data hora — N pacotes. IDs: ...):")
-                        parts.append("\n".join(dev_blocks))
-            except Exception as e_dev:
-                print(f"get_contexto devolucoes: {e_dev}")
-
-            # --- HISTÓRICO DE NOTIFICAÇÕES (AVISOS ENVIADOS) ---
-            try:
-                avisos_ref = base_ref.collection('avisos_enviados')
-                avisos_docs = list(avisos_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(10).stream())
-                if avisos_docs:
-                    parts.append("Últimos avisos enviados aos motoristas:")
-                    for d in avisos_docs:
-                        a = d.to_dict() or {}
-                        ts = a.get('timestamp')
-                        ts_str = ""
-                        if ts:
-                            try:
-                                # Firestore timestamp ou milissegundos
-                                if hasattr(ts, 'timestamp'):
-                                    ts_str = ts.strftime('%d/%m %H:%M')
-                                else:
-                                    ts_str = datetime.fromtimestamp(ts / 1000.0).strftime('%d/%m %H:%M')
-                            except: pass
-                        remetente = a.get('remetenteNome', 'Admin')
-                        destinatario = a.get('destinatarioNome', 'Motorista')
-                        texto = a.get('texto', '')
-                        parts.append(f"  [{ts_str}] {remetente} enviou para {destinatario}: \"{texto}\"")
-            except Exception as e_avisos:
-                print(f"get_contexto avisos: {e_avisos}")
-
-            contexto = " ".join(parts)
-            FirestoreReader._contexto_cache[base_id] = (agora, contexto)
-            print(f"✅ Contexto da base {base_id} cacheado por {FirestoreReader._CACHE_TTL_SEGUNDOS}s")
-            return contexto
+            self.cache_contexto.observar_escala(base_ref, base_id, hoje)
+            if self.devolucoes_resumo is not None:
+                self.devolucoes_resumo.observar()
+            inicio = time.perf_counter()
+            consultas = {secao: self.cache_contexto.consultar(base_id, secao, hoje) for secao in self._SECOES_CONTEXTO}
+            # Base, configuração, os dois documentos da escala e os resumos de devoluções que vão ser relidos: um único get_all
+            refs_lote = [
+                ref for secao in self._SECOES_COM_DOCUMENTOS
+                if not consultas[secao][1] and not self.cache_contexto.recarregando(base_id, secao, hoje)
+                for ref in self._documentos_da_secao(secao, base_ref, hoje)
+            ]
+            lote = self._executor_contexto().submit(self.ler_documentos, refs_lote) if len(refs_lote) > 1 else None
+            em_cache = {}
+            futuros = {}
+            for secao in self._SECOES_CONTEXTO:
+                partes, fresco = consultas[secao]
+                if not fresco:
+                    futuro, novo = self.cache_contexto.recarregar(
+                        base_id, secao, hoje, self._executor_contexto(),
+                        lambda secao=secao: self._medir_secao(secao, base_ref, base_id, hoje, lote)
+                    )
+                    if partes is None:
+                        futuros[secao] = (futuro, novo)
+                    elif novo:
+                        futuro.add_done_callback(
+                            lambda f, secao=secao: f.exception() and print(
+                                f"⚠️ Recarga em background da seção {secao} (base {base_id}): {f.exception()}")
+                        )
+                em_cache[secao] = partes
+            # Montagem na ordem das seções; uma seção sem tratamento de erro próprio aborta o contexto
+            parts = []
+            tempos = []
+            for secao in self._SECOES_CONTEXTO:
+                if secao in futuros:
+                    futuro, novo = futuros[secao]
+                    partes_secao, ms = futuro.result()
+                    tempos.append(f"{secao} {ms:.0f}ms" + ("" if novo else " (aguardou recarga em andamento)"))
+                else:
+                    partes_secao = em_cache[secao]
+                parts.extend(partes_secao)
+            if futuros:
+                total_ms = (time.perf_counter() - inicio) * 1000
+                print(f"⏱️ Contexto da base {base_id} em {total_ms:.0f}ms "
+                      f"({len(self._SECOES_CONTEXTO) - len(futuros)} seções do cache): " + ", ".join(tempos))
+            else:
+                print(f"⚡ Contexto da base {base_id} servido do cache")
+
+            return " ".join(parts)
         except Exception as e:
             print(f"get_contexto_base_para_assistente: {e}")
             return ""
 
+    def _contexto_base(self, base_ref, base_id: str, hoje: str, lote: Optional[Future] = None) -> List[str]:
+        """Nome e plano da base (sem tratamento de erro: uma falha aqui aborta o contexto)."""
+        parts = []
+        base_doc = self._ler(base_ref, lote)
+        base_data = base_doc.to_dict() or {}
+        nome_base = base_data.get('nome', 'Base') if base_doc.exists else 'Base'
+        parts.append(f"Base atual: {nome_base} (id: {base_id}).")
+
+        # --- MONETIZAÇÃO (PLANOS) ---
+        plano = base_data.get('plano', 'gratuito')
+        parts.append(f"Plano da base: {plano}.")
+        if plano == 'trial':
+            fim_trial = base_data.get('dataFimTrial')
+            if fim_trial:
+                try:
+                    dt_fim = datetime.fromtimestamp(fim_trial / 1000.0)
+                    dias_restantes = (dt_fim - datetime.utcnow()).days
+                    parts.append(f"Período de teste (Trial) termina em: {dt_fim.strftime('%d/%m/%Y')} ({max(0, dias_restantes)} dias restantes).")
+                except: pass
+        return parts
+
+    def _contexto_config(self, base_ref, base_id: str, hoje: str, lote: Optional[Future] = None) -> List[str]:
+        """Regras de localização do galpão e limites por onda."""
+        parts = []
+        # --- CONFIGURAÇÃO E REGRAS DA BASE ---
+        try:
+            config_ref = base_ref.collection('configuracao').document('principal')
+            config_doc = self._ler(config_ref, lote)
+            if config_doc.exists:
+                c_data = config_doc.to_dict() or {}
+                galpao = c_data.get('galpao') or {}
+                if galpao.get('lat') and galpao.get('lng'):
+                    parts.append(f"Regra de Localização: Galpão em ({galpao.get('lat')}, {galpao.get('lng')}) com raio de detecção de {galpao.get('raio', 100)} metros.")
+                
+                limites = c_data.get('limitesOndas') or {}
+                if limites:
+                    limites_str = ", ".join([f"{k}: {v} motoristas" for k, v in limites.items()])
+                    parts.append(f"Limites de motoristas por onda: {limites_str}.")
+        except Exception as e_cfg:
+            print(f"get_contexto config: {e_cfg}")
+        return parts
+
+    def _contexto_motoristas(self, base_ref, base_id: str, hoje: str, lote: Optional[Future] = None) -> List[str]:
+        """Motoristas ativos, contagem por modalidade e nomes para escalar (do diretório, se hidratado)."""
+        parts = []
+        diretorio = self._diretorio_da_base(base_id)
+        if diretorio is not None:
+            # O diretório guarda campos ausentes como None; sem eles, os padrões abaixo (ativo, FROTA) valem
+            motoristas_dados = [
+                {k: v for k, v in entrada.items() if v is not None} for entrada in diretorio.listar('motoristas')
+            ]
+        else:
+            # Sem diretório: só motoristas (filtro no servidor) e só nome, modalidade e ativo;
+            # os inativos saem no filtro abaixo, como no diretório
+            motoristas_dados = [
+                dict({k: v for k, v in (d.to_dict() or {}).items() if v is not None}, papel='motorista')
+                for d in MOTORISTAS_DA_BASE.montar(base_ref.collection('motoristas'), 'motorista').stream()
+            ]
+        
+        # Contagem por modalidade
+        contagem_modalidade = Counter()
+        motoristas_nomes = []
+        for m_data in motoristas_dados:
+            if m_data.get('papel') == 'motorista' and m_data.get('ativo', True):
+                nome = m_data.get('nome', '').strip()
+                modalidade = m_data.get('modalidade', 'FROTA').upper()
+                if nome:
+                    motoristas_nomes.append(nome)
+                    contagem_modalidade[modalidade] += 1
+        
+        motoristas_nomes.sort()
+        total_motoristas = len(motoristas_nomes)
+        parts.append(f"Total de motoristas na base: {total_motoristas}.")
+        
+        if contagem_modalidade:
+            resumo_mod = ", ".join([f"{count} {mod}" for mod, count in sorted(contagem_modalidade.items())])
+            parts.append(f"Contagem por modalidade: {resumo_mod}.")
+
+        if motoristas_nomes:
+            parts.append("Motoristas que podem ser escalados (use estes nomes exatos): " + ", ".join(motoristas_nomes) + ".")
+        return parts
+
+    def _contexto_escala(self, base_ref, base_id: str, hoje: str, lote: Optional[Future] = None) -> List[str]:
+        """Escala de hoje (AM e PM) com onda, vaga, rota e sacas."""
+        parts = []
+        escalados_hoje = set()
+        # --- ESCALA DETALHADA: turno (AM/PM), onda, hora da onda, vaga, rota, sacas por motorista ---
+        escala_detalhes = []
+        for turno in ('AM', 'PM'):
+            doc_id = f"{hoje}_{turno}"
+            escala_ref = base_ref.collection('escalas').document(doc_id)
+            escala_doc = self._ler(escala_ref, lote)
+            if not escala_doc.exists:
+                continue
+            data = escala_doc.to_dict() or {}
+            ondas = data.get('ondas') or []
+            for idx, onda in enumerate(ondas):
+                nome_onda = onda.get('nome') or f'Onda'
+                horario_onda = (onda.get('horario') or '').strip()
+                itens = onda.get('itens') or []
+                for item in itens:
+                    mid = (item.get('motoristaId') or '').strip()
+                    nome = (item.get('nome') or '').strip()
+                    vaga = (item.get('vaga') or '').strip()
+                    rota = (item.get('rota') or '').strip()
+                    horario_item = (item.get('horario') or '').strip()
+                    sacas = item.get('sacas')
+                    sacas_str = str(sacas) if sacas is not None else "-"
+                    if mid:
+                        escalados_hoje.add((mid, nome))
+                    linha = f"  {turno} | {nome_onda} (hora onda: {horario_onda or '-'}) | {nome} | vaga {vaga or '-'} | rota {rota or '-'} | sacas {sacas_str}"
+                    if horario_item:
+                        linha += f" | horário motorista: {horario_item}"
+                    escala_detalhes.append(linha)
+        total_escalados = len(escalados_hoje)
+        nomes_escalados = sorted(set(n for _, n in escalados_hoje if n))
+        parts.append(f"Escala de hoje ({hoje}): {total_escalados} motoristas escalados.")
+        parts.append("Motoristas já escalados (NÃO adicionar de novo; para mudar vaga/rota/sacas use atualização): " + ", ".join(nomes_escalados[:40]) + ("..." if len(nomes_escalados) > 40 else "") + ".")
+        if escala_detalhes:
+            parts.append("Detalhe da escala (turno | onda e hora | motorista | vaga | rota | sacas):")
+            parts.extend(escala_detalhes[:50])
+            if len(escala_detalhes) > 50:
+                parts.append(f"  ... e mais {len(escala_detalhes) - 50} itens.")
+        elif total_escalados > 0:
+            parts.append("Nomes escalados hoje: " + ", ".join(nomes_escalados[:20]) + ("..." if total_escalados > 20 else "") + ".")
+        return parts
+
+    def _contexto_eta(self, base_ref, base_id: str, hoje: str, lote: Optional[Future] = None) -> List[str]:
+        """Tempo estimado ao galpão (location_responses prontas)."""
+        parts = []
+        # --- TEMPO ESTIMADO (ETA): location_responses com status ready ---
+        try:
+            resp_ref = base_ref.collection('location_responses')
+            resp_docs = list(resp_ref.stream())
+            etas = []
+            for d in resp_docs:
+                data = d.to_dict() or {}
+                if data.get('status') != 'ready':
+                    continue
+                nome = (data.get('motoristaNome') or '').strip()
+                dist = data.get('distanceKm')
+                eta_min = data.get('etaMinutes')
+                if nome and eta_min is not None:
+                    dist_str = f"{dist:.1f} km" if dist is not None else "?"
+                    etas.append(f"{nome}: ~{eta_min} min ({dist_str})")
+            if etas:
+                parts.append("Tempo estimado ao galpão (ETA): " + "; ".join(etas) + ".")
+        except Exception as e_eta:
+            print(f"get_contexto ETA: {e_eta}")
+        return parts
+
+    def _contexto_disponibilidade(self, base_ref, base_id: str, hoje: str, lote: Optional[Future] = None) -> List[str]:
+        """Disponibilidade de hoje e amanhã."""
+        parts = []
+        # --- DISPONIBILIDADE: solicitações recentes (hoje e amanhã) ---
+        try:
+            amanha = (datetime.utcnow() + timedelta(days=1)).strftime('%Y-%m-%d')
+            disp_ref = self.db.collection('disponibilidades')
+            # Filtro de data no servidor: só os documentos de hoje e amanhã, em ordem de data
+            disp_docs = DISPONIBILIDADES_DO_DIA.montar(disp_ref, base_id, [hoje, amanha]).stream()
+            disp_dados = sorted((d.to_dict() or {} for d in disp_docs), key=lambda dd: dd.get('data') or '')
+            disp_listas = []
+            for data_disp in disp_dados:
+                data_str = (data_disp.get('data') or '').strip()
+                motoristas = data_disp.get('motoristas') or []
+                resumos = []
+                counts = Counter()
+                for m in motoristas:
+                    nome_m = (m.get('nome') or '').strip()
+                    disp = m.get('disponivel')
+                    status_str = "não respondeu"
+                    if disp is True:
+                        status_str = "disponível"
+                    elif disp is False:
+                        status_str = "indisponível"
+                    
+                    counts[status_str] += 1
+                    resumos.append(f"{nome_m}: {status_str}")
+                
+                if resumos:
+                    resumo_counts = f"({counts['disponível']} disponíveis, {counts['indisponível']} indisponíveis, {counts['não respondeu']} sem resposta)"
+                    disp_listas.append(f"Data {data_str} {resumo_counts}: " + "; ".join(resumos[:15]))
+            if disp_listas:
+                parts.append("Disponibilidade (hoje/amanhã): " + " | ".join(disp_listas))
+        except Exception as e_disp:
+            print(f"get_contexto disponibilidade: {e_disp}")
+        return parts
+
+    def _contexto_quinzena(self, base_ref, base_id: str, hoje: str, lote: Optional[Future] = None) -> List[str]:
+        """Dias trabalhados por quinzena no mês atual."""
+        parts = []
+        # --- QUINZENA: dias trabalhados no mês atual (1ª e 2ª quinzena) ---
+        try:
+            now = datetime.utcnow()
+            mes, ano = now.month, now.year
+            quinzenas_ref = self.db.collection('quinzenas')
+            q_docs = QUINZENAS_DO_MES.montar(quinzenas_ref, base_id, mes, ano).limit(50).stream()
+            q_resumos = []
+            for d in q_docs:
+                data_q = d.to_dict() or {}
+                nome_q = (data_q.get('motoristaNome') or '').strip()
+                p1 = data_q.get('primeiraQuinzena') or {}
+                p2 = data_q.get('segundaQuinzena') or {}
+                d1 = p1.get('diasTrabalhados') if isinstance(p1.get('diasTrabalhados'), (int, float)) else 0
+                d2 = p2.get('diasTrabalhados') if isinstance(p2.get('diasTrabalhados'), (int, float)) else 0
+                if nome_q:
+                    q_resumos.append(f"{nome_q}: 1ª quinzena {d1} dia(s), 2ª quinzena {d2} dia(s)")
+            if q_resumos:
+                parts.append("Quinzena do mês (dias trabalhados): " + "; ".join(q_resumos[:25]))
+        except Exception as e_q:
+            print(f"get_contexto quinzena: {e_q}")
+        return parts
+
+    def _contexto_devolucoes(self, base_ref, base_id: str, hoje: str, lote: Optional[Future] = None) -> List[str]:
+        """
+        Devoluções recentes agrupadas por motorista, do resumo do mês (devolucoes_resumo/{yyyy-mm} e o do mês
+        anterior: dois documentos, em vez das 50 últimas devoluções). Base ainda não reconstruída
+        (sem devolucoes_resumo/estado na versão atual) ou sem resumo nos dois meses: lê as devoluções direto.
+        A tendência semanal vem só do resumo do mês atual.
+        """
+        parts = []
+        # --- DEVOLUÇÕES: por motorista → Total por dia → depois cada devolução (data hora — N pacotes. IDs: ...) ---
+        try:
+            entradas = None
+            tendencia = None
+            if self.devolucoes_resumo is not None:
+                atual, anterior, estado = [
+                    self._ler(ref, lote) for ref in self._documentos_da_secao('devolucoes', base_ref, hoje)
+                ]
+                reconstruida = estado.exists and base_reconstruida(estado.to_dict())
+                resumos = [doc.to_dict() or {} for doc in (atual, anterior) if doc.exists] if reconstruida else []
+                if resumos:
+                    recentes = [r for resumo in resumos for r in resumo.get('recentes') or []]
+                    recentes.sort(key=lambda r: r.get('timestamp') or 0, reverse=True)
+                    entradas = recentes[:MAX_RECENTES]
+                    if atual.exists:
+                        tendencia = (atual.to_dict() or {}).get('tendenciaSemanal')
+            if entradas is None:
+                entradas = self._devolucoes_recentes(base_ref)
+            by_motorista = {}
+            for e in entradas:
+                by_motorista.setdefault(e["motoristaNome"], []).append(e)
+            dev_blocks = []
+            for motorista, entradas_motorista in sorted(by_motorista.items(), key=lambda x: x[0]):
+                # Total por dia (agrupar por data)
+                por_dia = Counter(e["data"] for e in entradas_motorista[:15] if e.get("data"))
+                total_por_dia = "; ".join(f"{data} {c} devolução(ões)" for data, c in sorted(por_dia.items()))
+                linhas = [f"[Motorista: {motorista}]", f"Total por dia: {total_por_dia}."]
+                for e in entradas_motorista[:15]:
+                    data_hora = f"{e['data']} {e['hora']}".strip()
+                    ids_str = ", ".join(e["ids"][:30]) if e["ids"] else "(sem IDs)"
+                    if e["totalIds"] > 30:
+                        ids_str += f" ... (+{e['totalIds'] - 30} mais)"
+                    linhas.append(f"  • {data_hora} — {e['qtd']} pacote(s). IDs: {ids_str}")
+                dev_blocks.append("\n".join(linhas))
+            if dev_blocks:
+                parts.append("Devoluções (apresente EXATAMENTE neste formato: primeiro Total por dia do motorista, depois cada linha com data hora — N pacotes. IDs: ...):")
+                parts.append("\n".join(dev_blocks))
+            if tendencia and tendencia.get('variacaoPct') is not None:
+                variacao = tendencia['variacaoPct']
+                sentido = "aumento" if variacao > 0 else "queda" if variacao < 0 else "estável"
+                parts.append(
+                    f"Tendência semanal de devoluções: semana {tendencia['semana']} com {tendencia['devolucoes']} "
+                    f"devolução(ões) contra {tendencia['devolucoesAnterior']} na semana {tendencia['semanaAnterior']} "
+                    f"({sentido}{'' if variacao == 0 else f' de {abs(variacao):.0f}%'})."
+                )
+        except Exception as e_dev:
+            print(f"get_contexto devolucoes: {e_dev}")
+        return parts
+
+    @staticmethod
+    def _devolucoes_recentes(base_ref) -> List[Dict[str, Any]]:
+        """As 50 últimas devoluções da base lidas direto da coleção (base sem resumo), no formato de 'recentes' do resumo."""
+        entradas = []
+        dev_ref = base_ref.collection('devolucoes')
+        for d in dev_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(MAX_RECENTES).stream():
+            resumo = resumo_vazio('')
+            if aplicar_no_resumo(resumo, d.id, d.to_dict() or {}):
+                entradas.extend(resumo['recentes'])
+        return entradas
+
+    def _contexto_avisos(self, base_ref, base_id: str, hoje: str, lote: Optional[Future] = None) -> List[str]:
+        """Últimos avisos enviados aos motoristas."""
+        parts = []
+        # --- HISTÓRICO DE NOTIFICAÇÕES (AVISOS ENVIADOS) ---
+        try:
+            avisos_ref = base_ref.collection('avisos_enviados')
+            avisos_docs = list(avisos_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(10).stream())
+            if avisos_docs:
+                parts.append("Últimos avisos enviados aos motoristas:")
+                for d in avisos_docs:
+                    a = d.to_dict() or {}
+                    ts = a.get('timestamp')
+                    ts_str = ""
+                    if ts:
+                        try:
+                            # Firestore timestamp ou milissegundos
+                            if hasattr(ts, 'timestamp'):
+                                ts_str = ts.strftime('%d/%m %H:%M')
+                            else:
+                                ts_str = datetime.fromtimestamp(ts / 1000.0).strftime('%d/%m %H:%M')
+                        except: pass
+                    remetente = a.get('remetenteNome', 'Admin')
+                    destinatario = a.get('destinatarioNome', 'Motorista')
+                    texto = a.get('texto', '')
+                    parts.append(f"  [{ts_str}] {remetente} enviou para {destinatario}: \"{texto}\"")
+        except Exception as e_avisos:
+            print(f"get_contexto avisos: {e_avisos}")
+        return parts
+
     def write_location_response(self, base_id: str, motorista_id: str, data: dict, merge: bool = True):
         """Grava documento em bases/{baseId}/location_responses/{motoristaId}"""
         ref = self.db.collection('bases').document(base_id).collection('location_responses').document(motorista_id)
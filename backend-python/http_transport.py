@@ -0,0 +1,245 @@
+"""
+http_transport.py
+
+Transporte HTTP compartilhado pelas integrações externas (FCM, OpenRouteService e OpenAI).
+Mantém um pool de conexões keep-alive por host, para não abrir uma conexão TCP+TLS
+nova a cada mensagem, e expõe estatísticas dos pools para ajuste fino.
+
+Configuração (variáveis de ambiente):
+    HTTP_POOL_MAXSIZE: conexões mantidas por host (padrão: 20)
+    FCM_HTTP2: "1" para usar HTTP/2 (multiplexado) com fcm.googleapis.com.
+               Requer httpx com suporte a HTTP/2 (pip install "httpx[http2]").
+"""
+
+import os
+import threading
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import httpx
+except ImportError:  # httpx é opcional (vem junto com o SDK da OpenAI)
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+    _HTTP2_DISPONIVEL = httpx is not None
+except ImportError:
+    _HTTP2_DISPONIVEL = False
+
+
+FCM_HOST = "fcm.googleapis.com"
+
+
+class _EstatisticasHost:
+    """Contadores de uso do pool de conexões de um host."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requisicoes = 0
+        self.novas_conexoes = 0
+        self.esperas = 0
+
+    def incrementar(self, campo: str, valor: int = 1):
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + valor)
+
+    def to_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requisicoes": self.requisicoes,
+                "reutilizadas": max(0, self.requisicoes - self.novas_conexoes),
+                "novas_conexoes": self.novas_conexoes,
+                "esperas": self.esperas,
+            }
+
+
+class _RegistroEstatisticas:
+    """Estatísticas por host, compartilhadas entre requests e httpx."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, _EstatisticasHost] = {}
+
+    def para_host(self, host: str) -> _EstatisticasHost:
+        with self._lock:
+            stats = self._hosts.get(host)
+            if stats is None:
+                stats = self._hosts[host] = _EstatisticasHost()
+            return stats
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {host: stats.to_dict() for host, stats in sorted(hosts.items())}
+
+
+class _PoolContadorMixin:
+    """Conta conexões reaproveitadas, conexões novas e esperas por conexão livre."""
+
+    _registro: Optional[_RegistroEstatisticas] = None
+
+    def _get_conn(self, timeout=None):
+        stats = self._registro.para_host(self.host)
+        if self.block and self.pool is not None and self.pool.empty():
+            # Todas as conexões do host estão em uso: a requisição vai esperar
+            stats.incrementar('esperas')
+        stats.incrementar('requisicoes')
+        return super()._get_conn(timeout)
+
+    def _new_conn(self):
+        self._registro.para_host(self.host).incrementar('novas_conexoes')
+        return super()._new_conn()
+
+
+class _PoolAdapter(HTTPAdapter):
+    """HTTPAdapter cujos pools (um por host) alimentam o registro de estatísticas."""
+
+    def __init__(self, registro: _RegistroEstatisticas, **kwargs):
+        attrs = {"_registro": registro}
+        self._pool_classes = {
+            "http": type("_HTTPPool", (_PoolContadorMixin, HTTPConnectionPool), attrs),
+            "https": type("_HTTPSPool", (_PoolContadorMixin, HTTPSConnectionPool), attrs),
+        }
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+
+class HttpTransport:
+    """
+    Transporte HTTP com pools keep-alive por host.
+
+    Chamadas via requests (FCM, OpenRouteService, OAuth do Google) usam uma única Session
+    com um pool por host. Hosts configurados para HTTP/2 e o SDK da OpenAI usam httpx.
+    """
+
+    POOL_MAXSIZE_PADRAO = 20
+
+    def __init__(self, pool_maxsize: Optional[int] = None, http2_hosts: Optional[Iterable[str]] = None):
+        """
+        Args:
+            pool_maxsize: Conexões mantidas por host (se None, usa HTTP_POOL_MAXSIZE ou POOL_MAXSIZE_PADRAO)
+            http2_hosts: Hosts que devem usar HTTP/2 (se None, usa FCM_HTTP2 para fcm.googleapis.com)
+        """
+        if pool_maxsize is None:
+            pool_maxsize = int(os.getenv('HTTP_POOL_MAXSIZE') or self.POOL_MAXSIZE_PADRAO)
+        self.pool_maxsize = max(1, pool_maxsize)
+
+        if http2_hosts is None:
+            http2_hosts = [FCM_HOST] if os.getenv('FCM_HTTP2', '').strip() in ('1', 'true', 'True') else []
+        http2_hosts = set(http2_hosts)
+        if http2_hosts and not _HTTP2_DISPONIVEL:
+            print("⚠️ HTTP/2 solicitado, mas httpx[http2] não está instalado. Usando HTTP/1.1 keep-alive.")
+            http2_hosts = set()
+        self.http2_hosts = http2_hosts
+
+        self._registro = _RegistroEstatisticas()
+        self._lock = threading.Lock()
+
+        self._session = requests.Session()
+        adapter = _PoolAdapter(
+            self._registro,
+            pool_connections=self.pool_maxsize,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=True,
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self._http2_client = None
+        self._httpx_client = None
+
+    @property
+    def session(self) -> requests.Session:
+        """Session compartilhada (ex.: para google.auth.transport.requests.Request)."""
+        return self._session
+
+    def _novo_httpx_client(self, http2: bool):
+        """Cria um httpx.Client cujas conexões e requisições entram nas estatísticas."""
+        registro = self._registro
+
+        def _on_request(req):
+            host = req.url.host
+            registro.para_host(host).incrementar('requisicoes')
+
+            def trace(evento, info):
+                if evento == "connection.connect_tcp.complete":
+                    registro.para_host(host).incrementar('novas_conexoes')
+            req.extensions["trace"] = trace
+
+        limits = httpx.Limits(
+            max_connections=self.pool_maxsize,
+            max_keepalive_connections=self.pool_maxsize,
+        )
+        return httpx.Client(http2=http2, limits=limits, event_hooks={"request": [_on_request]})
+
+    def _get_http2_client(self):
+        with self._lock:
+            if self._http2_client is None:
+                self._http2_client = self._novo_httpx_client(http2=True)
+            return self._http2_client
+
+    def httpx_client(self):
+        """
+        httpx.Client keep-alive compartilhado (usado pelo SDK da OpenAI via http_client=).
+
+        Returns:
+            httpx.Client, ou None se httpx não estiver instalado
+        """
+        if httpx is None:
+            return None
+        with self._lock:
+            if self._httpx_client is None:
+                self._httpx_client = self._novo_httpx_client(http2=False)
+            return self._httpx_client
+
+    def post(
+        self,
+        url: str,
+        json: Optional[Any] = None,
+        data: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None
+    ):
+        """
+        POST pelo pool do host de destino.
+
+        Returns:
+            Resposta com status_code, text, headers e json() (requests.Response ou httpx.Response)
+        """
+        host = urlsplit(url).hostname or ""
+        if host in self.http2_hosts:
+            client = self._get_http2_client()
+            if data is not None:
+                return client.post(url, content=data, headers=headers, timeout=timeout)
+            return client.post(url, json=json, headers=headers, timeout=timeout)
+        return self._session.post(url, json=json, data=data, headers=headers, timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas dos pools por host: requisições, reutilizadas, novas conexões e esperas."""
+        return {
+            "pool_maxsize": self.pool_maxsize,
+            "http2_hosts": sorted(self.http2_hosts),
+            "hosts": self._registro.to_dict(),
+        }
+
+
+_transport: Optional[HttpTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> HttpTransport:
+    """Retorna o transporte compartilhado do processo (criado na primeira chamada)."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HttpTransport()
+    return _transport
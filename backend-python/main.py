@@ -9,7 +9,7 @@ import argparse
 import os
 import sys
 from firestore_reader import FirestoreReader
-from fcm_sender import FCMSender
+from fcm_sender import FCMSender, tokens_para_remover
 
 
 def main():
@@ -144,14 +144,21 @@ Exemplos de uso:
             body=args.body,
             data=data_dict
         )
+
+        # 6. Remover do Firestore os tokens que o FCM rejeitou como inválidos
+        tokens_removidos = 0
+        mortos = tokens_para_remover(tokens, resultado)
+        if mortos:
+            tokens_removidos = reader.remover_tokens_invalidos(args.base_id, mortos)
         
-        # 6. Resumo final
+        # 7. Resumo final
         print("\n" + "=" * 60)
         print("📊 RESUMO FINAL")
         print("=" * 60)
         print(f"   ✅ Sucessos: {resultado['sucessos']}")
         print(f"   ❌ Falhas: {resultado['falhas']}")
         print(f"   📱 Total: {len(tokens)}")
+        print(f"   🗑️ Tokens inválidos removidos: {tokens_removidos}")
         
         if resultado['falhas'] == 0:
             print("\n🎉 Todas as notificações foram enviadas com sucesso!")
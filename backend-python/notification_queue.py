@@ -0,0 +1,334 @@
+"""
+notification_queue.py
+
+Fila durável (SQLite) de notificações a enviar.
+No modo fila, os endpoints /notify/* gravam um job e respondem 202 na hora;
+um pool de workers em background consome a fila com retentativas.
+
+O arquivo SQLite sobrevive a reinícios do processo e pode ser compartilhado por
+vários workers do gunicorn na mesma máquina: cada job é reservado por um "lease";
+enquanto o job roda, o worker renova o lease; se o processo cair no meio do envio,
+o job volta para a fila quando o lease expira.
+
+Jobs de prioridade alta (mudança de status, chamada de um motorista) passam na frente dos
+broadcasts, e parte dos workers só atende prioridade alta: um broadcast longo nunca ocupa
+todos os workers.
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from rate_limiter import PRIORIDADE_ALTA, PRIORIDADE_NORMAL
+
+
+STATUS_PENDENTE = "pendente"
+STATUS_PROCESSANDO = "processando"
+STATUS_CONCLUIDO = "concluido"
+STATUS_FALHOU = "falhou"
+
+# handler(tipo, payload) -> (resposta: dict, http_status: int)
+Handler = Callable[[str, Dict[str, Any]], Tuple[Dict[str, Any], int]]
+
+
+class NotificationQueue:
+    """Fila de jobs de notificação persistida em SQLite, com pool de workers."""
+
+    MAX_TENTATIVAS_PADRAO = 5
+    LEASE_SEGUNDOS = 120  # sem renovação por esse tempo (processo caiu), o job volta para a fila
+    RENOVACAO_LEASE_SEGUNDOS = 30  # intervalo em que o worker renova o lease do job em andamento
+    RETENCAO_SEGUNDOS = 24 * 3600  # jobs finalizados ficam consultáveis por 24h
+    INTERVALO_POLL_SEGUNDOS = 1.0
+    WORKERS_PRIORITARIOS_PADRAO = 1
+
+    def __init__(self, db_path: Optional[str] = None, max_tentativas: Optional[int] = None):
+        """
+        Args:
+            db_path: Caminho do arquivo SQLite (se None, usa NOTIFY_FILA_DB ou notification_queue.db
+                     na pasta do backend)
+            max_tentativas: Tentativas por job antes de marcar como falhou (se None, usa NOTIFY_FILA_MAX_TENTATIVAS)
+        """
+        self.db_path = db_path or self.caminho_padrao()
+        if max_tentativas is None:
+            max_tentativas = int(os.getenv('NOTIFY_FILA_MAX_TENTATIVAS') or self.MAX_TENTATIVAS_PADRAO)
+        self.max_tentativas = max(1, max_tentativas)
+
+        # Acorda todos os workers a cada enqueue (o worker prioritário não pode perder o aviso)
+        self._novo_job = threading.Condition()
+        self._enfileirados = 0
+        self._parar = threading.Event()
+        self._workers: List[threading.Thread] = []
+        self._criar_tabela()
+
+    @staticmethod
+    def caminho_padrao() -> str:
+        """Arquivo SQLite da fila: NOTIFY_FILA_DB ou notification_queue.db na pasta do backend."""
+        return os.getenv('NOTIFY_FILA_DB') or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'notification_queue.db'
+        )
+
+    def _conectar(self) -> sqlite3.Connection:
+        # Conexão curta por operação: seguro entre threads e entre processos
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _criar_tabela(self):
+        conn = self._conectar()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    tipo TEXT NOT NULL,
+                    prioridade INTEGER NOT NULL DEFAULT 0,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    tentativas INTEGER NOT NULL DEFAULT 0,
+                    resultado TEXT,
+                    http_status INTEGER,
+                    erro TEXT,
+                    criado_em REAL NOT NULL,
+                    atualizado_em REAL NOT NULL,
+                    disponivel_em REAL NOT NULL,
+                    lease_ate REAL
+                )
+                """
+            )
+            colunas = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "prioridade" not in colunas:
+                # Arquivo criado antes das prioridades
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN prioridade INTEGER NOT NULL DEFAULT {PRIORIDADE_NORMAL}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, disponivel_em)")
+        finally:
+            conn.close()
+
+    def enqueue(self, tipo: str, payload: Dict[str, Any], prioridade: int = PRIORIDADE_NORMAL) -> str:
+        """
+        Grava um job na fila.
+
+        Args:
+            tipo: Tipo do job (ex.: "motorista", "base", "status-change")
+            payload: Body JSON original da requisição
+            prioridade: PRIORIDADE_NORMAL ou PRIORIDADE_ALTA (atendida primeiro e por workers dedicados)
+
+        Returns:
+            ID do job
+        """
+        job_id = uuid.uuid4().hex
+        agora = time.time()
+        conn = self._conectar()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, tipo, prioridade, payload, status, criado_em, atualizado_em, disponivel_em) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, tipo, prioridade, json.dumps(payload, ensure_ascii=False), STATUS_PENDENTE,
+                 agora, agora, agora),
+            )
+        finally:
+            conn.close()
+        with self._novo_job:
+            self._enfileirados += 1
+            self._novo_job.notify_all()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Estado de um job (ou None se não existir / já expirou da retenção)."""
+        conn = self._conectar()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {
+            "jobId": row["id"],
+            "tipo": row["tipo"],
+            "prioridade": "alta" if row["prioridade"] >= PRIORIDADE_ALTA else "normal",
+            "status": row["status"],
+            "tentativas": row["tentativas"],
+            "httpStatus": row["http_status"],
+            "resultado": json.loads(row["resultado"]) if row["resultado"] else None,
+            "erro": row["erro"],
+            "criadoEm": row["criado_em"],
+            "atualizadoEm": row["atualizado_em"],
+        }
+
+    def _reservar(self, prioridade_minima: int = PRIORIDADE_NORMAL) -> Optional[sqlite3.Row]:
+        """
+        Reserva (lease) o job pendente de maior prioridade e mais antigo, ou um cujo lease expirou.
+        Com prioridade_minima=PRIORIDADE_ALTA, só considera jobs prioritários.
+        """
+        agora = time.time()
+        conn = self._conectar()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, tipo, payload, tentativas FROM jobs "
+                "WHERE ((status = ? AND disponivel_em <= ?) OR (status = ? AND lease_ate < ?)) "
+                "AND prioridade >= ? "
+                "ORDER BY prioridade DESC, criado_em LIMIT 1",
+                (STATUS_PENDENTE, agora, STATUS_PROCESSANDO, agora, prioridade_minima),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, tentativas = tentativas + 1, lease_ate = ?, atualizado_em = ? "
+                    "WHERE id = ?",
+                    (STATUS_PROCESSANDO, agora + self.LEASE_SEGUNDOS, agora, row["id"]),
+                )
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _renovar_lease(self, job_id: str):
+        """Estende o lease de um job ainda em processamento."""
+        agora = time.time()
+        conn = self._conectar()
+        try:
+            conn.execute(
+                "UPDATE jobs SET lease_ate = ?, atualizado_em = ? WHERE id = ? AND status = ?",
+                (agora + self.LEASE_SEGUNDOS, agora, job_id, STATUS_PROCESSANDO),
+            )
+        finally:
+            conn.close()
+
+    def _manter_lease(self, job_id: str, terminou: threading.Event):
+        """
+        Renova o lease até o job terminar: um broadcast grande com retentativas pode passar de
+        LEASE_SEGUNDOS, e outro worker não pode reservar (e reenviar) o job enquanto ele roda.
+        """
+        while not terminou.wait(self.RENOVACAO_LEASE_SEGUNDOS):
+            try:
+                self._renovar_lease(job_id)
+            except Exception as e:
+                print(f"⚠️ Erro ao renovar lease do job {job_id}: {e}")
+
+    def _finalizar(self, job_id: str, status: str, resultado: Optional[Dict] = None,
+                   http_status: Optional[int] = None, erro: Optional[str] = None,
+                   disponivel_em: Optional[float] = None):
+        agora = time.time()
+        conn = self._conectar()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, resultado = ?, http_status = ?, erro = ?, "
+                "atualizado_em = ?, disponivel_em = ?, lease_ate = NULL WHERE id = ?",
+                (
+                    status,
+                    json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+                    http_status,
+                    erro,
+                    agora,
+                    disponivel_em if disponivel_em is not None else agora,
+                    job_id,
+                ),
+            )
+        finally:
+            conn.close()
+
+    def _limpar_antigos(self):
+        limite = time.time() - self.RETENCAO_SEGUNDOS
+        conn = self._conectar()
+        try:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND atualizado_em < ?",
+                (STATUS_CONCLUIDO, STATUS_FALHOU, limite),
+            )
+        finally:
+            conn.close()
+
+    def processar_um(self, handler: Handler, prioridade_minima: int = PRIORIDADE_NORMAL) -> bool:
+        """
+        Processa o próximo job da fila (só prioritários se prioridade_minima=PRIORIDADE_ALTA).
+        Respostas 5xx e exceções são retentadas com backoff exponencial até max_tentativas;
+        2xx conclui o job e 4xx o marca como falhou (não adianta tentar de novo).
+
+        Returns:
+            True se havia um job para processar
+        """
+        row = self._reservar(prioridade_minima)
+        if row is None:
+            return False
+
+        job_id, tipo, tentativas = row["id"], row["tipo"], row["tentativas"] + 1
+        terminou = threading.Event()
+        threading.Thread(
+            target=self._manter_lease, args=(job_id, terminou), name=f"notify-lease-{job_id[:8]}", daemon=True
+        ).start()
+        try:
+            resposta, http_status = handler(tipo, json.loads(row["payload"]))
+            erro = None if http_status < 400 else str(resposta.get("error") or f"HTTP {http_status}")
+        except Exception as e:
+            resposta, http_status, erro = None, None, f"Exceção: {e}"
+        finally:
+            terminou.set()
+
+        if http_status is not None and http_status < 400:
+            self._finalizar(job_id, STATUS_CONCLUIDO, resposta, http_status)
+            print(f"✅ Job {job_id} ({tipo}) concluído")
+        elif (http_status is None or http_status >= 500) and tentativas < self.max_tentativas:
+            espera = random.uniform(0, min(60.0, 2.0 ** tentativas))
+            self._finalizar(job_id, STATUS_PENDENTE, resposta, http_status, erro, time.time() + espera)
+            print(f"🔁 Job {job_id} ({tipo}) falhou ({erro}); nova tentativa em {espera:.1f}s")
+        else:
+            self._finalizar(job_id, STATUS_FALHOU, resposta, http_status, erro)
+            print(f"❌ Job {job_id} ({tipo}) falhou definitivamente: {erro}")
+        return True
+
+    def _loop_worker(self, handler: Handler, limpar: bool, prioridade_minima: int):
+        ultima_limpeza = 0.0
+        while not self._parar.is_set():
+            visto = self._enfileirados
+            try:
+                if limpar and time.time() - ultima_limpeza > 3600:
+                    self._limpar_antigos()
+                    ultima_limpeza = time.time()
+                if self.processar_um(handler, prioridade_minima):
+                    continue
+            except Exception as e:
+                print(f"⚠️ Erro no worker da fila de notificações: {e}")
+            with self._novo_job:
+                if self._enfileirados == visto and not self._parar.is_set():
+                    self._novo_job.wait(timeout=self.INTERVALO_POLL_SEGUNDOS)
+
+    def start_workers(self, handler: Handler, quantidade: int = 2, prioritarios: Optional[int] = None):
+        """
+        Inicia as threads que consomem a fila (idempotente).
+
+        Args:
+            handler: Função que processa um job
+            quantidade: Workers que atendem qualquer job (prioritários primeiro)
+            prioritarios: Workers extras que só atendem prioridade alta
+                          (se None, usa NOTIFY_FILA_WORKERS_PRIORITARIOS ou WORKERS_PRIORITARIOS_PADRAO)
+        """
+        if self._workers:
+            return
+        if prioritarios is None:
+            prioritarios = int(os.getenv('NOTIFY_FILA_WORKERS_PRIORITARIOS') or self.WORKERS_PRIORITARIOS_PADRAO)
+        quantidade = max(1, quantidade)
+        prioritarios = max(0, prioritarios)
+        for i in range(quantidade + prioritarios):
+            prioridade_minima = PRIORIDADE_ALTA if i >= quantidade else PRIORIDADE_NORMAL
+            nome = f"notify-worker-{i}" if i < quantidade else f"notify-worker-alta-{i - quantidade}"
+            t = threading.Thread(
+                target=self._loop_worker, args=(handler, i == 0, prioridade_minima),
+                name=nome, daemon=True,
+            )
+            t.start()
+            self._workers.append(t)
+        print(f"✅ Fila de notificações ativa ({quantidade} workers + {prioritarios} prioritários, {self.db_path})")
+
+    def stop(self):
+        """Sinaliza os workers para terminarem."""
+        self._parar.set()
+        with self._novo_job:
+            self._novo_job.notify_all()
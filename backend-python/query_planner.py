@@ -0,0 +1,345 @@
+"""
+query_planner.py
+
+Catálogo das consultas que o backend faz no Firestore, com filtros no servidor (where)
+e projeção de campos (select), e o planejador que diz quais índices compostos cada uma exige.
+
+O FirestoreReader monta as consultas a partir deste catálogo, então o plano impresso
+é sempre o que de fato roda.
+
+Uso:
+    python query_planner.py                       # plano de cada consulta + índices compostos
+    python query_planner.py ../Raiz-prompt/firestore.indexes.json   # também aponta os que faltam no arquivo
+"""
+
+import json
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+# Operadores de igualdade (podem ser combinados sem índice composto)
+OPERADORES_IGUALDADE = ('==', 'in', 'array_contains', 'array_contains_any')
+# Operadores de intervalo / desigualdade
+OPERADORES_INTERVALO = ('<', '<=', '>', '>=', '!=', 'not-in')
+
+
+class ConsultaPlanejada:
+    """
+    Uma consulta do catálogo: coleção, filtros (campo, operador), ordenação e campos projetados.
+    Os valores dos filtros são passados em montar(), na mesma ordem dos filtros.
+    """
+
+    def __init__(
+        self,
+        nome: str,
+        colecao: str,
+        filtros: Sequence[Tuple[str, str]] = (),
+        campos: Sequence[str] = (),
+        ordenacao: Sequence[Tuple[str, str]] = (),
+        escopo: str = "COLLECTION",
+        descricao: str = "",
+        indice_explicito: bool = False
+    ):
+        """
+        Args:
+            nome: Identificador da consulta
+            colecao: ID da coleção (ex.: "motoristas" em bases/{baseId}/motoristas)
+            filtros: [(campo, operador)], operador do Firestore ("==", "in", ">", ...)
+            campos: Campos projetados com select() (vazio = documento inteiro)
+            ordenacao: [(campo, "ASCENDING" | "DESCENDING")]
+            escopo: "COLLECTION" ou "COLLECTION_GROUP"
+            descricao: Onde a consulta é usada
+            indice_explicito: Declarar índice composto mesmo só com igualdades (sem ele o Firestore
+                              combina os índices de campo único, mais lento em coleções grandes)
+        """
+        self.nome = nome
+        self.colecao = colecao
+        self.filtros = list(filtros)
+        self.campos = list(campos)
+        self.ordenacao = list(ordenacao)
+        self.escopo = escopo
+        self.descricao = descricao
+        self.indice_explicito = indice_explicito
+
+    def montar(self, ref, *valores, projetar: bool = True):
+        """
+        Aplica filtros e projeção sobre uma CollectionReference (ou collection_group).
+
+        Args:
+            ref: Coleção de origem
+            valores: Um valor por filtro, na ordem de self.filtros
+            projetar: Aplicar select(campos); False para agregações (count)
+        """
+        if len(valores) != len(self.filtros):
+            raise ValueError(f"Consulta {self.nome}: esperava {len(self.filtros)} valores, recebeu {len(valores)}")
+        query = ref
+        for (campo, operador), valor in zip(self.filtros, valores):
+            query = query.where(campo, operador, valor)
+        for campo, direcao in self.ordenacao:
+            query = query.order_by(campo, direction=direcao)
+        if self.campos and projetar:
+            query = query.select(self.campos)
+        return query
+
+    def indice_composto(self) -> Optional[Dict[str, Any]]:
+        """
+        Índice composto exigido pela consulta, no formato de firestore.indexes.json (ou None).
+
+        Regras do Firestore: igualdades sozinhas usam os índices de campo único (merge);
+        um índice composto é necessário quando há igualdade/in junto de intervalo ou ordenação
+        em outro campo, ou intervalo e ordenação em campos diferentes.
+        """
+        igualdade = [c for c, op in self.filtros if op in OPERADORES_IGUALDADE]
+        intervalo = [c for c, op in self.filtros if op in OPERADORES_INTERVALO]
+        ordenados = [c for c, _ in self.ordenacao]
+
+        campos_alem_igualdade = list(dict.fromkeys(intervalo + ordenados))
+        todos = set(igualdade) | set(campos_alem_igualdade)
+        if len(todos) <= 1 or (not campos_alem_igualdade and not self.indice_explicito):
+            return None
+
+        campos: List[Dict[str, str]] = []
+        vistos = set()
+        for campo, op in self.filtros:
+            if op in OPERADORES_IGUALDADE and campo not in vistos:
+                ordem = {"arrayConfig": "CONTAINS"} if op.startswith('array_contains') else {"order": "ASCENDING"}
+                campos.append({"fieldPath": campo, **ordem})
+                vistos.add(campo)
+        direcoes = dict(self.ordenacao)
+        for campo in campos_alem_igualdade:
+            if campo not in vistos:
+                campos.append({"fieldPath": campo, "order": direcoes.get(campo, "ASCENDING")})
+                vistos.add(campo)
+        return {"collectionGroup": self.colecao, "queryScope": self.escopo, "fields": campos}
+
+    def field_overrides(self) -> List[Dict[str, Any]]:
+        """
+        Consultas de collection_group sem índice composto usam o índice de campo único do campo
+        filtrado, que no escopo COLLECTION_GROUP não existe por padrão: precisa de um fieldOverride.
+        O override substitui os índices automáticos do campo, então os do escopo COLLECTION são repetidos.
+        """
+        if self.escopo != "COLLECTION_GROUP" or self.indice_composto() is not None:
+            return []
+        campos = list(dict.fromkeys([c for c, _ in self.filtros] + [c for c, _ in self.ordenacao]))
+        return [
+            {
+                "collectionGroup": self.colecao,
+                "fieldPath": campo,
+                "indexes": [
+                    {"order": "ASCENDING", "queryScope": "COLLECTION"},
+                    {"order": "DESCENDING", "queryScope": "COLLECTION"},
+                    {"arrayConfig": "CONTAINS", "queryScope": "COLLECTION"},
+                    {"order": "ASCENDING", "queryScope": "COLLECTION_GROUP"},
+                ],
+            }
+            for campo in campos
+        ]
+
+    def plano(self) -> Dict[str, Any]:
+        return {
+            "nome": self.nome,
+            "colecao": self.colecao,
+            "escopo": self.escopo,
+            "filtros": [f"{c} {op}" for c, op in self.filtros],
+            "ordenacao": [f"{c} {d}" for c, d in self.ordenacao],
+            "select": self.campos or None,
+            "indice_composto": self.indice_composto(),
+            "indice_explicito": self.indice_explicito,
+            "field_overrides": self.field_overrides(),
+            "descricao": self.descricao,
+        }
+
+
+# Papéis que recebem os avisos de status (get_admins_tokens), comparados após strip().lower().
+# O app grava papel sem normalizar (" admin", "SuperAdmin"), então não há filtro `in` exato no servidor.
+PAPEIS_ADMIN = ('admin', 'auxiliar', 'superadmin', 'ajudante')
+# Modalidades de motorista gravadas pelo app (Motorista.modalidade, padrão FROTA)
+MODALIDADES = ('FROTA', 'PASSEIO', 'DEDICADO', 'UTILITARIO')
+
+
+def variantes_modalidade(modalidade: str) -> List[str]:
+    """Grafias de uma modalidade aceitas no filtro `in` (o diretório compara com upper())."""
+    return list(dict.fromkeys([modalidade, modalidade.lower(), modalidade.capitalize()]))
+
+
+CONSULTAS: Dict[str, ConsultaPlanejada] = {}
+
+
+def registrar(consulta: ConsultaPlanejada) -> ConsultaPlanejada:
+    CONSULTAS[consulta.nome] = consulta
+    return consulta
+
+
+MOTORISTAS_COM_TOKEN = registrar(ConsultaPlanejada(
+    "motoristas_com_token", "motoristas",
+    filtros=[("fcmToken", ">")],
+    campos=["fcmToken", "nome"],
+    descricao="FirestoreReader.get_motoristas_tokens (valor: \"\" = qualquer token não vazio)",
+))
+
+ADMINS_DA_BASE = registrar(ConsultaPlanejada(
+    "admins_da_base", "motoristas",
+    campos=["fcmToken", "nome", "papel"],
+    descricao="FirestoreReader.get_admins_tokens sem diretório (papel normalizado e filtrado em Python)",
+))
+
+USUARIO_POR_AUTH_UID = registrar(ConsultaPlanejada(
+    "usuario_por_auth_uid", "usuarios",
+    filtros=[("authUid", "==")],
+    campos=["papel"],
+    descricao="FirestoreReader.get_usuario_papel (login anônimo: ID do doc diferente do Auth UID)",
+))
+
+MOTORISTA_POR_AUTH_UID = registrar(ConsultaPlanejada(
+    "motorista_por_auth_uid", "motoristas",
+    filtros=[("authUid", "==")],
+    campos=["papel"],
+    descricao="FirestoreReader.get_usuario_papel (login anônimo: ID do doc diferente do Auth UID)",
+))
+
+DISPONIBILIDADES_DO_DIA = registrar(ConsultaPlanejada(
+    "disponibilidades_do_dia", "disponibilidades",
+    filtros=[("baseId", "=="), ("data", "in")],
+    descricao="FirestoreReader._contexto_disponibilidade (valores: baseId, [hoje, amanha])",
+    indice_explicito=True,
+))
+
+# ativo ausente conta como ativo (como no diretório e no app), então o servidor filtra só papel
+# e os inativos (ativo == false) são descontados: na projeção em Python, nas contagens com count()
+MOTORISTAS_DA_BASE = registrar(ConsultaPlanejada(
+    "motoristas_da_base", "motoristas",
+    filtros=[("papel", "==")],
+    campos=["nome", "modalidade", "ativo"],
+    descricao="FirestoreReader._contexto_motoristas sem diretório; count() do total em "
+              "contar_motoristas_ativos (valor: \"motorista\")",
+))
+
+MOTORISTAS_INATIVOS = registrar(ConsultaPlanejada(
+    "motoristas_inativos", "motoristas",
+    filtros=[("papel", "=="), ("ativo", "==")],
+    descricao="FirestoreReader.contar_motoristas_ativos: count() dos inativos (valores: \"motorista\", False)",
+))
+
+MOTORISTAS_POR_MODALIDADE = registrar(ConsultaPlanejada(
+    "motoristas_por_modalidade", "motoristas",
+    filtros=[("papel", "=="), ("modalidade", "in")],
+    descricao="FirestoreReader.contar_motoristas_ativos: count() por modalidade "
+              "(valores: \"motorista\", variantes_modalidade(m))",
+))
+
+# Quem não tem modalidade (FROTA) não aparece em nenhum índice de modalidade: é o total menos estes
+MOTORISTAS_COM_MODALIDADE = registrar(ConsultaPlanejada(
+    "motoristas_com_modalidade", "motoristas",
+    filtros=[("papel", "=="), ("modalidade", "!=")],
+    descricao="FirestoreReader.contar_motoristas_ativos: count() de quem tem modalidade (valores: \"motorista\", None)",
+))
+
+MOTORISTAS_INATIVOS_COM_MODALIDADE = registrar(ConsultaPlanejada(
+    "motoristas_inativos_com_modalidade", "motoristas",
+    filtros=[("papel", "=="), ("ativo", "=="), ("modalidade", "!=")],
+    descricao="FirestoreReader.contar_motoristas_ativos: count() dos inativos com modalidade "
+              "(valores: \"motorista\", False, None)",
+))
+
+MOTORISTAS_INATIVOS_POR_MODALIDADE = registrar(ConsultaPlanejada(
+    "motoristas_inativos_por_modalidade", "motoristas",
+    filtros=[("papel", "=="), ("modalidade", "in"), ("ativo", "==")],
+    descricao="FirestoreReader.contar_motoristas_ativos: count() dos inativos por modalidade "
+              "(valores: \"motorista\", variantes_modalidade(m), False)",
+))
+
+QUINZENAS_DO_MES = registrar(ConsultaPlanejada(
+    "quinzenas_do_mes", "quinzenas",
+    filtros=[("baseId", "=="), ("mes", "=="), ("ano", "==")],
+    descricao="FirestoreReader._contexto_quinzena e QuinzenaEngine (valores: baseId, mes, ano)",
+))
+
+APLICADAS_DO_MES = registrar(ConsultaPlanejada(
+    "devolucoes_aplicadas_do_mes", "devolucoes_aplicadas",
+    filtros=[("mes", "==")],
+    campos=["mes"],
+    descricao="DevolucaoRollup.reconstruir de um mês: marcadores a conferir (valor: yyyy-mm)",
+))
+
+
+USUARIO_POR_AUTH_UID_GLOBAL = registrar(ConsultaPlanejada(
+    "usuario_por_auth_uid_global", "usuarios",
+    filtros=[("authUid", "==")],
+    campos=["papel"],
+    escopo="COLLECTION_GROUP",
+    descricao="FirestoreReader.get_usuario_papel_in_any_base enquanto o RoleIndex não hidratou",
+))
+
+MOTORISTA_POR_AUTH_UID_GLOBAL = registrar(ConsultaPlanejada(
+    "motorista_por_auth_uid_global", "motoristas",
+    filtros=[("authUid", "==")],
+    campos=["papel"],
+    escopo="COLLECTION_GROUP",
+    descricao="FirestoreReader.get_usuario_papel_in_any_base enquanto o RoleIndex não hidratou",
+))
+
+DEVOLUCOES_RECENTES_GLOBAL = registrar(ConsultaPlanejada(
+    "devolucoes_recentes_global", "devolucoes",
+    filtros=[("timestamp", ">=")],
+    escopo="COLLECTION_GROUP",
+    descricao="DevolucaoRollup.observar (valor: timestamp em ms do início da janela)",
+))
+
+
+def indices_compostos() -> List[Dict[str, Any]]:
+    """Índices compostos exigidos pelo catálogo, sem repetição."""
+    indices = []
+    for consulta in CONSULTAS.values():
+        indice = consulta.indice_composto()
+        if indice is not None and indice not in indices:
+            indices.append(indice)
+    return indices
+
+
+def field_overrides() -> List[Dict[str, Any]]:
+    """fieldOverrides exigidos pelo catálogo (índices de campo único em collection group), sem repetição."""
+    overrides = []
+    for consulta in CONSULTAS.values():
+        for override in consulta.field_overrides():
+            if override not in overrides:
+                overrides.append(override)
+    return overrides
+
+
+def indices_faltando(arquivo_indices: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Índices compostos e fieldOverrides do catálogo que não estão no firestore.indexes.json informado."""
+    with open(arquivo_indices, 'r') as f:
+        existentes = json.load(f) or {}
+    indices = existentes.get("indexes") or []
+    overrides = {(o.get("collectionGroup"), o.get("fieldPath")) for o in existentes.get("fieldOverrides") or []}
+    return {
+        "indexes": [i for i in indices_compostos() if i not in indices],
+        "fieldOverrides": [o for o in field_overrides() if (o["collectionGroup"], o["fieldPath"]) not in overrides],
+    }
+
+
+def main():
+    for consulta in CONSULTAS.values():
+        plano = consulta.plano()
+        print(f"🔎 {plano['nome']} ({plano['escopo']} {plano['colecao']})")
+        print(f"   where: {', '.join(plano['filtros']) or '-'}")
+        if plano['ordenacao']:
+            print(f"   order_by: {', '.join(plano['ordenacao'])}")
+        print(f"   select: {', '.join(plano['select']) if plano['select'] else 'documento inteiro'}")
+        indice = plano['indice_composto']
+        print(f"   índice composto: {json.dumps(indice['fields']) if indice else 'não precisa'}")
+        for override in plano['field_overrides']:
+            print(f"   fieldOverride: {override['collectionGroup']}.{override['fieldPath']} (COLLECTION_GROUP)")
+
+    print(f"\n📋 Índices compostos necessários: {len(indices_compostos())}; fieldOverrides: {len(field_overrides())}")
+    if len(sys.argv) > 1:
+        faltando = indices_faltando(sys.argv[1])
+        if faltando["indexes"] or faltando["fieldOverrides"]:
+            print(f"⚠️ Faltando em {sys.argv[1]}:")
+            print(json.dumps(faltando, indent=4, ensure_ascii=False))
+        else:
+            print(f"✅ Todos presentes em {sys.argv[1]}")
+
+
+if __name__ == "__main__":
+    main()
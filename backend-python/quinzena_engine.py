@@ -0,0 +1,224 @@
+"""
+quinzena_engine.py
+
+Recalcula os dias trabalhados por quinzena (coleção quinzenas) a partir das escalas do mês.
+
+O assistente e o app leem quinzenas/{baseId}_{motoristaId}_{mes}_{ano}.diasTrabalhados, que só
+reflete as marcações feitas no app. Aqui o mês inteiro de escalas da base (escalas/{yyyy-mm-dd}_{AM|PM},
+até 62 documentos) é lido num get_all em lote, vira uma matriz motorista x dia (NumPy) e a 1ª quinzena
+(dias 1-15) e a 2ª (16 até o fim do mês) de todos os motoristas saem de uma soma por eixo.
+Um motorista escalado no AM e no PM do mesmo dia conta um dia.
+
+Gravação (BulkWriter, só os documentos que mudaram):
+- padrão: junta com as marcações do app; cada data fica com o maior entre as marcações manuais e a escala
+  (dias marcados à mão sem escala e marcações repetidas são preservados);
+- substituir=True: a escala passa a ser a única fonte (marcações manuais do mês são descartadas).
+
+Uso:
+    python quinzena_engine.py <service_account.json> <baseId|--todas> [yyyy-mm] [--substituir]
+"""
+
+import calendar
+import sys
+import time
+from collections import Counter
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from query_planner import QUINZENAS_DO_MES
+
+
+TURNOS = ('AM', 'PM')
+ULTIMO_DIA_PRIMEIRA_QUINZENA = 15
+
+
+def matriz_presenca(escalas_por_dia: Sequence[Sequence[Dict[str, Any]]]) -> Tuple[List[str], Dict[str, str], np.ndarray]:
+    """
+    Matriz de presença a partir das escalas do mês.
+
+    Args:
+        escalas_por_dia: Para cada dia do mês (índice 0 = dia 1), os documentos de escala do dia (AM, PM)
+
+    Returns:
+        (ids dos motoristas, {id: nome}, matriz bool motoristas x dias)
+    """
+    indice: Dict[str, int] = {}
+    nomes: Dict[str, str] = {}
+    linhas: List[int] = []
+    colunas: List[int] = []
+    for dia, escalas in enumerate(escalas_por_dia):
+        for escala in escalas:
+            for onda in escala.get('ondas') or []:
+                for item in onda.get('itens') or []:
+                    mid = (item.get('motoristaId') or '').strip()
+                    if not mid:
+                        continue
+                    linha = indice.setdefault(mid, len(indice))
+                    nome = (item.get('nome') or '').strip()
+                    if nome:
+                        nomes[mid] = nome
+                    linhas.append(linha)
+                    colunas.append(dia)
+    presenca = np.zeros((len(indice), len(escalas_por_dia)), dtype=bool)
+    presenca[np.asarray(linhas, dtype=np.intp), np.asarray(colunas, dtype=np.intp)] = True
+    return list(indice), nomes, presenca
+
+
+def contar_quinzenas(presenca: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Dias trabalhados de cada motorista (linha) na 1ª e na 2ª quinzena."""
+    q1 = presenca[:, :ULTIMO_DIA_PRIMEIRA_QUINZENA].sum(axis=1)
+    q2 = presenca[:, ULTIMO_DIA_PRIMEIRA_QUINZENA:].sum(axis=1)
+    return q1, q2
+
+
+def calcular_quinzenas(
+    escalas_por_dia: Sequence[Sequence[Dict[str, Any]]],
+    ano: int,
+    mes: int
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Quinzenas de todos os motoristas escalados no mês.
+
+    Returns:
+        {motoristaId: {"motoristaNome", "primeiraQuinzena": {"diasTrabalhados", "datas"}, "segundaQuinzena": {...}}}
+        (datas em dd/MM/yyyy, como o app grava)
+    """
+    ids, nomes, presenca = matriz_presenca(escalas_por_dia)
+    q1, q2 = contar_quinzenas(presenca)
+    rotulos = np.array([f"{dia:02d}/{mes:02d}/{ano}" for dia in range(1, presenca.shape[1] + 1)], dtype=object)
+    linhas, colunas = np.nonzero(presenca)  # em ordem de linha e, dentro dela, de dia
+    cortes = np.searchsorted(linhas, np.arange(len(ids) + 1))
+    resultado = {}
+    for i, mid in enumerate(ids):
+        dias = colunas[cortes[i]:cortes[i + 1]]
+        separacao = int(q1[i])
+        resultado[mid] = {
+            "motoristaNome": nomes.get(mid, ""),
+            "primeiraQuinzena": {"diasTrabalhados": separacao, "datas": rotulos[dias[:separacao]].tolist()},
+            "segundaQuinzena": {"diasTrabalhados": int(q2[i]), "datas": rotulos[dias[separacao:]].tolist()},
+        }
+    return resultado
+
+
+def _chave_data(data: str) -> Tuple[int, int, int]:
+    try:
+        dia, mes, ano = (int(p) for p in data.split('/'))
+        return ano, mes, dia
+    except ValueError:
+        return 0, 0, 0
+
+
+def juntar_datas(manuais: Sequence[str], da_escala: Sequence[str]) -> List[str]:
+    """Cada data com max(marcações manuais, 1 se escalado), em ordem de data."""
+    contagem = Counter(d for d in manuais if isinstance(d, str) and d)
+    for data in da_escala:
+        if contagem[data] == 0:
+            contagem[data] = 1
+    return [data for data in sorted(contagem, key=_chave_data) for _ in range(contagem[data])]
+
+
+class QuinzenaEngine:
+    """Calcula e grava as quinzenas de uma base a partir das escalas (usa o get_all em lote do FirestoreReader)."""
+
+    def __init__(self, reader):
+        """
+        Args:
+            reader: FirestoreReader (cliente do Firestore e leitura em lote)
+        """
+        self.reader = reader
+        self.db = reader.db
+
+    def carregar_escalas(self, base_id: str, ano: int, mes: int) -> List[List[Dict[str, Any]]]:
+        """Documentos de escala de cada dia do mês (AM e PM), lidos em um get_all."""
+        escalas_ref = self.db.collection('bases').document(base_id).collection('escalas')
+        dias = calendar.monthrange(ano, mes)[1]
+        refs = [
+            escalas_ref.document(f"{date(ano, mes, dia).isoformat()}_{turno}")
+            for dia in range(1, dias + 1) for turno in TURNOS
+        ]
+        snapshots = self.reader.ler_documentos(refs, field_paths=['ondas'])
+        escalas_por_dia: List[List[Dict[str, Any]]] = [[] for _ in range(dias)]
+        for i, ref in enumerate(refs):
+            snap = snapshots.get(ref.path)
+            if snap is not None and snap.exists:
+                escalas_por_dia[i // len(TURNOS)].append(snap.to_dict() or {})
+        return escalas_por_dia
+
+    def _existentes(self, base_id: str, ano: int, mes: int) -> Dict[str, Dict[str, Any]]:
+        docs = QUINZENAS_DO_MES.montar(self.db.collection('quinzenas'), base_id, mes, ano).stream()
+        return {doc.id: doc.to_dict() or {} for doc in docs}
+
+    def recalcular(self, base_id: str, ano: int, mes: int, substituir: bool = False) -> Dict[str, Any]:
+        """
+        Calcula as quinzenas do mês a partir das escalas e grava as que mudaram.
+
+        Returns:
+            {"motoristas": escalados no mês, "gravados": documentos gravados, "ms_calculo", "ms_total"}
+        """
+        inicio = time.perf_counter()
+        escalas_por_dia = self.carregar_escalas(base_id, ano, mes)
+        inicio_calculo = time.perf_counter()
+        calculadas = calcular_quinzenas(escalas_por_dia, ano, mes)
+        ms_calculo = (time.perf_counter() - inicio_calculo) * 1000
+        existentes = self._existentes(base_id, ano, mes)
+
+        vazia = {"motoristaNome": "", "primeiraQuinzena": {"datas": []}, "segundaQuinzena": {"datas": []}}
+        por_doc = {f"{base_id}_{mid}_{mes}_{ano}": (mid, q) for mid, q in calculadas.items()}
+        if substituir:
+            # Motoristas com quinzena gravada mas sem escala no mês ficam zerados
+            for doc_id, atual in existentes.items():
+                if doc_id not in por_doc and atual.get('motoristaId'):
+                    por_doc[doc_id] = (atual['motoristaId'], vazia)
+
+        agora = int(time.time() * 1000)
+        gravados = 0
+        writer = self.db.bulk_writer()
+        for doc_id, (mid, q) in por_doc.items():
+            atual = existentes.get(doc_id) or {}
+            novo = {
+                "motoristaId": mid,
+                "motoristaNome": (atual.get('motoristaNome') or '').strip() or q["motoristaNome"],
+                "baseId": base_id,
+                "mes": mes,
+                "ano": ano,
+            }
+            for campo in ('primeiraQuinzena', 'segundaQuinzena'):
+                datas = q[campo]["datas"]
+                if not substituir:
+                    datas = juntar_datas((atual.get(campo) or {}).get('datas') or [], datas)
+                novo[campo] = {"diasTrabalhados": len(datas), "datas": datas}
+            if atual and all(atual.get(k) == v for k, v in novo.items()):
+                continue
+            novo["atualizadoEm"] = agora
+            writer.set(self.db.collection('quinzenas').document(doc_id), novo)
+            gravados += 1
+        writer.close()
+
+        if gravados:
+            self.reader.invalidar_cache_contexto(base_id, 'quinzena')
+        ms_total = (time.perf_counter() - inicio) * 1000
+        print(f"🗓️ Quinzenas {mes:02d}/{ano} da base {base_id}: {len(calculadas)} motorista(s) escalado(s), "
+              f"{gravados} documento(s) gravado(s) (cálculo {ms_calculo:.1f}ms, total {ms_total:.0f}ms)")
+        return {"motoristas": len(calculadas), "gravados": gravados, "ms_calculo": ms_calculo, "ms_total": ms_total}
+
+
+def main():
+    args = [a for a in sys.argv[1:] if a != '--substituir']
+    if len(args) < 2:
+        print("Uso: python quinzena_engine.py <service_account.json> <baseId|--todas> [yyyy-mm] [--substituir]")
+        sys.exit(1)
+    from firestore_reader import FirestoreReader
+
+    reader = FirestoreReader(args[0], usar_diretorio=False, usar_indice_papeis=False, usar_resumo_devolucoes=False)
+    hoje = date.today()
+    ano, mes = (int(args[2][:4]), int(args[2][5:7])) if len(args) > 2 else (hoje.year, hoje.month)
+    engine = QuinzenaEngine(reader)
+    base_ids = reader.get_all_bases() if args[1] == '--todas' else [args[1]]
+    for base_id in base_ids:
+        engine.recalcular(base_id, ano, mes, substituir='--substituir' in sys.argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+rate_limiter.py
+
+Limitador de taxa (token bucket) para os envios ao FCM, um por projeto Firebase.
+Mantém os broadcasts grandes no limite da cota em vez de estourar com 429,
+e respeita o Retry-After devolvido pelo FCM pausando o bucket inteiro.
+
+Os envios têm duas prioridades: PRIORIDADE_ALTA (mudança de status, chamada de um motorista,
+pedido de localização) tem uma fração da cota reservada, para que um broadcast grande
+não atrase as chamadas para a doca.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+PRIORIDADE_NORMAL = 0  # broadcasts (/notify/base)
+PRIORIDADE_ALTA = 1    # status, chamada individual, localização
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe.
+
+    reservar() consome um token e devolve quantos segundos o chamador deve aguardar
+    antes de enviar (0 se havia token disponível). O chamador é quem dorme
+    (time.sleep no envio síncrono, asyncio.sleep no assíncrono).
+    """
+
+    def __init__(self, taxa_por_segundo: float, capacidade: Optional[float] = None):
+        """
+        Args:
+            taxa_por_segundo: Tokens repostos por segundo (mensagens por segundo)
+            capacidade: Rajada máxima (se None, igual à taxa = 1 segundo de rajada)
+        """
+        self.taxa = max(0.001, float(taxa_por_segundo))
+        self.capacidade = max(1.0, float(capacidade if capacidade is not None else self.taxa))
+        self._tokens = self.capacidade
+        self._atualizado_em = time.monotonic()
+        self._pausado_ate = 0.0
+        self._lock = threading.Lock()
+
+        self.reservas = 0
+        self.reservas_com_espera = 0
+        self.espera_total = 0.0
+        self.pausas = 0
+
+    def _recarregar(self, agora: float):
+        decorrido = agora - self._atualizado_em
+        if decorrido > 0:
+            self._tokens = min(self.capacidade, self._tokens + decorrido * self.taxa)
+            self._atualizado_em = agora
+
+    def reservar(self, n: float = 1, prioridade: int = PRIORIDADE_NORMAL) -> float:
+        """
+        Reserva n tokens. O bucket simples atende todas as prioridades na mesma fila
+        (ver BucketComPrioridade).
+
+        Returns:
+            Segundos a aguardar antes de usar a reserva
+        """
+        with self._lock:
+            agora = time.monotonic()
+            self._recarregar(agora)
+            self._tokens -= n
+            espera = -self._tokens / self.taxa if self._tokens < 0 else 0.0
+            espera = max(espera, self._pausado_ate - agora)
+            self.reservas += 1
+            if espera > 0:
+                self.reservas_com_espera += 1
+                self.espera_total += espera
+            return espera
+
+    def tentar_reservar(self, n: float = 1) -> bool:
+        """Reserva n tokens só se estiverem disponíveis agora (sem espera e sem dívida)."""
+        with self._lock:
+            agora = time.monotonic()
+            self._recarregar(agora)
+            if self._tokens < n or self._pausado_ate > agora:
+                return False
+            self._tokens -= n
+            self.reservas += 1
+            return True
+
+    def pausar(self, segundos: float):
+        """Suspende as reservas por alguns segundos (ex.: Retry-After de um 429)."""
+        with self._lock:
+            self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos)
+            self.pausas += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "taxa_por_segundo": self.taxa,
+                "capacidade": self.capacidade,
+                "reservas": self.reservas,
+                "reservas_com_espera": self.reservas_com_espera,
+                "espera_total_s": round(self.espera_total, 3),
+                "pausas_retry_after": self.pausas,
+            }
+
+
+class BucketComPrioridade:
+    """
+    Cota do projeto dividida em duas faixas.
+
+    A faixa normal (broadcasts) só recebe (1 - fracao_reservada) da taxa. A faixa alta tem a
+    fração reservada e, quando ela se esgota, ainda pode pegar tokens livres da faixa normal.
+    A soma das duas nunca passa da taxa total, e uma fila de broadcast acumulada na faixa
+    normal não entra na frente dos envios prioritários.
+    """
+
+    FRACAO_RESERVADA_PADRAO = 0.2
+
+    def __init__(self, taxa_por_segundo: float, fracao_reservada: Optional[float] = None):
+        """
+        Args:
+            taxa_por_segundo: Mensagens por segundo do projeto (soma das duas faixas)
+            fracao_reservada: Parte da taxa reservada à prioridade alta
+                              (se None, usa FCM_FRACAO_PRIORITARIA ou FRACAO_RESERVADA_PADRAO)
+        """
+        if fracao_reservada is None:
+            fracao_reservada = float(os.getenv('FCM_FRACAO_PRIORITARIA') or self.FRACAO_RESERVADA_PADRAO)
+        self.fracao_reservada = min(0.9, max(0.05, fracao_reservada))
+        self.taxa = max(0.001, float(taxa_por_segundo))
+        self.normal = TokenBucket(self.taxa * (1 - self.fracao_reservada))
+        self.alta = TokenBucket(self.taxa * self.fracao_reservada)
+        self._lock = threading.Lock()
+        self.emprestimos = 0  # envios prioritários atendidos com tokens livres da faixa normal
+
+    def reservar(self, n: float = 1, prioridade: int = PRIORIDADE_NORMAL) -> float:
+        """
+        Reserva n tokens na faixa da prioridade.
+
+        Returns:
+            Segundos a aguardar antes de usar a reserva
+        """
+        if prioridade < PRIORIDADE_ALTA:
+            return self.normal.reservar(n)
+        if self.alta.tentar_reservar(n):
+            return 0.0
+        if self.normal.tentar_reservar(n):
+            with self._lock:
+                self.emprestimos += 1
+            return 0.0
+        return self.alta.reservar(n)
+
+    def pausar(self, segundos: float):
+        """Suspende as duas faixas (o Retry-After vale para o projeto inteiro)."""
+        self.normal.pausar(segundos)
+        self.alta.pausar(segundos)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            emprestimos = self.emprestimos
+        return {
+            "taxa_por_segundo": self.taxa,
+            "fracao_reservada": self.fracao_reservada,
+            "emprestimos_da_faixa_normal": emprestimos,
+            "normal": self.normal.stats(),
+            "alta": self.alta.stats(),
+        }
+
+
+_buckets: Dict[str, BucketComPrioridade] = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket_do_projeto(project_id: str, taxa_por_segundo: float) -> BucketComPrioridade:
+    """Retorna o bucket compartilhado do projeto Firebase (criado na primeira chamada)."""
+    with _buckets_lock:
+        bucket = _buckets.get(project_id)
+        if bucket is None:
+            bucket = _buckets[project_id] = BucketComPrioridade(taxa_por_segundo)
+        return bucket
@@ -0,0 +1,212 @@
+"""
+role_index.py
+
+Índice reverso UID -> (baseId, papel) de todas as bases.
+
+get_usuario_papel_in_any_base percorria todas as bases com até quatro leituras por base.
+Este índice é montado por listeners (on_snapshot) de collection_group em usuarios e motoristas:
+o primeiro snapshot carrega todos os documentos de todas as bases, e as mudanças seguintes
+mantêm o índice em dia. A consulta do papel vira um lookup em dicionário.
+
+Cada documento entra no índice pelo ID (usuarios/{uid}) e pelo campo authUid
+(login anônimo: o ID do documento é diferente do Auth UID).
+
+A precedência é a da leitura direta (get_usuario_papel, base a base): em cada base vale o primeiro
+vínculo em usuarios por ID, usuarios por authUid, motoristas por ID, motoristas por authUid, mesmo sem papel.
+Um usuarios/{uid} sem papel não é completado pelo papel de motoristas da mesma base.
+
+Nenhuma consulta espera a hidratação: até o primeiro snapshot das duas coleções chegar,
+vinculos() devolve None e o chamador usa a busca direta (collection_group por authUid).
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+
+# Mesma ordem de get_usuario_papel: usuarios antes de motoristas
+COLECOES_INDICE = ('usuarios', 'motoristas')
+
+# (base_id, colecao, papel)
+Vinculo = Tuple[str, str, Optional[str]]
+# (base_id, colecao, via): via 0 = ID do documento, 1 = campo authUid
+ChaveVinculo = Tuple[str, str, int]
+
+
+def papel_por_precedencia(vinculos: List[Vinculo]) -> Optional[str]:
+    """
+    Papel de vínculos já ordenados (por base e precedência): em cada base só o primeiro vínculo conta,
+    mesmo sem papel; vale o da primeira base em que ele tem papel.
+    """
+    decididas = set()
+    for base_id, _, papel in vinculos:
+        if base_id in decididas:
+            continue
+        decididas.add(base_id)
+        if papel:
+            return papel
+    return None
+
+
+def _base_do_documento(doc) -> Optional[str]:
+    """ID da base de bases/{baseId}/{colecao}/{docId} (None para coleções homônimas fora de bases/)."""
+    base_ref = doc.reference.parent.parent
+    if base_ref is None or base_ref.parent.id != 'bases':
+        return None
+    return base_ref.id
+
+
+class RoleIndex:
+    """Índice UID -> vínculos (baseId, coleção, papel), mantido por listeners de collection_group."""
+
+    def __init__(self, db):
+        """
+        Args:
+            db: Cliente do Firestore
+        """
+        self.db = db
+
+        self._lock = threading.Lock()
+        self._por_uid: Dict[str, Dict[ChaveVinculo, Optional[str]]] = {}
+        self._chaves_do_doc: Dict[str, List[Tuple[str, ChaveVinculo]]] = {}  # caminho -> [(uid, chave)]
+        self._hidratadas = {col: threading.Event() for col in COLECOES_INDICE}
+        self._watches: Dict[str, Any] = {}
+        self._iniciado = False
+        self._ao_mudar: List[Callable[[Optional[Set[str]]], None]] = []
+
+        self.consultas = 0
+        self.acertos = 0
+        self.indisponivel = 0
+
+    def iniciar(self):
+        """Registra os listeners (idempotente). A hidratação acontece em background."""
+        with self._lock:
+            if self._iniciado and all(getattr(w, 'is_active', True) for w in self._watches.values()):
+                return
+            self._iniciado = True
+            for evento in self._hidratadas.values():
+                evento.clear()
+            antigos = list(self._watches.values())
+            self._watches = {}
+        for watch in antigos:
+            try:
+                watch.unsubscribe()
+            except Exception:
+                pass
+        for col in COLECOES_INDICE:
+            self._watches[col] = self.db.collection_group(col).on_snapshot(
+                lambda docs, changes, read_time, col=col: self._aplicar_snapshot(col, docs, changes)
+            )
+        print("👀 Índice de papéis (UID -> base) sendo montado por collection_group")
+
+    def ao_mudar(self, callback: Callable[[Optional[Set[str]]], None]):
+        """
+        Registra um callback chamado quando vínculos mudam: callback(uids alterados),
+        ou callback(None) quando uma coleção foi (re)carregada inteira.
+        """
+        with self._lock:
+            self._ao_mudar.append(callback)
+
+    def _notificar(self, uids: Optional[Set[str]]):
+        for callback in list(self._ao_mudar):
+            try:
+                callback(uids)
+            except Exception as e:
+                print(f"⚠️ Erro no callback do índice de papéis: {e}")
+
+    def _remover_doc(self, caminho: str) -> List[str]:
+        anterior = self._chaves_do_doc.pop(caminho, None)
+        if anterior is None:
+            return []
+        for uid, chave in anterior:
+            vinculos = self._por_uid.get(uid)
+            if vinculos is not None:
+                vinculos.pop(chave, None)
+                if not vinculos:
+                    del self._por_uid[uid]
+        return [uid for uid, _ in anterior]
+
+    def _indexar_doc(self, col: str, doc) -> List[str]:
+        """Indexa o documento. Returns: UIDs afetados (antigos e novos)."""
+        caminho = doc.reference.path
+        afetados = self._remover_doc(caminho)
+        base_id = _base_do_documento(doc)
+        if base_id is None:
+            return afetados
+        data = doc.to_dict() or {}
+        chaves = [(doc.id, (base_id, col, 0))]
+        auth_uid = data.get('authUid')
+        if isinstance(auth_uid, str) and auth_uid and auth_uid != doc.id:
+            chaves.append((auth_uid, (base_id, col, 1)))
+        for uid, chave in chaves:
+            self._por_uid.setdefault(uid, {})[chave] = data.get('papel')
+        self._chaves_do_doc[caminho] = chaves
+        return afetados + [uid for uid, _ in chaves]
+
+    def _aplicar_snapshot(self, col: str, docs, changes):
+        afetados: Optional[Set[str]] = set()
+        with self._lock:
+            if not self._hidratadas[col].is_set():
+                for caminho in [
+                    c for c, chaves in self._chaves_do_doc.items() if any(chave[1] == col for _, chave in chaves)
+                ]:
+                    self._remover_doc(caminho)
+                for doc in docs:
+                    self._indexar_doc(col, doc)
+                afetados = None
+            else:
+                for change in changes:
+                    if change.type.name == 'REMOVED':
+                        afetados.update(self._remover_doc(change.document.reference.path))
+                    else:
+                        afetados.update(self._indexar_doc(col, change.document))
+        self._hidratadas[col].set()
+        if afetados is None or afetados:
+            self._notificar(afetados)
+
+    def _pronto(self) -> bool:
+        """True se as duas coleções já hidrataram (não espera; garante os listeners registrados)."""
+        self.iniciar()
+        return all(evento.is_set() for evento in self._hidratadas.values())
+
+    def vinculos(self, uid: str) -> Optional[List[Vinculo]]:
+        """
+        Bases e papéis do UID, ordenados por baseId e, na base, pela precedência de get_usuario_papel
+        (usuarios antes de motoristas; por ID antes de por authUid).
+
+        Returns:
+            Lista (vazia se o UID não está em nenhuma base), ou None enquanto o índice hidrata
+        """
+        pronto = self._pronto()
+        with self._lock:
+            self.consultas += 1
+            if not pronto:
+                self.indisponivel += 1
+                return None
+            vinculos = self._por_uid.get(uid) or {}
+            if vinculos:
+                self.acertos += 1
+            ordenados = sorted(vinculos.items(), key=lambda v: (v[0][0], COLECOES_INDICE.index(v[0][1]), v[0][2]))
+            return [(base_id, col, papel) for (base_id, col, _), papel in ordenados]
+
+    def papel_em_qualquer_base(self, uid: str) -> Tuple[bool, Optional[str]]:
+        """
+        Papel na primeira base (por baseId) em que o vínculo de maior precedência tem papel.
+
+        Returns:
+            (disponivel, papel): disponivel=False se o índice não hidratou (use a busca direta)
+        """
+        vinculos = self.vinculos(uid)
+        if vinculos is None:
+            return False, None
+        return True, papel_por_precedencia(vinculos)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hidratado": all(e.is_set() for e in self._hidratadas.values()),
+                "uids": len(self._por_uid),
+                "documentos": len(self._chaves_do_doc),
+                "consultas": self.consultas,
+                "acertos": self.acertos,
+                "indisponivel": self.indisponivel,
+            }
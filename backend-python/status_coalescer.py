@@ -0,0 +1,148 @@
+"""
+status_coalescer.py
+
+Coalescência das notificações de mudança de status (/notify/status-change).
+
+- Repetições: o app pode postar o mesmo status várias vezes em poucos segundos
+  (reenvio, geofence oscilando entre PROXIMO e CHEGUEI). Dentro da janela, a chave
+  (baseId, motoristaId, status) só dispara notificação na primeira vez; se o envio falhar,
+  a chave é removida (cancelar) e a próxima tentativa notifica normalmente.
+- Avisos aos admins: cada aviso é enviado na hora, dentro da própria requisição (ou job da fila).
+  Enquanto um envio aos admins de uma base está em andamento, os avisos que chegam para a mesma
+  base esperam e saem juntos no envio seguinte, em vez de um fan-out por motorista.
+
+O estado fica em memória do processo (com vários workers do gunicorn, cada um coalesce o que recebe).
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# enviar(base_id, eventos): eventos na ordem de chegada, cada um um dicionário livre do chamador
+EnviarDigest = Callable[[str, List[Dict[str, Any]]], None]
+
+
+class _LoteAdmin:
+    """Avisos aos admins de uma base que sairão no mesmo envio."""
+
+    def __init__(self):
+        self.eventos: List[Dict[str, Any]] = []
+        self.finalizado = False
+        self.erro: Optional[Exception] = None
+
+
+class StatusCoalescer:
+    """Descarta status repetidos e agrupa os avisos aos admins por base."""
+
+    JANELA_REPETICAO_PADRAO = 30.0  # segundos em que o mesmo status do mesmo motorista é ignorado
+
+    def __init__(self, janela_repeticao: Optional[float] = None):
+        """
+        Args:
+            janela_repeticao: Segundos da janela de repetição (se None, usa NOTIFY_STATUS_JANELA_S);
+                              0 desativa o descarte
+        """
+        if janela_repeticao is None:
+            janela_repeticao = float(os.getenv('NOTIFY_STATUS_JANELA_S') or self.JANELA_REPETICAO_PADRAO)
+        self.janela_repeticao = max(0.0, janela_repeticao)
+
+        self._lock = threading.Lock()
+        self._envio_concluido = threading.Condition(self._lock)
+        self._vistos: Dict[Tuple[str, str, str], float] = {}
+        self._ultima_limpeza = time.monotonic()
+        self._em_envio: set = set()  # bases com envio aos admins em andamento
+        self._proximos: Dict[str, _LoteAdmin] = {}  # avisos esperando o envio em andamento terminar
+
+        self.status_recebidos = 0
+        self.status_repetidos = 0
+        self.avisos_admin = 0
+        self.digests_enviados = 0
+
+    def _limpar_vistos(self, agora: float):
+        if agora - self._ultima_limpeza < self.janela_repeticao:
+            return
+        limite = agora - self.janela_repeticao
+        self._vistos = {chave: t for chave, t in self._vistos.items() if t > limite}
+        self._ultima_limpeza = agora
+
+    def registrar(self, base_id: str, motorista_id: str, status: str) -> bool:
+        """
+        Registra um status recebido.
+
+        Returns:
+            True se deve notificar; False se é repetição dentro da janela
+        """
+        chave = (base_id, motorista_id, status)
+        agora = time.monotonic()
+        with self._lock:
+            self.status_recebidos += 1
+            self._limpar_vistos(agora)
+            anterior = self._vistos.get(chave)
+            if anterior is not None and agora - anterior < self.janela_repeticao:
+                self.status_repetidos += 1
+                return False
+            self._vistos[chave] = agora
+            return True
+
+    def cancelar(self, base_id: str, motorista_id: str, status: str):
+        """
+        Desfaz registrar() quando o envio falhou (leitura do token ou push),
+        para que a retentativa da fila ou do app dentro da janela não seja descartada.
+        """
+        with self._lock:
+            self._vistos.pop((base_id, motorista_id, status), None)
+
+    def notificar_admins(self, base_id: str, evento: Dict[str, Any], enviar: EnviarDigest):
+        """
+        Envia um aviso aos admins da base e só retorna depois que ele saiu.
+
+        Sem envio em andamento para a base, enviar(base_id, [evento]) é chamado na hora.
+        Com um envio em andamento, o aviso entra no próximo lote da base; quando o envio atual termina,
+        a primeira chamada que acordar envia o lote inteiro de uma vez e as demais recebem o resultado.
+
+        Raises:
+            A exceção de enviar(), em todas as chamadas cujo aviso estava no lote que falhou
+        """
+        with self._envio_concluido:
+            self.avisos_admin += 1
+            lote = self._proximos.get(base_id)
+            if lote is None:
+                lote = self._proximos[base_id] = _LoteAdmin()
+            lote.eventos.append(evento)
+            # Enquanto o lote não sai, ele continua em _proximos; quem o envia tira de lá e ocupa a base
+            while base_id in self._em_envio and not lote.finalizado:
+                self._envio_concluido.wait()
+            if not lote.finalizado:
+                del self._proximos[base_id]
+                self._em_envio.add(base_id)
+                self.digests_enviados += 1
+                enviar_agora = True
+            else:
+                enviar_agora = False
+
+        if enviar_agora:
+            try:
+                enviar(base_id, list(lote.eventos))
+            except Exception as e:
+                lote.erro = e
+            with self._envio_concluido:
+                lote.finalizado = True
+                self._em_envio.discard(base_id)
+                self._envio_concluido.notify_all()
+
+        if lote.erro is not None:
+            raise lote.erro
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "janela_repeticao_s": self.janela_repeticao,
+                "status_recebidos": self.status_recebidos,
+                "status_repetidos": self.status_repetidos,
+                "avisos_admin": self.avisos_admin,
+                "digests_enviados": self.digests_enviados,
+                "bases_enviando_aviso": len(self._em_envio),
+                "avisos_aguardando": sum(len(lote.eventos) for lote in self._proximos.values()),
+            }
@@ -0,0 +1,259 @@
+"""
+Testes dos backends de cache compartilhado (cache_backends.py).
+
+O RedisCacheBackend é exercitado contra um servidor RESP falso em memória (thread local),
+sem precisar de um Redis de verdade.
+
+Rodar na pasta backend-python:
+    python -m unittest discover -s tests
+"""
+
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from fnmatch import fnmatchcase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_backends import CacheCompartilhado, ErroRedis, RedisCacheBackend, SQLiteCacheBackend  # noqa: E402
+
+
+class _RedisFalso(socketserver.ThreadingTCPServer):
+    """Servidor RESP mínimo: AUTH, SELECT, GET, SET [PX], DEL e SCAN (devolve tudo de uma vez)."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, senha=None):
+        super().__init__(('127.0.0.1', 0), _SessaoRedis)
+        self.senha = senha
+        self.dados = {}  # chave -> (valor, vence_em ou None)
+        self.comandos = []
+        self.conexoes = 0
+        self.sessoes = []
+        self._lock = threading.Lock()
+
+    def derrubar_conexoes(self):
+        """Fecha do lado do servidor as conexões abertas (como um restart do Redis)."""
+        with self._lock:
+            sessoes, self.sessoes = self.sessoes, []
+        for sessao in sessoes:
+            try:
+                sessao.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def valor(self, chave):
+        valor, vence_em = self.dados.get(chave, (None, None))
+        if vence_em is not None and time.time() >= vence_em:
+            self.dados.pop(chave, None)
+            return None
+        return valor
+
+
+class _SessaoRedis(socketserver.StreamRequestHandler):
+
+    def _ler_comando(self):
+        linha = self.rfile.readline()
+        if not linha:
+            return None
+        args = []
+        for _ in range(int(linha[1:-2])):
+            tamanho = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(tamanho + 2)[:-2].decode('utf-8'))
+        return args
+
+    def _bulk(self, valor):
+        if valor is None:
+            return b"$-1\r\n"
+        dados = valor.encode('utf-8')
+        return f"${len(dados)}\r\n".encode() + dados + b"\r\n"
+
+    def handle(self):
+        servidor = self.server
+        with servidor._lock:
+            servidor.conexoes += 1
+            servidor.sessoes.append(self.connection)
+        autenticado = servidor.senha is None
+        while True:
+            args = self._ler_comando()
+            if args is None:
+                return
+            nome = args[0].upper()
+            with servidor._lock:
+                servidor.comandos.append(nome)
+                if nome == 'AUTH':
+                    autenticado = args[-1] == servidor.senha
+                    resposta = b"+OK\r\n" if autenticado else b"-WRONGPASS invalid username-password pair\r\n"
+                elif not autenticado:
+                    resposta = b"-NOAUTH Authentication required.\r\n"
+                elif nome == 'SELECT':
+                    resposta = b"+OK\r\n"
+                elif nome == 'GET':
+                    resposta = self._bulk(servidor.valor(args[1]))
+                elif nome == 'SET':
+                    vence_em = time.time() + int(args[4]) / 1000.0 if len(args) > 4 and args[3].upper() == 'PX' else None
+                    servidor.dados[args[1]] = (args[2], vence_em)
+                    resposta = b"+OK\r\n"
+                elif nome == 'DEL':
+                    apagadas = sum(1 for chave in args[1:] if servidor.dados.pop(chave, None) is not None)
+                    resposta = f":{apagadas}\r\n".encode()
+                elif nome == 'SCAN':
+                    padrao = args[args.index('MATCH') + 1] if 'MATCH' in args else '*'
+                    chaves = [c for c in list(servidor.dados) if servidor.valor(c) is not None and fnmatchcase(c, padrao)]
+                    resposta = b"*2\r\n" + self._bulk('0') + f"*{len(chaves)}\r\n".encode()
+                    resposta += b"".join(self._bulk(c) for c in chaves)
+                else:
+                    resposta = f"-ERR unknown command '{nome}'\r\n".encode()
+            self.wfile.write(resposta)
+            self.wfile.flush()
+
+
+class _CasosDoCache:
+    """Casos comuns aos dois backends (self.backend é criado em setUp)."""
+
+    def _cache(self, ttl_segundos=60.0, **kwargs):
+        return CacheCompartilhado(self.backend, 'teste', ttl_segundos, **kwargs)
+
+    def test_grava_e_le_chave_em_tupla(self):
+        cache = self._cache()
+        cache.set(('uid1', 'base1'), {'papel': 'admin', 'bases': ['a', 'b']})
+        self.assertEqual(cache.get(('uid1', 'base1')), {'papel': 'admin', 'bases': ['a', 'b']})
+        self.assertIsNone(cache.get(('uid1', 'outra')))
+        self.assertEqual(cache.stats()['acertos'], 1)
+        self.assertEqual(cache.stats()['faltas'], 1)
+
+    def test_none_gravado_e_diferente_de_ausente(self):
+        cache = self._cache()
+        cache.set('negada', None)
+        self.assertTrue(cache.contem('negada'))
+        self.assertFalse(cache.contem('nunca_gravada'))
+
+    def test_entrada_expira(self):
+        cache = self._cache()
+        cache.set('curta', 'valor', ttl_segundos=0.05)
+        self.assertEqual(cache.get('curta'), 'valor')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('curta'))
+
+    def test_backend_remove_entrada_vencida(self):
+        self.backend.gravar('raiz:teste:"direta"', 'x', 0.05)
+        self.assertEqual(self.backend.ler('raiz:teste:"direta"'), 'x')
+        time.sleep(0.1)
+        self.assertIsNone(self.backend.ler('raiz:teste:"direta"'))
+
+    def test_obsoleto_dentro_da_janela(self):
+        cache = self._cache(janela_obsoleta=5.0)
+        cache.set('swr', 42, ttl_segundos=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('swr'))
+        self.assertEqual(cache.get_com_validade('swr'), (42, False))
+
+    def test_invalidar_onde_e_limpar(self):
+        cache = self._cache()
+        cache.set(('u1', 'b1'), 'admin')
+        cache.set(('u1', 'b2'), 'admin')
+        cache.set(('u2', 'b1'), 'motorista')
+        self.assertEqual(cache.invalidar_onde(lambda chave: chave[0] == 'u1'), 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get(('u2', 'b1')), 'motorista')
+        cache.limpar()
+        self.assertEqual(len(cache), 0)
+
+    def test_namespaces_separados(self):
+        a = CacheCompartilhado(self.backend, 'a', 60.0)
+        b = CacheCompartilhado(self.backend, 'b', 60.0)
+        a.set('chave', 1)
+        b.set('chave', 2)
+        a.limpar()
+        self.assertIsNone(a.get('chave'))
+        self.assertEqual(b.get('chave'), 2)
+
+    def test_valor_corrompido_conta_como_falta(self):
+        cache = self._cache()
+        self.backend.gravar(cache._chave('ruim'), 'não é json', 60)
+        self.backend.gravar(cache._chave('sem_envelope'), '[1, 2]', 60)
+        self.assertEqual(cache.get('ruim', 'padrao'), 'padrao')
+        self.assertEqual(cache.get('sem_envelope', 'padrao'), 'padrao')
+        self.assertEqual(cache.stats()['erros'], 0)
+
+
+class TestSQLiteCacheBackend(_CasosDoCache, unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.TemporaryDirectory()
+        self.backend = SQLiteCacheBackend(os.path.join(self.pasta.name, 'cache.db'))
+
+    def tearDown(self):
+        self.pasta.cleanup()
+
+    def test_compartilhado_entre_instancias(self):
+        outro = SQLiteCacheBackend(self.backend.db_path)
+        CacheCompartilhado(self.backend, 'teste', 60.0).set('chave', 'valor')
+        self.assertEqual(CacheCompartilhado(outro, 'teste', 60.0).get('chave'), 'valor')
+
+
+class TestRedisCacheBackend(_CasosDoCache, unittest.TestCase):
+
+    SENHA = 's3nha'
+
+    def setUp(self):
+        self.servidor = _RedisFalso(senha=self.SENHA)
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        porta = self.servidor.server_address[1]
+        self.backend = RedisCacheBackend(f"redis://:{self.SENHA}@127.0.0.1:{porta}/2", timeout=2.0)
+
+    def tearDown(self):
+        self.backend._fechar()
+        if self.servidor is not None:
+            self.servidor.shutdown()
+            self.servidor.server_close()
+
+    def test_autentica_e_seleciona_o_db_uma_vez_por_conexao(self):
+        self.backend.gravar('k', 'v', 60)
+        self.backend.ler('k')
+        self.assertEqual(self.servidor.comandos[:2], ['AUTH', 'SELECT'])
+        self.assertEqual(self.servidor.comandos.count('AUTH'), 1)
+        self.assertEqual(self.servidor.conexoes, 1)
+
+    def test_auth_recusado_nao_guarda_conexao(self):
+        porta = self.servidor.server_address[1]
+        errado = RedisCacheBackend(f"redis://:errada@127.0.0.1:{porta}/0", timeout=2.0)
+        with self.assertRaises(ErroRedis):
+            errado.ler('k')
+        self.assertIsNone(getattr(errado._local, 'conexao', None))
+
+    def test_auth_recusado_vira_falta_e_suspende(self):
+        porta = self.servidor.server_address[1]
+        cache = CacheCompartilhado(RedisCacheBackend(f"redis://:errada@127.0.0.1:{porta}/0"), 'teste', 60.0)
+        self.assertEqual(cache.get('k', 'padrao'), 'padrao')
+        stats = cache.stats()
+        self.assertEqual(stats['erros'], 1)
+        self.assertTrue(stats['suspenso'])
+        chamadas = len(self.servidor.comandos)
+        cache.get('k')  # suspenso: nem tenta conectar
+        self.assertEqual(len(self.servidor.comandos), chamadas)
+
+    def test_reconecta_quando_a_conexao_cai(self):
+        self.backend.gravar('k', 'v', 60)
+        self.servidor.derrubar_conexoes()
+        self.assertEqual(self.backend.ler('k'), 'v')
+        self.assertEqual(self.servidor.conexoes, 2)
+
+    def test_servidor_fora_do_ar_vira_falta(self):
+        porta = self.servidor.server_address[1]
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        self.servidor = None
+        cache = CacheCompartilhado(RedisCacheBackend(f"redis://127.0.0.1:{porta}/0", timeout=0.5), 'teste', 60.0)
+        self.assertEqual(cache.get('k', 'padrao'), 'padrao')
+        self.assertEqual(cache.stats()['erros'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
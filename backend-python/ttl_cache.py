@@ -0,0 +1,245 @@
+"""
+ttl_cache.py
+
+Cache em memória com expiração (TTL) e limites de entradas e de bytes (LRU), thread-safe.
+
+O tamanho de cada valor é estimado (sys.getsizeof recursivo em str/bytes/list/tuple/dict/set),
+suficiente para limitar caches de textos e listas como o contexto do assistente.
+Entradas vencidas saem no acesso e numa varredura periódica feita nas gravações.
+Com janela_obsoleta, a entrada vencida ainda fica disponível por esse tempo em get_com_validade()
+(stale-while-revalidate: o chamador usa o valor antigo enquanto recarrega em background).
+
+SingleFlight junta recargas simultâneas da mesma chave numa só execução.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+_AUSENTE = object()
+
+
+def tamanho_aproximado(valor: Any) -> int:
+    """Bytes ocupados por valor e pelo que ele contém (estimativa)."""
+    tamanho = sys.getsizeof(valor)
+    if isinstance(valor, dict):
+        tamanho += sum(tamanho_aproximado(k) + tamanho_aproximado(v) for k, v in valor.items())
+    elif isinstance(valor, (list, tuple, set, frozenset)):
+        tamanho += sum(tamanho_aproximado(v) for v in valor)
+    return tamanho
+
+
+class TTLCache:
+    """
+    Dicionário com TTL por item, no máximo max_itens entradas e (opcional) max_bytes
+    (ao passar de um limite, sai a usada há mais tempo).
+    """
+
+    def __init__(
+        self,
+        max_itens: int,
+        ttl_segundos: float,
+        max_bytes: Optional[int] = None,
+        janela_obsoleta: float = 0.0
+    ):
+        """
+        Args:
+            max_itens: Entradas mantidas no máximo
+            ttl_segundos: Validade padrão de cada entrada
+            max_bytes: Bytes estimados (chaves + valores) mantidos no máximo (None = sem limite)
+            janela_obsoleta: Segundos após vencer em que a entrada ainda é devolvida por get_com_validade()
+        """
+        self.max_itens = max(1, max_itens)
+        self.ttl_segundos = max(0.0, ttl_segundos)
+        self.janela_obsoleta = max(0.0, janela_obsoleta)
+        self.max_bytes = max(0, max_bytes) if max_bytes is not None else None
+        self._itens: "OrderedDict[Hashable, Tuple[float, Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        # Varredura de vencidos: no máximo uma por intervalo, feita dentro de set()
+        self._intervalo_varredura = min(60.0, max(1.0, self.ttl_segundos))
+        self._proxima_varredura = time.monotonic() + self._intervalo_varredura
+
+        self.acertos = 0
+        self.faltas = 0
+        self.expirados = 0
+        self.despejados = 0
+        self.invalidados = 0
+        self.rejeitados = 0  # maiores que max_bytes sozinhos
+        self.obsoletos = 0  # vencidos entregues por get_com_validade
+
+    def get(self, chave: Hashable, padrao: Any = None) -> Any:
+        """Valor da chave, ou padrao se ausente/expirado."""
+        valor, fresco = self._consultar(chave, padrao, aceitar_obsoleto=False)
+        return valor
+
+    def get_com_validade(self, chave: Hashable, padrao: Any = None) -> Tuple[Any, bool]:
+        """
+        Returns:
+            (valor, fresco): valor vencido há menos de janela_obsoleta volta com fresco=False;
+            ausente volta (padrao, False)
+        """
+        return self._consultar(chave, padrao, aceitar_obsoleto=True)
+
+    def _consultar(self, chave: Hashable, padrao: Any, aceitar_obsoleto: bool) -> Tuple[Any, bool]:
+        with self._lock:
+            item = self._itens.get(chave, _AUSENTE)
+            if item is _AUSENTE:
+                self.faltas += 1
+                return padrao, False
+            expira_em, valor, _ = item
+            agora = time.monotonic()
+            if agora >= expira_em:
+                if agora >= expira_em + self.janela_obsoleta:
+                    self._remover(chave)
+                    self.expirados += 1
+                    self.faltas += 1
+                    return padrao, False
+                if not aceitar_obsoleto:
+                    self.faltas += 1
+                    return padrao, False
+                self.obsoletos += 1
+                return valor, False
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return valor, True
+
+    def _remover(self, chave: Hashable) -> bool:
+        item = self._itens.pop(chave, _AUSENTE)
+        if item is _AUSENTE:
+            return False
+        self._bytes -= item[2]
+        return True
+
+    def _varrer_expirados(self, agora: float):
+        if agora < self._proxima_varredura:
+            return
+        self._proxima_varredura = agora + self._intervalo_varredura
+        limite = agora - self.janela_obsoleta
+        for chave in [c for c, (expira_em, _, _) in self._itens.items() if limite >= expira_em]:
+            self._remover(chave)
+            self.expirados += 1
+
+    def contem(self, chave: Hashable) -> bool:
+        return self.get(chave, _AUSENTE) is not _AUSENTE
+
+    def set(self, chave: Hashable, valor: Any, ttl_segundos: Optional[float] = None):
+        """Grava a chave com TTL próprio (ou o padrão do cache)."""
+        ttl = self.ttl_segundos if ttl_segundos is None else max(0.0, ttl_segundos)
+        tamanho = tamanho_aproximado(chave) + tamanho_aproximado(valor)
+        with self._lock:
+            agora = time.monotonic()
+            self._remover(chave)
+            if self.max_bytes is not None and tamanho > self.max_bytes:
+                self.rejeitados += 1
+                return
+            self._itens[chave] = (agora + ttl, valor, tamanho)
+            self._bytes += tamanho
+            self._varrer_expirados(agora)
+            while len(self._itens) > self.max_itens or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remover(next(iter(self._itens)))
+                self.despejados += 1
+
+    def obter_ou_calcular(self, chave: Hashable, calcular: Callable[[], Any], ttl_segundos: Optional[float] = None) -> Any:
+        """Valor em cache ou calcular() (gravado no cache). Chamadas simultâneas podem calcular em paralelo."""
+        valor = self.get(chave, _AUSENTE)
+        if valor is _AUSENTE:
+            valor = calcular()
+            self.set(chave, valor, ttl_segundos)
+        return valor
+
+    def invalidar(self, chave: Hashable) -> bool:
+        with self._lock:
+            if not self._remover(chave):
+                return False
+            self.invalidados += 1
+            return True
+
+    def invalidar_onde(self, condicao: Callable[[Hashable], bool]) -> int:
+        """Remove as chaves para as quais condicao(chave) é True. Returns: quantidade removida."""
+        with self._lock:
+            chaves = [c for c in self._itens if condicao(c)]
+            for chave in chaves:
+                self._remover(chave)
+            self.invalidados += len(chaves)
+            return len(chaves)
+
+    def limpar(self):
+        with self._lock:
+            self.invalidados += len(self._itens)
+            self._itens.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._itens)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            consultas = self.acertos + self.faltas
+            return {
+                "itens": len(self._itens),
+                "max_itens": self.max_itens,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_segundos,
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "taxa_acerto": round(self.acertos / consultas, 3) if consultas else None,
+                "expirados": self.expirados,
+                "despejados": self.despejados,
+                "invalidados": self.invalidados,
+                "rejeitados": self.rejeitados,
+                "janela_obsoleta_s": self.janela_obsoleta,
+                "obsoletos_servidos": self.obsoletos,
+            }
+
+
+class SingleFlight:
+    """
+    Uma execução em andamento por chave: quem pede a mesma chave enquanto ela roda
+    recebe o mesmo Future, em vez de repetir o trabalho.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._em_andamento: Dict[Hashable, Future] = {}
+        self.execucoes = 0
+        self.coalescidas = 0
+
+    def submeter(self, chave: Hashable, executor: Executor, funcao: Callable[[], Any]) -> Tuple[Future, bool]:
+        """
+        Returns:
+            (future, novo): novo=False quando a chave já estava em andamento
+        """
+        with self._lock:
+            futuro = self._em_andamento.get(chave)
+            if futuro is not None:
+                self.coalescidas += 1
+                return futuro, False
+            futuro = executor.submit(funcao)
+            self._em_andamento[chave] = futuro
+            self.execucoes += 1
+        futuro.add_done_callback(lambda _f: self._concluir(chave, _f))
+        return futuro, True
+
+    def _concluir(self, chave: Hashable, futuro: Future):
+        with self._lock:
+            if self._em_andamento.get(chave) is futuro:
+                del self._em_andamento[chave]
+
+    def em_andamento(self, chave: Hashable) -> bool:
+        with self._lock:
+            return chave in self._em_andamento
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "em_andamento": len(self._em_andamento),
+                "execucoes": self.execucoes,
+                "coalescidas": self.coalescidas,
+            }